@@ -1,6 +1,10 @@
+import time
+_import_start = time.time()
+
 import socket
+import threading
 from krpc.connection import Connection
-from krpc.client import Client
+from krpc.client import Client, HIGH_PRIORITY, NORMAL_PRIORITY, LOW_PRIORITY
 from krpc.encoder import Encoder
 from krpc.decoder import Decoder
 
@@ -10,31 +14,157 @@ DEFAULT_ADDRESS = '127.0.0.1'
 DEFAULT_RPC_PORT = 50000
 DEFAULT_STREAM_PORT = 50001
 
-def connect(address=DEFAULT_ADDRESS, rpc_port=DEFAULT_RPC_PORT, stream_port=DEFAULT_STREAM_PORT, name=None):
+# Seconds spent importing the package, and on each step of the most recent connect
+_startup_profile = {'import': time.time() - _import_start}
+
+def connect(address=DEFAULT_ADDRESS, rpc_port=DEFAULT_RPC_PORT, stream_port=DEFAULT_STREAM_PORT, name=None,
+            rpc_connections=1, reader_thread=False, property_cache=True, schema_cache=False,
+            high_priority_connection=False):
     """
     Connect to a kRPC server on the specified IP address and port numbers. If
     stream_port is None, does not connect to the stream server.
     Optionally give the kRPC server the supplied name to identify the client (up
     to 32 bytes of UTF-8 encoded text).
+    If rpc_connections is greater than 1, opens that many connections to the RPC
+    server. Calls made by different threads are sent on whichever connection is
+    least busy, so that they do not wait for each other. The server sees each
+    connection as a separate client with the same name. Streams are added using
+    the first connection.
+    If high_priority_connection is True, opens another connection to the RPC server
+    that is only used for requests with HIGH_PRIORITY (see Client.set_priority), so
+    that they are not run after requests already sent on the other connections.
+    If reader_thread is True, each RPC connection has a thread that receives
+    responses and hands them to the threads waiting for them. Otherwise, the
+    responses are received by whichever waiting thread gets to them first.
+    If property_cache is True, properties that do not change during a flight, listed
+    in krpc.cache.DEFAULT_POLICIES, are only fetched from the server once, or once
+    per stage for properties of parts and engines.
+    If schema_cache is True, or the path of a directory, the description of the
+    server's services is stored on disk (in krpc.schemacache.DEFAULT_DIRECTORY by
+    default) and reused when connecting to the same server and version again.
+    """
+    if rpc_connections < 1:
+        raise ValueError('rpc_connections must be at least 1')
+    start = time.time()
+    assert rpc_port != stream_port
+    rpc_connection, client_identifier = _connect_rpc(address, rpc_port, name)
+    # The stream handshake is done while the client fetches the services
+    stream_handshake = None
+    if stream_port is not None:
+        stream_handshake = _StreamHandshake(address, stream_port, client_identifier)
+    extra_rpc_connections = []
+    high_priority_rpc_connection = None
+    try:
+        for _ in range(rpc_connections-1):
+            extra_rpc_connections.append(_connect_rpc(address, rpc_port, name)[0])
+        if high_priority_connection:
+            high_priority_rpc_connection = _connect_rpc(address, rpc_port, name)[0]
+    except:
+        for connection in [rpc_connection] + extra_rpc_connections:
+            connection.close()
+        if stream_handshake is not None:
+            stream_handshake.close()
+        raise
+    rpc_handshake = time.time() - start
+    client = Client(rpc_connection, None, extra_rpc_connections, reader_thread, property_cache,
+                    schema_cache, stream_handshake, high_priority_rpc_connection)
+    profile = {'import': _startup_profile['import'], 'rpc_handshake': rpc_handshake,
+               'total': time.time() - start}
+    if stream_handshake is not None:
+        profile['stream_handshake'] = stream_handshake.duration
+    profile.update(client._startup_profile)
+    _startup_profile.clear()
+    _startup_profile.update(profile)
+    return client
+
+def startup_profile():
     """
+    Return the number of seconds spent importing the krpc package, and on each step
+    of the most recent call to connect, as a dictionary with the keys:
+    import: importing the krpc package. The protobuf runtime and the other modules
+    only needed once connected are imported by connect.
+    rpc_handshake: connecting to the RPC server.
+    stream_handshake: connecting to the stream server, which is done in the
+    background while the services are fetched.
+    stream_handshake_wait: waiting for the stream handshake to finish.
+    message_types: loading the protobuf message classes, on the first connect.
+    schema_fetch: fetching the description of the server's services.
+    service_build: creating the services. Each service's members are added
+    when it is first used, which is not included.
+    total: the whole call to connect.
+    The keys of steps that connect has not done are missing, for example if it
+    has not been called.
+    """
+    return dict(_startup_profile)
+
+def _connect(address, rpc_port, stream_port, name):
+    """ Connect to the RPC and stream servers, and perform the handshakes.
+        Returns the (rpc_connection, stream_connection) """
     assert rpc_port != stream_port
 
     # Connect to RPC server
+    rpc_connection, client_identifier = _connect_rpc(address, rpc_port, name)
+
+    # Connect to Stream server
+    if stream_port is not None:
+        stream_connection = _connect_stream(address, stream_port, client_identifier)
+    else:
+        stream_connection = None
+
+    return rpc_connection, stream_connection
+
+def _connect_rpc(address, rpc_port, name):
+    """ Connect to the RPC server, and perform the handshake.
+        Returns the (rpc_connection, client_identifier) """
     rpc_connection = Connection(address, rpc_port)
     rpc_connection.connect(retries=10, timeout=0.1)
     rpc_connection.send(Encoder.RPC_HELLO_MESSAGE)
     rpc_connection.send(Encoder.client_name(name))
     client_identifier = rpc_connection.receive(Decoder.GUID_LENGTH)
+    return rpc_connection, client_identifier
 
-    # Connect to Stream server
-    if stream_port is not None:
-        stream_connection = Connection(address, stream_port)
-        stream_connection.connect(retries=10, timeout=0.1)
-        stream_connection.send(Encoder.STREAM_HELLO_MESSAGE)
-        stream_connection.send(client_identifier)
-        ok_message = stream_connection.receive(Decoder.OK_LENGTH)
-        assert ok_message == Decoder.OK_MESSAGE
-    else:
-        stream_connection = None
+def _connect_stream(address, stream_port, client_identifier):
+    """ Connect to the stream server, and perform the handshake.
+        Returns the stream_connection """
+    stream_connection = Connection(address, stream_port)
+    stream_connection.connect(retries=10, timeout=0.1)
+    stream_connection.send(Encoder.STREAM_HELLO_MESSAGE)
+    stream_connection.send(client_identifier)
+    ok_message = stream_connection.receive(Decoder.OK_LENGTH)
+    assert ok_message == Decoder.OK_MESSAGE
+    return stream_connection
+
+class _StreamHandshake(object):
+    """ Connects to the stream server and performs the handshake in a background thread """
+
+    def __init__(self, address, stream_port, client_identifier):
+        self._connection = None
+        self._error = None
+        # Seconds the handshake took
+        self.duration = None
+        self._thread = threading.Thread(target=self._run, args=(address, stream_port, client_identifier))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self, address, stream_port, client_identifier):
+        start = time.time()
+        try:
+            self._connection = _connect_stream(address, stream_port, client_identifier)
+        except Exception as e:
+            self._error = e
+        self.duration = time.time() - start
+
+    def result(self):
+        """ Wait for the handshake to finish, and return the stream connection,
+            or raise the error it failed with """
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+        return self._connection
 
-    return Client(rpc_connection, stream_connection)
+    def close(self):
+        """ Wait for the handshake to finish, and close the stream connection if it
+            succeeded. Called when the rest of connect fails. """
+        self._thread.join()
+        if self._connection is not None:
+            self._connection.close()
@@ -0,0 +1,250 @@
+"""
+Single threaded asynchronous kRPC client.
+
+Coroutines are generators that yield Futures. Procedure calls and property gets
+made through a client returned by krpc.aio.connect return a Future, and a coroutine
+receives its result by yielding it:
+
+    def guidance(conn, loop):
+        vessel = yield conn.space_center.active_vessel
+        while True:
+            altitude = yield vessel.flight().mean_altitude
+            ...
+            yield loop.sleep(0.1)
+
+    conn = krpc.aio.connect()
+    loop = krpc.aio.EventLoop(conn)
+    loop.spawn(guidance(conn, loop))
+    loop.spawn(logger(conn, loop))
+    loop.run_forever()
+
+All coroutines share one connection, and many requests can be in flight at once.
+Responses and stream updates are received by the event loop, so no threads are used.
+A coroutine returns a value by raising Return(value), and can wait for another
+coroutine by yielding it.
+"""
+
+import select
+import time
+import heapq
+import inspect
+from collections import deque
+import krpc
+import krpc.client
+import krpc.stream
+from krpc.future import Future
+
+class Return(Exception):
+    """ Raised by a coroutine to return a value """
+    def __init__(self, value=None):
+        super(Return, self).__init__(value)
+        self.value = value
+
+def connect(address=krpc.DEFAULT_ADDRESS, rpc_port=krpc.DEFAULT_RPC_PORT,
+            stream_port=krpc.DEFAULT_STREAM_PORT, name=None):
+    """ Connect to a kRPC server, and return a client for use from coroutines.
+        Takes the same arguments as krpc.connect. """
+    rpc_connection, stream_connection = krpc._connect(address, rpc_port, stream_port, name)
+    return Client(rpc_connection, stream_connection)
+
+class Client(krpc.client.Client):
+    """ A kRPC client whose procedure calls and property gets return Futures
+        instead of blocking. Stream updates are received by the EventLoop
+        running the client, rather than by a separate thread. """
+
+    _return_futures = True
+
+    def _start_stream_thread(self):
+        pass
+
+    def add_stream(self, func, *args, **kwargs):
+        """ Create a stream, and return a Future for it """
+        if self._stream_connection is None:
+            raise RuntimeError('Not connected to stream server')
+        if func == setattr:
+            raise ValueError('Cannot stream a property setter')
+        request, return_type = self._build_call(func, *args, **kwargs)
+        value = self._submit_request(request, return_type)
+        stream_id = self.krpc.add_stream(request)
+        future = Future()
+        def added(stream_id):
+            # value has completed, as responses arrive in the order requests were sent
+            try:
+                args = (self, stream_id.result(), request, return_type, value.result())
+            except Exception as e:
+                future.set_exception(e)
+                return
+            with krpc.stream._stream_cache_lock:
+                stream = krpc.stream._add_to_cache(*args)
+                stream._auto = False
+                future.set_result(stream)
+        stream_id.add_done_callback(added)
+        return future
+
+    def _process_stream_messages(self):
+        """ Process any stream messages that have already been received, without blocking """
+        while True:
+            data = self._stream_connection.poll_message()
+            if data is None:
+                break
+            krpc.stream.process_message(data)
+
+class StreamUpdates(object):
+    """ Waits for updates to a stream. next() returns a Future for the next
+        value received by the stream. Values received while nothing is waiting
+        are skipped, in the same way that calling a stream returns only its
+        most recent value. """
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._future = None
+        stream.add_callback(self._update)
+
+    def next(self):
+        """ Return a Future for the next value received by the stream """
+        if self._future is None:
+            self._future = Future()
+        return self._future
+
+    def close(self):
+        """ Stop waiting for updates to the stream """
+        self._stream.remove_callback(self._update)
+
+    def _update(self, value):
+        future = self._future
+        if future is not None:
+            self._future = None
+            if isinstance(value, Exception):
+                future.set_exception(value)
+            else:
+                future.set_result(value)
+
+def updates(stream):
+    """ Return a StreamUpdates object for waiting on updates to a stream """
+    return StreamUpdates(stream)
+
+class Task(Future):
+    """ A coroutine scheduled to run on an event loop. Completes with the
+        value returned by the coroutine. """
+
+    def __init__(self, loop, coroutine):
+        super(Task, self).__init__()
+        self._loop = loop
+        self._coroutine = coroutine
+        loop._call_soon(self._step, None, None)
+
+    def _step(self, value, exception):
+        """ Run the coroutine until it yields or returns """
+        try:
+            if exception is not None:
+                yielded = self._coroutine.throw(exception)
+            else:
+                yielded = self._coroutine.send(value)
+        except StopIteration:
+            self.set_result(None)
+            return
+        except Return as e:
+            self.set_result(e.value)
+            return
+        except Exception as e:
+            self.set_exception(e)
+            return
+        if yielded is None:
+            # Give other coroutines a chance to run
+            self._loop._call_soon(self._step, None, None)
+            return
+        try:
+            future = self._loop._as_future(yielded)
+        except TypeError as e:
+            self._loop._call_soon(self._step, None, e)
+            return
+        future.add_done_callback(self._wakeup)
+
+    def _wakeup(self, future):
+        self._loop._call_soon(self._resume, future)
+
+    def _resume(self, future):
+        try:
+            value = future.result()
+        except Exception as e:
+            self._step(None, e)
+            return
+        self._step(value, None)
+
+class EventLoop(object):
+    """ Runs coroutines that make RPCs using an asynchronous client """
+
+    def __init__(self, client):
+        self._client = client
+        self._ready = deque()
+        self._timers = []
+        self._timer_count = 0
+        self._stopped = False
+
+    def spawn(self, coroutine):
+        """ Schedule a coroutine to run, and return a Task for its result """
+        return Task(self, coroutine)
+
+    def sleep(self, seconds):
+        """ Return a Future that completes after the given number of seconds """
+        future = Future()
+        self._timer_count += 1
+        heapq.heappush(self._timers, (time.time() + seconds, self._timer_count, future))
+        return future
+
+    def run_until_complete(self, coroutine):
+        """ Run the event loop until the given coroutine or Future completes,
+            and return its result """
+        future = self._as_future(coroutine)
+        while not future.done():
+            self._run_once()
+        return future.result()
+
+    def run_forever(self):
+        """ Run the event loop until stop() is called """
+        self._stopped = False
+        while not self._stopped:
+            self._run_once()
+
+    def stop(self):
+        """ Stop the event loop after the current iteration """
+        self._stopped = True
+
+    def _call_soon(self, callback, *args):
+        self._ready.append((callback, args))
+
+    def _as_future(self, value):
+        if isinstance(value, Future):
+            return value
+        if inspect.isgenerator(value):
+            return self.spawn(value)
+        raise TypeError('Coroutine yielded %s, expected a Future or a coroutine' % repr(value))
+
+    def _run_once(self):
+        """ Wait for responses, stream updates or timers, then run the ready callbacks """
+        client = self._client
+        rpc_connections = [channel.connection for channel in client._rpc_channels]
+        connections = list(rpc_connections)
+        if client._stream_connection is not None:
+            connections.append(client._stream_connection)
+        # Messages already received into a connection's buffer are not seen by select
+        buffered = [connection for connection in connections if connection.has_message()]
+        timeout = None
+        if len(self._ready) > 0 or self._stopped or len(buffered) > 0:
+            timeout = 0
+        elif len(self._timers) > 0:
+            timeout = max(0, self._timers[0][0] - time.time())
+        ready, _, _ = select.select(connections, [], [], timeout)
+        ready.extend(buffered)
+
+        if any(connection in ready for connection in rpc_connections):
+            client._process_responses()
+        if client._stream_connection in ready:
+            client._process_stream_messages()
+        now = time.time()
+        while len(self._timers) > 0 and self._timers[0][0] <= now:
+            heapq.heappop(self._timers)[2].set_result(None)
+
+        for _ in range(len(self._ready)):
+            callback, args = self._ready.popleft()
+            callback(*args)
@@ -1,14 +1,14 @@
-import re
-
-re_property_name = re.compile(r'^Property\.(Get|Set)\((.+)\)$')
-re_service_name_from_class_method = re.compile(r'^Class\.(Static)?Method\(([^,\.]+)\.[^,]+,[^,]+\)$')
-re_service_name_from_class_property = re.compile(r'^Class\.Property.(Get|Set)\(([^,\.]+)\.[^,]+,[^,]+\)$')
-re_class_name_from_class_method = re.compile(r'^Class\.(Static)?Method\([^,\.]+\.([^,\.]+),[^,]+\)$')
-re_class_name_from_class_property = re.compile(r'^Class\.Property.(Get|Set)\([^,\.]+\.([^,]+),[^,]+\)$')
-re_class_method_name = re.compile(r'^Class\.(Static)?Method\([^,]+,([^,]+)\)$')
-re_class_property_name = re.compile(r'^Class\.Property\.(Get|Set)\([^,]+,([^,]+)\)$')
-re_return_type = re.compile(r'^ReturnType\.(.+)$')
-re_parameter_type = re.compile(r'^ParameterType\((\d+)\)\.(.+)$')
+from krpc.utils import LazyPattern
+
+re_property_name = LazyPattern(r'^Property\.(Get|Set)\((.+)\)$')
+re_service_name_from_class_method = LazyPattern(r'^Class\.(Static)?Method\(([^,\.]+)\.[^,]+,[^,]+\)$')
+re_service_name_from_class_property = LazyPattern(r'^Class\.Property.(Get|Set)\(([^,\.]+)\.[^,]+,[^,]+\)$')
+re_class_name_from_class_method = LazyPattern(r'^Class\.(Static)?Method\([^,\.]+\.([^,\.]+),[^,]+\)$')
+re_class_name_from_class_property = LazyPattern(r'^Class\.Property.(Get|Set)\([^,\.]+\.([^,]+),[^,]+\)$')
+re_class_method_name = LazyPattern(r'^Class\.(Static)?Method\([^,]+,([^,]+)\)$')
+re_class_property_name = LazyPattern(r'^Class\.Property\.(Get|Set)\([^,]+,([^,]+)\)$')
+re_return_type = LazyPattern(r'^ReturnType\.(.+)$')
+re_parameter_type = LazyPattern(r'^ParameterType\((\d+)\)\.(.+)$')
 
 class Attributes(object):
     """ Methods for extracting information from procedure attributes """
@@ -0,0 +1,170 @@
+from collections import deque
+import threading
+import time
+from krpc.decoder import Decoder
+import krpc.stream
+
+# Returned by AutoStreamer.read when a getter is not served by a stream
+missing = object()
+
+class _Getter(object):
+    """ The calls made with one encoded getter request """
+
+    def __init__(self, service, procedure):
+        self.service = service
+        self.procedure = procedure
+        # Times of the calls made within the window
+        self.calls = deque()
+        self.stream = None
+        self.promoting = False
+        # Set if adding the stream failed, so it is not tried again
+        self.failed = False
+        self.last_read = None
+        # Number of reads served by the stream, instead of an RPC
+        self.reads = 0
+
+class AutoStreamer(object):
+    """ Creates streams for property getters that are called often. Once a getter
+        request is made more than threshold times within window seconds, a stream
+        is added for it and later calls return the stream's most recent value. The
+        stream is removed once it has not been read for cooldown seconds. A stream
+        that was also added with add_stream is used, but never removed. """
+
+    def __init__(self, client, threshold, window, cooldown):
+        self._client = client
+        self._threshold = threshold
+        self._window = window
+        self._cooldown = cooldown
+        # Getters, keyed by their encoded request
+        self._getters = {}
+        self._lock = threading.Lock()
+        self._timer = None
+        self._closed = False
+        # Number of streams that could not be added
+        self.failures = 0
+
+    def read(self, data):
+        """ Return the most recent value of the stream for a getter request, or
+            missing if it has no stream """
+        with self._lock:
+            getter = self._getters.get(data)
+            if getter is None or getter.stream is None:
+                return missing
+            stream = getter.stream
+        # Read the value while holding the cache lock, so the stream is not removed
+        # by the user, or by _remove_unused, in the meantime
+        with krpc.stream._stream_cache_lock:
+            removed = krpc.stream._stream_cache.get(stream._stream_id) is not stream
+            if not removed:
+                value = stream()
+        with self._lock:
+            if removed:
+                # Removed by the user, after it was shared with add_stream
+                if getter.stream is stream:
+                    getter.stream = None
+                    getter.calls.clear()
+                return missing
+            getter.last_read = time.time()
+            getter.reads += 1
+        return value
+
+    def record(self, service, procedure, data, return_type, value):
+        """ Record a call to a getter that was sent to the server, and add a stream
+            for it if it has been called often enough """
+        now = time.time()
+        with self._lock:
+            if self._closed:
+                return
+            getter = self._getters.get(data)
+            if getter is None:
+                getter = self._getters[data] = _Getter(service, procedure)
+            calls = getter.calls
+            calls.append(now)
+            while calls[0] < now - self._window:
+                calls.popleft()
+            if len(calls) <= self._threshold or getter.stream is not None or \
+               getter.promoting or getter.failed:
+                return
+            getter.promoting = True
+        try:
+            self._promote(getter, data, return_type, value)
+        except Exception:
+            # The value has already been read, so the call does not fail. The
+            # getter is no longer promoted, and keeps making RPCs.
+            with self._lock:
+                getter.failed = True
+                self.failures += 1
+        finally:
+            getter.promoting = False
+
+    def report(self):
+        """ Return a list of (service, procedure, active, reads) for the getters that
+            have had a stream, where active is true if the stream still exists and
+            reads is the number of calls it served instead of an RPC """
+        with self._lock:
+            return sorted((getter.service, getter.procedure, getter.stream is not None, getter.reads)
+                          for getter in self._getters.values()
+                          if getter.stream is not None or getter.reads > 0)
+
+    def close(self, remove_streams=True):
+        """ Stop adding streams, and remove the streams that have been added """
+        with self._lock:
+            self._closed = True
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if remove_streams:
+            self._remove_unused(None)
+
+    def _promote(self, getter, data, return_type, value):
+        client = self._client
+        request = Decoder.decode_delimited(data, client._request_type)
+        stream_id = client.krpc.add_stream(request)
+        with krpc.stream._stream_cache_lock:
+            if stream_id not in krpc.stream._stream_cache:
+                stream = krpc.stream._add_to_cache(client, stream_id, request, return_type, value)
+                stream._auto = True
+            else:
+                # Shared with a stream added with add_stream
+                stream = krpc.stream._stream_cache[stream_id]
+        with self._lock:
+            getter.stream = stream
+            getter.last_read = time.time()
+            if self._timer is None and not self._closed:
+                self._start_timer()
+
+    def _start_timer(self):
+        """ Check for unused streams after the cooldown. Called with the lock held. """
+        self._timer = threading.Timer(self._cooldown, self._check)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _check(self):
+        with self._lock:
+            self._timer = None
+        try:
+            self._remove_unused(time.time() - self._cooldown)
+        except Exception:
+            # The connection has been closed
+            return
+        with self._lock:
+            if not self._closed and any(getter.stream is not None for getter in self._getters.values()):
+                self._start_timer()
+
+    def _remove_unused(self, last_read):
+        """ Remove the streams not read since the given time, or all streams if it is None """
+        streams = []
+        with self._lock:
+            for data, getter in list(self._getters.items()):
+                if getter.stream is not None and (last_read is None or getter.last_read < last_read):
+                    streams.append(getter.stream)
+                    getter.stream = None
+                    getter.calls.clear()
+                if getter.stream is None and getter.reads == 0 and \
+                   (len(getter.calls) == 0 or getter.calls[-1] < time.time() - self._window):
+                    del self._getters[data]
+        for stream in streams:
+            with krpc.stream._stream_cache_lock:
+                # Not removed if it has been added with add_stream since it was promoted
+                if stream._auto:
+                    stream._remove()
@@ -0,0 +1,38 @@
+from krpc.future import Future
+from krpc.encoder import Encoder
+
+class Batch(object):
+    """ A group of RPCs that are queued by the client, then sent to the server in a
+        single write when the batch is closed. Calls made while a batch is open
+        return a Future instead of the result of the RPC. """
+
+    def __init__(self, client):
+        self._client = client
+        self._requests = []
+        self._futures = []
+
+    def add(self, func, *args, **kwargs):
+        """ Queue a call to a remote procedure and return a Future for its result.
+            Takes the same arguments as Client.add_stream. """
+        request, return_type = self._client._build_call(func, *args, **kwargs)
+        data = Encoder.encode_delimited(request, self._client._request_type)
+        return self._add_request(request.service, request.procedure, data, return_type)
+
+    def results(self):
+        """ Return the results of all queued RPCs, in the order they were made.
+            Blocks until the batch has been sent and all responses received. """
+        return [future.result() for future in self._futures]
+
+    @property
+    def futures(self):
+        """ Futures for all queued RPCs, in the order they were made """
+        return list(self._futures)
+
+    def __len__(self):
+        return len(self._futures)
+
+    def _add_request(self, service, procedure, data, return_type):
+        future = Future(self._client, return_type)
+        self._requests.append((service, procedure, data))
+        self._futures.append(future)
+        return future
@@ -0,0 +1,116 @@
+import sys
+import threading
+import time
+
+# Policy for properties of parts and engines, which are fetched again after staging,
+# as staging changes the parts that make up a vessel
+_UNTIL_STAGED = {'invalidate_on': ['Control_ActivateNextStage']}
+
+# Properties of SpaceCenter objects that do not change during a flight, which are
+# cached by default. Maps (service, class, property) to the keyword arguments of
+# Client.cache_property. The class is None for a property of the service itself.
+DEFAULT_POLICIES = {
+    ('SpaceCenter', 'CelestialBody', 'Name'): {},
+    ('SpaceCenter', 'CelestialBody', 'GravitationalParameter'): {},
+    ('SpaceCenter', 'CelestialBody', 'EquatorialRadius'): {},
+    ('SpaceCenter', 'CelestialBody', 'RotationalPeriod'): {},
+    ('SpaceCenter', 'CelestialBody', 'SurfaceGravity'): {},
+    ('SpaceCenter', 'CelestialBody', 'SphereOfInfluence'): {},
+    ('SpaceCenter', 'Part', 'Name'): _UNTIL_STAGED,
+    ('SpaceCenter', 'Part', 'Title'): _UNTIL_STAGED,
+    ('SpaceCenter', 'Part', 'Stage'): _UNTIL_STAGED,
+    ('SpaceCenter', 'Part', 'DecoupleStage'): _UNTIL_STAGED,
+    ('SpaceCenter', 'Engine', 'VacuumSpecificImpulse'): _UNTIL_STAGED,
+    ('SpaceCenter', 'Engine', 'Propellants'): _UNTIL_STAGED
+}
+
+def _property_procedure(class_name, accessor, property_name):
+    """ The name of the procedure that gets or sets (accessor is 'get' or 'set') a property """
+    name = accessor + '_' + property_name
+    if class_name is None:
+        return name
+    return class_name + '_' + name
+
+def copy_value(value):
+    """ Copy the lists, dictionaries, sets and numpy arrays in a cached value, so that
+        callers changing the value they were returned do not change the cached value """
+    typ = type(value)
+    if typ is list:
+        return [copy_value(x) for x in value]
+    elif typ is dict:
+        return dict((k, copy_value(v)) for k, v in value.items())
+    elif typ is set:
+        return set(value)
+    elif typ is tuple:
+        return tuple(copy_value(x) for x in value)
+    numpy = sys.modules.get('numpy')
+    if numpy is not None and typ is numpy.ndarray:
+        return value.copy()
+    return value
+
+class PropertyCache(object):
+    """ Caches the values returned by property getters, according to a policy for
+        each property. Values are cached forever (for properties that never change),
+        for a time to live, or until a procedure that changes them is called.
+        Values are cached separately for each object that a class property is
+        read from. """
+
+    def __init__(self):
+        # Time to live for each getter, keyed by (service, procedure). None for forever.
+        self._ttls = {}
+        # Getters to invalidate when a procedure is called, keyed by (service, procedure)
+        self._invalidated_by = {}
+        # Futures for the cached calls to each getter, and when they expire,
+        # keyed by the encoded request
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def add_policy(self, service, class_name, property_name, ttl=None, invalidate_on=None):
+        """ Cache the values of the given property """
+        getter = (service, _property_procedure(class_name, 'get', property_name))
+        self._ttls[getter] = ttl
+        # Setting the property also invalidates it
+        setter = _property_procedure(class_name, 'set', property_name)
+        for procedure in [setter] + list(invalidate_on or []):
+            self._invalidated_by.setdefault((service, procedure), set()).add(getter)
+
+    def handles(self, service, procedure):
+        """ Return true if the values of the given getter are cached """
+        return (service, procedure) in self._ttls
+
+    def invalidates(self, service, procedure):
+        """ Return true if calling the given procedure invalidates cached values """
+        return (service, procedure) in self._invalidated_by
+
+    def get(self, service, procedure, data):
+        """ Return the Future for a cached call to a getter, or None if it has not been
+            called, or its value has expired """
+        with self._lock:
+            entry = self._entries.get((service, procedure), {}).get(data)
+            if entry is None:
+                return None
+            future, expires = entry
+            if expires is not None and time.time() > expires:
+                del self._entries[(service, procedure)][data]
+                return None
+            return future
+
+    def put(self, service, procedure, data, future):
+        """ Cache the Future for a call to a getter. It is removed if the call fails. """
+        ttl = self._ttls[(service, procedure)]
+        expires = time.time() + ttl if ttl is not None else None
+        with self._lock:
+            self._entries.setdefault((service, procedure), {})[data] = (future, expires)
+        def done(future):
+            if future.exception() is not None:
+                with self._lock:
+                    entries = self._entries.get((service, procedure), {})
+                    if data in entries and entries[data][0] is future:
+                        del entries[data]
+        future.add_done_callback(done)
+
+    def invalidate(self, service, procedure):
+        """ Remove the cached values of the getters invalidated by the given procedure """
+        with self._lock:
+            for getter in self._invalidated_by[(service, procedure)]:
+                self._entries.pop(getter, None)
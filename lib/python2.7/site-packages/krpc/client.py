@@ -1,14 +1,90 @@
 from krpc.types import Types, DefaultArgument
-from krpc.service import create_service
-from krpc.encoder import Encoder
+from krpc.service import create_service, load_schema
+from krpc.encoder import Encoder, RequestTemplate
 from krpc.decoder import Decoder
 from krpc.attributes import Attributes
 from krpc.utils import snake_case
-from krpc.error import RPCError
+from krpc.error import RPCError, RPCTimeoutError
+from krpc.future import Future
+from krpc.batch import Batch
+from krpc.coalesce import WriteCoalescer
+from krpc.cache import PropertyCache, DEFAULT_POLICIES, copy_value
+from krpc.autostream import AutoStreamer
+from krpc.schemacache import SchemaCache
+import krpc.autostream
 import krpc.stream
-import krpc.schema.KRPC
 from contextlib import contextmanager
+from collections import deque
 import threading
+import heapq
+import itertools
+import time
+import sys
+
+# Priorities of outgoing requests. When several threads are waiting to send
+# requests on a connection, higher priority requests are sent first. If the client
+# has a high priority connection, high priority requests are sent on it.
+HIGH_PRIORITY = 2
+NORMAL_PRIORITY = 1
+LOW_PRIORITY = 0
+
+# Upper bounds of the buckets of the deadline histogram, as the fraction
+# of its timeout that a call took to complete
+DEADLINE_HISTOGRAM_BUCKETS = (0.1, 0.25, 0.5, 0.75, 0.9, 1.0)
+
+# Used to tell that a thread has not set a timeout, as None means no timeout
+_default_timeout = object()
+
+class _PriorityLock(object):
+    """ A lock that is handed to waiting threads in order of priority, then in
+        the order they started waiting """
+
+    def __init__(self):
+        self._condition = threading.Condition(threading.Lock())
+        self._locked = False
+        self._waiting = []
+        self._count = itertools.count()
+
+    def acquire(self, priority=NORMAL_PRIORITY):
+        with self._condition:
+            if not self._locked and len(self._waiting) == 0:
+                self._locked = True
+                return
+            entry = (-priority, next(self._count))
+            heapq.heappush(self._waiting, entry)
+            while self._locked or self._waiting[0] != entry:
+                self._condition.wait()
+            heapq.heappop(self._waiting)
+            self._locked = True
+
+    def release(self):
+        with self._condition:
+            self._locked = False
+            if len(self._waiting) > 0:
+                self._condition.notify_all()
+
+    def __enter__(self):
+        self.acquire()
+
+    def __exit__(self, typ, value, traceback):
+        self.release()
+
+class _RPCChannel(object):
+    """ A connection to the RPC server, and the requests that are waiting for
+        a response on it """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.send_lock = _PriorityLock()
+        self.receive_lock = threading.Lock()
+        # Futures for requests that have been sent, in the order they were sent.
+        # The server responds to requests in order, so responses are matched
+        # to the futures at the front of this queue.
+        self.pending = deque()
+        # Thread that receives responses for this channel, if the client uses reader threads
+        self.reader = None
+        # Error that stopped the reader thread. Requests can no longer be sent once set.
+        self.error = None
 
 class Client(object):
     """
@@ -17,36 +93,192 @@ class Client(object):
     RPCs can be made using client.ServiceName.ProcedureName(parameter)
     """
 
-    def __init__(self, rpc_connection, stream_connection):
+    # If true, RPCs return a Future instead of waiting for the result
+    _return_futures = False
+
+    def __init__(self, rpc_connection, stream_connection, extra_rpc_connections=[], reader_thread=False,
+                 property_cache=True, schema_cache=False, stream_handshake=None,
+                 high_priority_connection=None):
+        # Seconds spent on each step of setting up the client, reported by krpc.startup_profile
+        self._startup_profile = {}
         self._types = Types()
         self._rpc_connection = rpc_connection
-        self._rpc_connection_lock = threading.Lock()
+        # The first channel is the connection whose client identifier the stream
+        # connection was opened with. Calls to the KRPC service are always sent on it.
+        # Other calls are sent on whichever channel is least busy.
+        self._rpc_channels = [_RPCChannel(rpc_connection)] + \
+                             [_RPCChannel(connection) for connection in extra_rpc_connections]
+        # Channels shared by requests of any priority, and the channel reserved for
+        # high priority requests, so that they never wait behind other requests
+        # that have already been sent
+        self._shared_channels = list(self._rpc_channels)
+        self._high_priority_channel = None
+        if high_priority_connection is not None:
+            self._high_priority_channel = _RPCChannel(high_priority_connection)
+            self._rpc_channels.append(self._high_priority_channel)
+        # Per-thread state, such as the currently open batch
+        self._local = threading.local()
+        # Priorities for requests, keyed by (service, procedure) or (service, None)
+        self._priorities = {}
+        # Called with the errors raised by fire-and-forget calls
+        self._error_callback = None
+        self._write_coalescer = WriteCoalescer(self)
+        # Property getters, as (service, procedure), and the getter requests
+        # that are waiting for a response, keyed by their encoded request
+        self._property_getters = set()
+        self._in_flight = {}
+        self._in_flight_lock = threading.Lock()
+        self._sequence = itertools.count()
+        self._stats = {'getter_calls': 0, 'coalesced_getter_calls': 0}
+        # Timeout for calls, in seconds, and counters of how long calls with a timeout took
+        self._timeout = None
+        self._numpy_results = False
+        self._lazy_collections = False
+        self._stats_lock = threading.Lock()
+        self._deadline_counts = [0] * len(DEADLINE_HISTOGRAM_BUCKETS)
+        self._stats['timeouts'] = 0
+        self._stats['late_responses'] = 0
+        # Cached property values
+        self._property_cache = PropertyCache()
+        self._stats['property_cache_hits'] = 0
+        self._stats['property_cache_misses'] = 0
+        if property_cache:
+            self.cache_properties(DEFAULT_POLICIES)
+        # Adds streams for frequently called getters, if enabled
+        self._auto_streams = None
         self._stream_connection = stream_connection
+        self._request_templates = {}
+
+        # Close the connections, and stop the reader threads, if the client can't be set up
+        self._stream_thread = None
+        try:
+            self._setup(reader_thread, schema_cache, stream_handshake)
+        except:
+            self._close_rpc_channels()
+            if stream_handshake is not None:
+                stream_handshake.close()
+            raise
+
+    def _setup(self, reader_thread, schema_cache, stream_handshake):
+        """ Start the reader threads, add the services and start the stream thread """
+
+        # Loads the protobuf message classes, on the first connect
+        start = time.time()
         self._request_type = self._types.as_type('KRPC.Request')
+        self._argument_type = self._types.as_type('KRPC.Argument')
         self._response_type = self._types.as_type('KRPC.Response')
+        self._startup_profile['message_types'] = time.time() - start
 
-        # Get the services
-        services = self._invoke('KRPC', 'GetServices', return_type=self._types.as_type('KRPC.Services')).services
+        # Set up response reader threads
+        if reader_thread:
+            for channel in self._rpc_channels:
+                self._start_reader_thread(channel)
 
-        # Set up services
-        for service in services:
-            setattr(self, snake_case(service.name), create_service(self, service))
+        # Set up services. Each service is only decoded, and its members added,
+        # when it is first used. Modules generated by krpc.stubgen for these services
+        # are used instead of decoding them, if present. The service types, and the
+        # members of their classes, are shared with other clients in this process
+        # connected to servers with the same services.
+        self._services = {}
+        start = time.time()
+        data = self._get_services(schema_cache)
+        self._startup_profile['schema_fetch'] = time.time() - start
+        start = time.time()
+        self._add_services(load_schema(data))
+        self._startup_profile['service_build'] = time.time() - start
+
+        # Wait for the stream handshake, if it was done while fetching the services
+        if stream_handshake is not None:
+            start = time.time()
+            self._stream_connection = stream_handshake.result()
+            self._startup_profile['stream_handshake_wait'] = time.time() - start
 
         # Set up stream update thread
-        if stream_connection is not None:
-            self._stream_thread_stop = threading.Event()
-            self._stream_thread = threading.Thread(target=krpc.stream.update_thread,
-                                                   args=(stream_connection,self._stream_thread_stop))
-            self._stream_thread.daemon = True
-            self._stream_thread.start()
-        else:
-            self._stream_thread = None
+        if self._stream_connection is not None:
+            self._start_stream_thread()
+
+    def _get_services(self, schema_cache):
+        """ Return the serialized KRPC.Services message describing the server's services.
+            If schema_cache is set, it is loaded from the cache when the cache holds the
+            message for this server and version, and stored in the cache otherwise. """
+        if schema_cache:
+            cache = SchemaCache(schema_cache if schema_cache is not True else None)
+            request = self._build_request('KRPC', 'GetStatus')
+            version = self._submit_request(request, self._types.as_type('KRPC.Status')).result().version
+            address = self._rpc_connection._address
+            port = self._rpc_connection._port
+            data = cache.load(address, port, version)
+            if data is not None:
+                return data
+        # Keep the serialized message, rather than decoding it as a KRPC.Services message
+        future = Future(self, raw=True)
+        self._submit('KRPC', 'GetServices', self._encode_request('KRPC', 'GetServices'), None, future)
+        data = future.result()
+        if schema_cache:
+            cache.store(address, port, version, data)
+        return data
+
+    def _add_services(self, schema):
+        """ Add the services of a schema to the client """
+        self._types = Types(schema, self)
+        self._property_getters = schema.property_getters
+        # Parameter and return types of procedures, keyed by their signature
+        self._signatures = {}
+        for cls in schema.services.values():
+            setattr(self, snake_case(cls._name), create_service(self, cls))
+
+    def _start_stream_thread(self):
+        """ Start the thread that receives stream updates """
+        self._stream_thread_stop = threading.Event()
+        self._stream_thread = threading.Thread(target=krpc.stream.update_thread,
+                                               args=(self._stream_connection,self._stream_thread_stop))
+        self._stream_thread.daemon = True
+        self._stream_thread.start()
+
+    def _start_reader_thread(self, channel):
+        """ Start a thread that receives the responses for a channel """
+        channel.reader = threading.Thread(target=self._reader_thread_main, args=(channel,))
+        channel.reader.daemon = True
+        channel.reader.start()
+
+    def _reader_thread_main(self, channel):
+        """ Receive responses from the server, in order, and hand each one to the
+            future waiting for it. When the connection is closed, or a response cannot
+            be handled, the futures still waiting are completed with the error. """
+        try:
+            while True:
+                response = self._receive_response(channel.connection)
+                self._complete_next(channel, response)
+        except Exception as e:
+            # Raised when the connection is shut down or closed. Any other error, such
+            # as a response that cannot be decoded, also stops the thread, as later
+            # responses can no longer be matched to their requests.
+            error = e
+        with channel.send_lock:
+            channel.error = error
+            pending = list(channel.pending)
+            channel.pending.clear()
+        for future in pending:
+            future.set_exception(error)
 
     def close(self):
-        self._rpc_connection.close()
+        if self._auto_streams is not None:
+            self._auto_streams.close(remove_streams=False)
+        self._close_rpc_channels()
         if self._stream_thread is not None:
             self._stream_thread_stop.set()
+            self._stream_connection.shutdown()
             self._stream_thread.join()
+        if self._stream_connection is not None:
+            self._stream_connection.close()
+
+    def _close_rpc_channels(self):
+        """ Close the RPC connections, and wait for their reader threads to exit """
+        for channel in self._rpc_channels:
+            if channel.reader is not None:
+                channel.connection.shutdown()
+                channel.reader.join()
+            channel.connection.close()
 
     def __enter__(self):
         return self
@@ -57,6 +289,8 @@ class Client(object):
     def add_stream(self, func, *args, **kwargs):
         if self._stream_connection is None:
             raise RuntimeError('Not connected to stream server')
+        if self._current_batch() is not None:
+            raise RuntimeError('Cannot add a stream inside a batch')
         return krpc.stream.add_stream(self, func, *args, **kwargs)
 
     @contextmanager
@@ -68,34 +302,560 @@ class Client(object):
         finally:
             s.remove()
 
+    def pipelined(self, func, *args, **kwargs):
+        """ Send an RPC without waiting for its response, and return a Future for its result.
+            Takes the same arguments as add_stream. Multiple pipelined calls are written
+            back-to-back, so their network round trips overlap. """
+        request, return_type = self._build_call(func, *args, **kwargs)
+        return self._submit_request(request, return_type)
+
+    @contextmanager
+    def batch(self):
+        """ Queue the RPCs made by the calling thread inside a 'with' block, and send them
+            to the server in a single write when the block exits. Calls made inside the block
+            return Futures, whose results are available once the block has exited. """
+        batch = self._current_batch()
+        if batch is not None:
+            # Nested batches are merged into the outermost batch
+            yield batch
+            return
+        batch = Batch(self)
+        self._local.batch = batch
+        try:
+            yield batch
+        finally:
+            self._local.batch = None
+        if len(batch) > 0:
+            self._send_batch(batch)
+            self._wait_for(batch._futures[-1])
+
+    def set_priority(self, priority, service, procedure=None):
+        """ Set the priority of requests to a service, or to one of its procedures.
+            The names are those used by the server, for example 'SpaceCenter' and
+            'AutoPilot_TargetPitchAndHeading'. Requests made inside a
+            'with client.priority(...)' block use the priority of the block instead.
+            Priorities only reorder requests waiting to be sent on the same connection,
+            as the server runs the requests on a connection in the order it receives
+            them. Connect with high_priority_connection=True for high priority requests
+            to have a connection of their own. """
+        self._priorities[(service, procedure)] = priority
+
+    @contextmanager
+    def priority(self, priority):
+        """ Send the requests made by the calling thread inside a 'with' block
+            with the given priority """
+        previous = getattr(self._local, 'priority', None)
+        self._local.priority = priority
+        try:
+            yield
+        finally:
+            self._local.priority = previous
+
+    @contextmanager
+    def fire_and_forget(self):
+        """ Calls to procedures and property setters that do not return a value, made by
+            the calling thread inside a 'with' block, are sent without waiting for their
+            response. Responses are handed over when they arrive. If one of the calls fails,
+            the error is passed to the error callback, or raised by the next call that the
+            thread makes if no callback has been set. """
+        previous = getattr(self._local, 'fire_and_forget', False)
+        self._local.fire_and_forget = True
+        try:
+            yield
+        finally:
+            self._local.fire_and_forget = previous
+
+    def set_error_callback(self, callback):
+        """ Set a function to call with the errors raised by fire-and-forget calls.
+            It is called from whichever thread receives the response, so must not
+            make RPCs that wait for a result. Pass None to raise the errors from the
+            next call made by the thread instead. """
+        self._error_callback = callback
+
+    def coalesce_writes(self, service, procedure, tolerance=0, max_rate=None):
+        """ Skip calls to a property setter or procedure without a return value that write
+            the same values as the last write sent to the server, or numeric values within
+            the given tolerance of them. If the server returns an error for a write, the next
+            write is sent even if its values are the same. Writes are tracked separately for
+            each object that a class property or method is called on. The names are those
+            used by the server, for example 'SpaceCenter' and 'Control_set_Throttle'.
+            If max_rate is given, at most that many writes per second are sent for each
+            object. A write made too soon after the previous one returns immediately, and is
+            sent when enough time has passed, unless a later write replaces it. Errors from
+            delayed writes are handled in the same way as fire-and-forget calls. """
+        self._write_coalescer.add_rule(service, procedure, tolerance, max_rate)
+
+    def cache_property(self, service, class_name, property_name, ttl=None, invalidate_on=None):
+        """ Cache the values returned by a property getter, rather than calling the server
+            every time the property is read. Values are cached forever, unless ttl gives
+            the number of seconds to keep them for, or until one of the procedures in
+            invalidate_on (such as 'Control_ActivateNextStage') or the property's setter
+            is called. Values of a class property are cached for each object. class_name
+            is None for a property of the service itself. The names are those used by the
+            server, for example 'SpaceCenter', 'CelestialBody' and 'GravitationalParameter'.
+            Each read returns its own copy of a cached list, dictionary, set or numpy array,
+            except that clients returning Futures, such as krpc.aio clients, share the
+            Future for the cached call. """
+        self._property_cache.add_policy(service, class_name, property_name, ttl, invalidate_on)
+
+    def cache_properties(self, policies):
+        """ Cache the properties in a table that maps (service, class_name, property_name)
+            to a dictionary of keyword arguments for cache_property. Properties that are
+            known not to change during a flight are cached when the client connects. """
+        for (service, class_name, property_name), policy in policies.items():
+            self.cache_property(service, class_name, property_name, **policy)
+
+    def set_auto_streams(self, enabled=True, threshold=10, window=1.0, cooldown=5.0):
+        """ Add a stream for a property getter once it has been called with the same
+            arguments more than threshold times within window seconds, and return the
+            stream's most recent value from later calls instead of making an RPC. A
+            stream that has not been read for cooldown seconds is removed. Disabling
+            removes the streams that were added. """
+        if self._auto_streams is not None:
+            self._auto_streams.close()
+            self._auto_streams = None
+        if enabled:
+            if self._stream_connection is None:
+                raise RuntimeError('Not connected to stream server')
+            self._auto_streams = AutoStreamer(self, threshold, window, cooldown)
+
+    def auto_stream_report(self):
+        """ Return a list of (service, procedure, active, reads) for the property getters
+            that streams were added for by set_auto_streams, where active is true if the
+            stream still exists and reads is the number of RPCs it saved """
+        if self._auto_streams is None:
+            return []
+        return self._auto_streams.report()
+
+    def set_timeout(self, timeout):
+        """ Set the time, in seconds, that calls wait for a response before raising
+            RPCTimeoutError. None, the default, waits forever. A response received
+            after its call timed out is discarded. """
+        self._timeout = timeout
+
+    @contextmanager
+    def timeout(self, timeout):
+        """ Set the timeout for the calls made by the calling thread inside a 'with'
+            block, overriding the timeout set by set_timeout """
+        previous = getattr(self._local, 'timeout', _default_timeout)
+        self._local.timeout = timeout
+        try:
+            yield
+        finally:
+            self._local.timeout = previous
+
+    def set_numpy_results(self, enabled=True):
+        """ Return numpy arrays of float64, instead of tuples and lists, from calls and
+            streams that return tuples of doubles and floats (such as positions and
+            velocities) or lists of doubles or floats. Requires numpy. """
+        if enabled:
+            import numpy
+        self._numpy_results = enabled
+
+    def set_lazy_collections(self, enabled=True):
+        """ Return a LazyList or LazyDict, instead of a list or dictionary, from calls
+            and streams that return them. Their items are decoded when they are first
+            accessed, which saves time when only a few items of a large collection,
+            such as the parts of a vessel, are used. """
+        self._lazy_collections = enabled
+
+    def stats(self):
+        """ Return a dictionary of counters describing the calls made by the client.
+            getter_calls is the number of property getter calls, and
+            coalesced_getter_calls is how many of those received the response to an
+            identical call that was already waiting, instead of sending a request.
+            timeouts is the number of calls that timed out, and late_responses the
+            number of responses received after their call timed out.
+            property_cache_hits and property_cache_misses count the reads of cached
+            properties that were and were not served from the cache. auto_stream_reads
+            is the number of getter calls served by streams added by set_auto_streams,
+            and auto_stream_failures the number of those streams that could not be added.
+            deadline_histogram is a list of (bound, count) pairs, counting the calls
+            with a timeout that completed within that fraction of their timeout. """
+        with self._stats_lock:
+            stats = dict(self._stats)
+            stats['deadline_histogram'] = zip(DEADLINE_HISTOGRAM_BUCKETS, self._deadline_counts)
+        stats['auto_stream_reads'] = sum(reads for _,_,_,reads in self.auto_stream_report())
+        auto_streams = self._auto_streams
+        stats['auto_stream_failures'] = auto_streams.failures if auto_streams is not None else 0
+        return stats
+
     def _invoke(self, service, procedure, args=[], kwargs={}, param_names=[], param_types=[], return_type=None):
         """ Execute an RPC """
 
-        # Build the request
-        request = self._build_request(service, procedure, args, kwargs, param_names, param_types, return_type)
+        # Raise errors from earlier fire-and-forget calls
+        errors = getattr(self._local, 'errors', None)
+        if errors:
+            raise errors.popleft()
+
+        # Encode the request
+        data = self._encode_request(service, procedure, args, kwargs, param_names, param_types)
+
+        # Remove cached property values that the call changes
+        if self._property_cache.invalidates(service, procedure):
+            self._property_cache.invalidate(service, procedure)
+
+        # Queue the request if a batch is open
+        batch = self._current_batch()
+        if batch is not None:
+            return batch._add_request(service, procedure, data, return_type)
+
+        # Return a cached property value
+        cached = self._property_cache.handles(service, procedure)
+        if cached:
+            future = self._property_cache.get(service, procedure, data)
+            with self._stats_lock:
+                self._stats['property_cache_hits' if future is not None else 'property_cache_misses'] += 1
+            if future is not None:
+                if self._return_futures:
+                    return future
+                return copy_value(self._result(future, time.time()))
+
+        # Return the value of a stream added for a frequently called getter
+        auto_streams = self._auto_streams
+        if auto_streams is not None and not self._return_futures and (service, procedure) in self._property_getters:
+            value = auto_streams.read(data)
+            if value is not krpc.autostream.missing:
+                return value
+        else:
+            auto_streams = None
 
-        # Send the request
-        with self._rpc_connection_lock:
-            self._send_request(request)
-            response = self._receive_response()
+        # Skip or delay coalesced writes
+        if return_type is None and self._write_coalescer.handles(service, procedure):
+            future = self._write_coalescer.write(service, procedure, data, args, param_names,
+                                                 self._fire_and_forget_done())
+            if future is None:
+                return None
+        else:
+            future = None
 
-        # Check for an error response
-        if response.has_error:
-            raise RPCError(response.error)
+        # Don't wait for the response to a call without a return value, if requested
+        if return_type is None and getattr(self._local, 'fire_and_forget', False):
+            if future is None:
+                future = self._submit(service, procedure, data, return_type)
+            future.add_done_callback(self._fire_and_forget_done())
+            self._process_responses()
+            return None
 
-        # Decode the response and return the (optional) result
-        result = None
-        if return_type is not None:
-            result = Decoder.decode(response.return_value, return_type)
+        # Send the request, then wait for the response and return the (optional) result
+        start = time.time()
+        if future is None:
+            if (service, procedure) in self._property_getters:
+                future = self._submit_getter(service, procedure, data, return_type)
+            else:
+                future = self._submit(service, procedure, data, return_type)
+            if cached:
+                self._property_cache.put(service, procedure, data, future)
+        if self._return_futures:
+            return future
+        result = self._result(future, start)
+        if auto_streams is not None:
+            auto_streams.record(service, procedure, data, return_type, result)
+        if cached or future._joined:
+            # The result is shared with the cache, or with the other callers of the getter
+            return copy_value(result)
         return result
 
+    def _result(self, future, start):
+        """ Wait for the result of a call made at the given time, for at most the
+            timeout of the calling thread or of the client """
+        timeout = getattr(self._local, 'timeout', _default_timeout)
+        if timeout is _default_timeout:
+            timeout = self._timeout
+        if timeout is None:
+            return future.result()
+        return self._result_before_deadline(future, start, timeout)
+
+    def _result_before_deadline(self, future, start, timeout):
+        """ Wait for the result of a call with a timeout, and record how long it took """
+        try:
+            future.result(start + timeout - time.time())
+        except RPCTimeoutError:
+            with self._stats_lock:
+                self._stats['timeouts'] += 1
+            raise
+        except RPCError:
+            pass
+        elapsed = (time.time() - start) / timeout
+        with self._stats_lock:
+            for i, bound in enumerate(DEADLINE_HISTOGRAM_BUCKETS):
+                if elapsed <= bound:
+                    self._deadline_counts[i] += 1
+                    break
+            else:
+                self._deadline_counts[-1] += 1
+        return future.result()
+
+    def _fire_and_forget_done(self):
+        """ Return a callback that handles the response to a fire-and-forget call
+            made by the calling thread """
+        errors = getattr(self._local, 'errors', None)
+        if errors is None:
+            errors = self._local.errors = deque()
+        def done(future):
+            error = future.exception()
+            if error is None:
+                return
+            if self._error_callback is not None:
+                self._error_callback(error)
+            else:
+                errors.append(error)
+        return done
+
+    def _current_batch(self):
+        """ Get the batch opened by the calling thread, or None """
+        return getattr(self._local, 'batch', None)
+
+    def _build_call(self, func, *args, **kwargs):
+        """ Get the KRPC.Request object and return type for a call to a remote procedure.
+            Properties are specified by passing getattr as the function, followed by
+            the object and property name. """
+        if func == getattr:
+            # A property or class property getter
+            attr = func(args[0].__class__, args[1])
+            return attr.fget._build_request(args[0]), attr.fget._signature.types(self)[1]
+        elif func == setattr:
+            # A property setter
+            raise ValueError('Cannot call a property setter')
+        elif hasattr(func, '__self__'):
+            # A method
+            return func._build_request(func.__self__, *args, **kwargs), func._signature.types(self)[1]
+        else:
+            # A function
+            return func._build_request(*args, **kwargs), func._signature.types(self)[1]
+
+    def _submit_request(self, request, return_type):
+        """ Send a KRPC.Request object to the server and return a Future for its response """
+        data = Encoder.encode_delimited(request, self._request_type)
+        return self._submit(request.service, request.procedure, data, return_type)
+
+    def _submit(self, service, procedure, data, return_type, future=None):
+        """ Send an encoded request to the server and return a Future for its response """
+        if future is None:
+            future = Future(self, return_type)
+        priority = self._request_priority(service, procedure)
+        self._send(self._select_channel(service == 'KRPC', priority), data, [future], priority)
+        return future
+
+    def _submit_getter(self, service, procedure, data, return_type):
+        """ Send an encoded property getter request to the server and return a Future for its
+            response. If an identical request is already waiting for a response, and will be
+            executed after the last request made by the calling thread, its Future is returned
+            instead. Requests on different channels are not executed in the order they were
+            sent, so the thread's last request must have completed or be on the same channel. """
+        last = getattr(self._local, 'last_future', None)
+        with self._in_flight_lock:
+            self._stats['getter_calls'] += 1
+            future = self._in_flight.get(data)
+            if future is not None and future._sent and not future.done() and \
+               (last is None or last.done() or
+                (future._channel is last._channel and future._sequence >= last._sequence)):
+                self._stats['coalesced_getter_calls'] += 1
+                future._joined = True
+                return future
+            future = Future(self, return_type)
+            self._in_flight[data] = future
+        def remove(_):
+            with self._in_flight_lock:
+                if self._in_flight.get(data) is future:
+                    del self._in_flight[data]
+        try:
+            self._submit(service, procedure, data, return_type, future)
+        except Exception as e:
+            remove(future)
+            future.set_exception(e)
+            raise
+        future.add_done_callback(remove)
+        return future
+
+    def _send_batch(self, batch):
+        """ Send all of the requests queued in a batch to the server in a single write """
+        data = b''.join(data for _,_,data in batch._requests)
+        krpc_service = any(service == 'KRPC' for service,_,_ in batch._requests)
+        priority = max(self._request_priority(service, procedure) for service,procedure,_ in batch._requests)
+        self._send(self._select_channel(krpc_service, priority), data, batch._futures, priority)
+
+    def _request_priority(self, service, procedure):
+        """ Get the priority to send a request to a procedure with """
+        priority = getattr(self._local, 'priority', None)
+        if priority is not None:
+            return priority
+        priorities = self._priorities
+        if len(priorities) == 0:
+            return NORMAL_PRIORITY
+        priority = priorities.get((service, procedure))
+        if priority is not None:
+            return priority
+        return priorities.get((service, None), NORMAL_PRIORITY)
+
+    def _select_channel(self, krpc_service=False, priority=NORMAL_PRIORITY):
+        """ Choose the channel to send a request on. Requests made by a thread are
+            sent on the same channel while it has earlier requests in flight, so that
+            they are executed in the order they were made. Otherwise high priority
+            requests use the high priority channel, if there is one, and other requests
+            use the shared channel with the fewest requests in flight. """
+        channels = self._rpc_channels
+        if krpc_service or len(channels) == 1:
+            return channels[0]
+        last = getattr(self._local, 'last_future', None)
+        if last is not None and not last.done():
+            return last._channel
+        if priority >= HIGH_PRIORITY and self._high_priority_channel is not None:
+            return self._high_priority_channel
+        channels = self._shared_channels
+        if len(channels) == 1:
+            return channels[0]
+        return min(channels, key=lambda channel: len(channel.pending))
+
+    def _send(self, channel, data, futures, priority=NORMAL_PRIORITY):
+        """ Send encoded requests to the server, and queue the futures
+            that will receive their responses. If other threads are waiting
+            to send, the requests with the highest priority are sent first. """
+        channel.send_lock.acquire(priority)
+        try:
+            if channel.error is not None:
+                raise channel.error
+            sequence = next(self._sequence)
+            for future in futures:
+                future._sent = True
+                future._channel = channel
+                future._sequence = sequence
+            channel.pending.extend(futures)
+            try:
+                channel.connection.send(data)
+            except:
+                for future in futures:
+                    channel.pending.pop()
+                    future._sent = False
+                    future._channel = None
+                raise
+        finally:
+            channel.send_lock.release()
+        self._local.last_future = futures[-1]
+
+    def _wait_for(self, future, deadline=None):
+        """ Receive responses from the server until the given future has completed.
+            Responses for other futures received along the way are handed to them.
+            Returns false if the deadline passed before the future completed. The
+            future still receives its response when it arrives. """
+        channel = future._channel
+        if channel.reader is not None:
+            # The reader thread completes the future
+            if not future.done():
+                event = threading.Event()
+                future.add_done_callback(lambda _: event.set())
+                if deadline is None:
+                    event.wait()
+                else:
+                    event.wait(max(0, deadline - time.time()))
+        else:
+            self._receive_until(future, deadline)
+        if not future.done():
+            future._timed_out = True
+            return False
+        return True
+
+    def _receive_until(self, future, deadline):
+        """ Receive responses from a channel until the given future has completed,
+            or the deadline passes """
+        channel = future._channel
+        event = None
+        while not future.done():
+            if deadline is None:
+                channel.receive_lock.acquire()
+            else:
+                remaining = deadline - time.time()
+                if not channel.receive_lock.acquire(False):
+                    # Another thread is receiving responses. Wait until it has received
+                    # this one, or has released the lock.
+                    if remaining <= 0:
+                        return
+                    if event is None:
+                        event = threading.Event()
+                        future.add_done_callback(lambda _: event.set())
+                    event.wait(min(remaining, 0.001))
+                    continue
+            try:
+                if future.done():
+                    return
+                if deadline is None:
+                    response = self._receive_response(channel.connection)
+                else:
+                    response = self._receive_response(channel.connection, max(0, remaining))
+                    if response is None:
+                        return
+                self._complete_next(channel, response)
+            finally:
+                channel.receive_lock.release()
+
+    def _complete_next(self, channel, response):
+        """ Hand a response to the future at the front of a channel's queue """
+        future = channel.pending.popleft()
+        if future._timed_out:
+            with self._stats_lock:
+                self._stats['late_responses'] += 1
+        future._set_response(response)
+
+    def _process_responses(self):
+        """ Hand any responses that have already been received to their futures,
+            without blocking """
+        for channel in self._rpc_channels:
+            # Skip channels whose responses are received by another thread
+            if channel.reader is not None or not channel.receive_lock.acquire(False):
+                continue
+            try:
+                while len(channel.pending) > 0:
+                    data = channel.connection.poll_message()
+                    if data is None:
+                        break
+                    response = Decoder.decode(data.tobytes(), self._response_type)
+                    self._complete_next(channel, response)
+            finally:
+                channel.receive_lock.release()
+
     def _build_request(self, service, procedure, args=[], kwargs={},
                        param_names=[], param_types=[], return_type=None):
         """ Build a KRPC.Request object """
+        arguments = []
+        for position, value in self._encode_arguments(service, procedure, args, kwargs, param_names, param_types):
+            argument = self._argument_type.python_type()
+            argument.position = position
+            argument.value = value
+            arguments.append(argument)
+
+        # Build the request object
+        request = self._request_type.python_type()
+        request.service = service
+        request.procedure = procedure
+        request.arguments.extend(arguments)
+        return request
+
+    def _encode_request(self, service, procedure, args=[], kwargs={}, param_names=[], param_types=[]):
+        """ Encode a KRPC.Request message, with size information, without building the
+            message object. The service and procedure fields are encoded once per procedure. """
+        template = self._request_templates.get((service, procedure))
+        if template is None:
+            template = RequestTemplate(service, procedure, len(param_types))
+            self._request_templates[(service, procedure)] = template
+        if len(param_types) == 0:
+            return template.encode_delimited()
+        return template.encode_delimited(
+            self._encode_arguments(service, procedure, args, kwargs, param_names, param_types))
+
+    def _encode_arguments(self, service, procedure, args, kwargs, param_names, param_types):
+        """ Encode the arguments for a call. Returns a list of (position, encoded value) pairs
+            for the arguments that were passed. """
+
+        numpy = sys.modules.get('numpy')
 
         def encode_argument(i, value):
             typ = param_types[i]
             if type(value) != typ.python_type:
+                if numpy is not None and isinstance(value, (numpy.generic, numpy.ndarray)):
+                    # Encode numpy scalars and arrays without converting them first
+                    data = Encoder.encode_numpy(value, typ)
+                    if data is not None:
+                        return data
                 # Try coercing to the correct type
                 try:
                     value = self._types.coerce_to(value, typ)
@@ -119,36 +879,13 @@ class Client(object):
                 arg = kwargs[param]
                 add = True
             if add:
-                argument = krpc.schema.KRPC.Argument()
-                argument.position = i
-                argument.value = encode_argument(i, arg)
-                arguments.append(argument)
+                arguments.append((i, encode_argument(i, arg)))
+        return arguments
 
-        # Build the request object
-        request = krpc.schema.KRPC.Request()
-        request.service = service
-        request.procedure = procedure
-        request.arguments.extend(arguments)
-        return request
-
-    def _send_request(self, request):
-        """ Send a KRPC.Request object to the server """
-        data = Encoder.encode_delimited(request, self._request_type)
-        self._rpc_connection.send(data)
-
-    def _receive_response(self):
-        """ Receive data from the server and decode it into a KRPC.Response object """
-
-        # Read the size and position of the response message
-        data = b''
-        while True:
-            try:
-                data += self._rpc_connection.partial_receive(1)
-                size,position = Decoder.decode_size_and_position(data)
-                break
-            except IndexError:
-                pass
-
-        # Read and decode the response message
-        data = self._rpc_connection.receive(size)
-        return Decoder.decode(data, self._response_type)
+    def _receive_response(self, connection, timeout=None):
+        """ Receive data from the server and decode it into a KRPC.Response object.
+            Returns None if a timeout is given and it expires first. """
+        data = connection.receive_message(timeout)
+        if data is None:
+            return None
+        return Decoder.decode(data.tobytes(), self._response_type)
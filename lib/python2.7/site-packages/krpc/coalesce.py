@@ -0,0 +1,163 @@
+import numbers
+import sys
+import threading
+import time
+import weakref
+from krpc.cache import copy_value
+
+class _WriteState(object):
+    """ The writes made to a procedure for one object """
+
+    def __init__(self):
+        # Argument values of the last write sent to the server. Cleared if the
+        # server returns an error for it, as the values were then not written.
+        self.sent = None
+        # Time the last write was sent
+        self.sent_time = None
+        # Encoded request and argument values of a write waiting to be sent, and the
+        # callback that handles its response
+        self.deferred = None
+        self.timer = None
+
+class WriteCoalescer(object):
+    """ Skips calls to property setters and procedures without a return value that
+        would write the same values as the last write sent, and limits the rate at
+        which they are sent. Writes are tracked separately for each object that a
+        class property or method is called on. """
+
+    def __init__(self, client):
+        self._client = client
+        self._rules = {}
+        # States of the writes to procedures, keyed by (service, procedure), for
+        # procedures that are not called on an object. The states for an object are
+        # kept for as long as the object is, keyed by the object then (service, procedure).
+        self._states = {}
+        self._object_states = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def add_rule(self, service, procedure, tolerance=0, max_rate=None):
+        """ Coalesce writes to the given procedure """
+        self._rules[(service, procedure)] = (tolerance, max_rate)
+
+    def handles(self, service, procedure):
+        """ Return true if writes to the given procedure are coalesced """
+        return (service, procedure) in self._rules
+
+    def write(self, service, procedure, data, args, param_names, done=None):
+        """ Send a write, unless it is within the tolerance of the last write sent, or of
+            the write waiting to be sent, or the maximum write rate has been reached. A write that exceeds the rate is
+            sent once enough time has passed, unless a later write replaces it. Returns a
+            Future for the write, or None if it was not sent immediately. done is called
+            with the Future for a delayed write when it completes. """
+        tolerance, max_rate = self._rules[(service, procedure)]
+        # The object is the first parameter of a class member. It is renamed
+        # from 'this' to 'self' for class methods.
+        obj = None
+        if len(param_names) > 0 and param_names[0] in ('this', 'self'):
+            obj = args[0]
+            values = tuple(args[1:])
+        else:
+            values = tuple(args)
+        # Keep a copy, so the caller changing a list or array after the call does
+        # not change the values recorded as sent
+        values = copy_value(values)
+        with self._lock:
+            state = self._state(service, procedure, obj)
+            # The values the server will have once the writes already made are sent
+            latest = state.deferred[1] if state.deferred is not None else state.sent
+            if latest is not None and _within_tolerance(values, latest, tolerance):
+                return None
+            if state.deferred is not None and state.sent is not None and \
+               _within_tolerance(values, state.sent, tolerance):
+                # Back to the values last sent, so the write waiting to be sent is not needed
+                state.deferred = None
+                return None
+            if max_rate is not None and state.sent_time is not None:
+                delay = state.sent_time + 1.0/max_rate - time.time()
+                if delay > 0:
+                    # Last write wins
+                    state.deferred = (data, values, done)
+                    if state.timer is None:
+                        state.timer = threading.Timer(delay, self._flush, args=(state, service, procedure))
+                        state.timer.daemon = True
+                        state.timer.start()
+                    return None
+            state.deferred = None
+            state.sent = values
+            state.sent_time = time.time()
+        return self._send(state, service, procedure, data, values)
+
+    def _state(self, service, procedure, obj):
+        """ Get the state of the writes to a procedure for an object, or for no object
+            if obj is None. Called with the lock held. """
+        if obj is None:
+            states = self._states
+        else:
+            states = self._object_states.get(obj)
+            if states is None:
+                states = self._object_states[obj] = {}
+        state = states.get((service, procedure))
+        if state is None:
+            state = states[(service, procedure)] = _WriteState()
+        return state
+
+    def _flush(self, state, service, procedure):
+        """ Send the write for an object that was delayed by the maximum write rate """
+        with self._lock:
+            state.timer = None
+            if state.deferred is None:
+                return
+            data, values, done = state.deferred
+            state.deferred = None
+            state.sent = values
+            state.sent_time = time.time()
+        try:
+            self._send(state, service, procedure, data, values, done)
+        except Exception:
+            # The connection has been closed
+            pass
+
+    def _send(self, state, service, procedure, data, values, done=None):
+        try:
+            future = self._client._submit(service, procedure, data, None)
+        except Exception:
+            self._failed(state, values)
+            raise
+        def completed(future):
+            if future.exception() is not None:
+                self._failed(state, values)
+            if done is not None:
+                done(future)
+        future.add_done_callback(completed)
+        return future
+
+    def _failed(self, state, values):
+        """ Forget the values of a write that was not made, so the next write is sent """
+        with self._lock:
+            if state.sent is values:
+                state.sent = None
+
+def _within_tolerance(values, previous, tolerance):
+    """ Return true if every value is within the tolerance of the previous value """
+    if len(values) != len(previous):
+        return False
+    numpy = sys.modules.get('numpy')
+    for value, prev in zip(values, previous):
+        if numpy is not None:
+            # Compare numpy arrays element-wise, as lists
+            if isinstance(value, numpy.ndarray):
+                value = value.tolist()
+            if isinstance(prev, numpy.ndarray):
+                prev = prev.tolist()
+        if isinstance(value, bool) or isinstance(prev, bool):
+            if value != prev:
+                return False
+        elif isinstance(value, numbers.Real) and isinstance(prev, numbers.Real):
+            if abs(value - prev) > tolerance:
+                return False
+        elif isinstance(value, (tuple, list)) and type(value) is type(prev):
+            if not _within_tolerance(value, prev, tolerance):
+                return False
+        elif value != prev:
+            return False
+    return True
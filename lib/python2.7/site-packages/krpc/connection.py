@@ -4,10 +4,19 @@ import time
 from krpc.error import NetworkError
 
 class Connection(object):
+
+    # Initial size of the receive buffer, in bytes. The buffer grows to fit larger messages.
+    BUFFER_SIZE = 4096
+
     def __init__(self, address, port):
         self._address = address
         self._port = port
         self._socket = None
+        # Data received from the socket that has not been consumed yet is
+        # stored in self._buffer[self._start:self._end]
+        self._buffer = bytearray(self.BUFFER_SIZE)
+        self._start = 0
+        self._end = 0
 
     def connect(self, retries=0, timeout=0):
         try:
@@ -29,6 +38,19 @@ class Connection(object):
         if self._socket is not None:
             self._socket.close()
 
+    def fileno(self):
+        """ The file descriptor of the socket, for use with select """
+        return self._socket.fileno()
+
+    def shutdown(self):
+        """ Shut down the connection. Wakes up any thread that is blocked receiving
+            from the connection, which will then see the connection as closed. """
+        if self._socket is not None:
+            try:
+                self._socket.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
     def __del__(self):
         self.close()
 
@@ -46,18 +68,73 @@ class Connection(object):
         if length == 0:
             return b''
         assert length > 0
-        data = b''
-        while len(data) < length:
-            remaining = length - len(data)
-            result = self._socket.recv(min(4096, remaining))
-            if len(result) == 0:
-                raise socket.error("Connection closed")
-            data += result
+        self._fill(length)
+        data = bytes(self._buffer[self._start:self._start+length])
+        self._start += length
         return data
 
+    def receive_message(self, timeout=None):
+        """ Receive a size delimited message from the connection. Blocks until the whole
+            message has been received, or for at most timeout seconds if a timeout is given.
+            Returns a memoryview of the message data, which is only valid until the next
+            call to receive or receive_message, or None if the timeout expired. Part of a
+            message received before the timeout expired is kept for the next call. """
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        while True:
+            size, position = self._decode_size()
+            if size is not None and self._end - position >= size:
+                self._start = position + size
+                return memoryview(self._buffer)[position:position+size]
+            # Wait for the rest of the size header (at most 10 bytes) or message
+            if size is None:
+                filled = self._fill(self._end - self._start + 1, deadline)
+            else:
+                filled = self._fill(position - self._start + size, deadline)
+            if not filled:
+                return None
+
+    def poll_message(self):
+        """ Receive a size delimited message if one is available, without blocking.
+            Returns a memoryview of the message data, which is only valid until the
+            next call to receive, receive_message or poll_message, or None if a
+            whole message has not been received yet. """
+        size, position = self._decode_size()
+        if size is None or self._end - position < size:
+            try:
+                ready = select.select([self._socket], [], [], 0)
+            except ValueError:
+                raise socket.error("Connection closed")
+            if not ready[0]:
+                return None
+            if size is None:
+                self._reserve(self._end - self._start + 1)
+            else:
+                self._reserve(position - self._start + size)
+            self._receive_into_buffer()
+            size, position = self._decode_size()
+            if size is None or self._end - position < size:
+                return None
+        self._start = position + size
+        return memoryview(self._buffer)[position:position+size]
+
+    def has_message(self):
+        """ Whether a whole size delimited message has already been received
+            into the buffer, so can be returned by poll_message without
+            receiving from the socket """
+        size, position = self._decode_size()
+        return size is not None and self._end - position >= size
+
     def partial_receive(self, length, timeout=0.01):
         """ Receive up to length bytes of data from the connection. """
         assert length > 0
+        if self._end > self._start:
+            # Return data that has already been received
+            length = min(length, self._end - self._start)
+            data = bytes(self._buffer[self._start:self._start+length])
+            self._start += length
+            return data
         try:
             ready = select.select([self._socket], [], [], timeout)
         except ValueError:
@@ -65,3 +142,61 @@ class Connection(object):
         if ready[0]:
             return self._socket.recv(length)
         return b''
+
+    def _decode_size(self):
+        """ Decode the varint size header of the next message in the buffer.
+            Returns (size, position of the message data), or (None, None)
+            if the whole header has not been received yet. """
+        buf = self._buffer
+        result = 0
+        shift = 0
+        pos = self._start
+        while pos < self._end:
+            b = buf[pos]
+            result |= (b & 0x7f) << shift
+            pos += 1
+            if not b & 0x80:
+                return result, pos
+            shift += 7
+        return None, None
+
+    def _fill(self, length, deadline=None):
+        """ Receive data from the socket into the buffer, until the buffer
+            contains at least length bytes of unconsumed data. Returns false
+            if the deadline passed before enough data was received. """
+        self._reserve(length)
+        while self._end - self._start < length:
+            if deadline is not None:
+                try:
+                    ready = select.select([self._socket], [], [], max(0, deadline - time.time()))
+                except ValueError:
+                    raise socket.error("Connection closed")
+                if not ready[0]:
+                    return False
+            self._receive_into_buffer()
+        return True
+
+    def _receive_into_buffer(self):
+        """ Receive as much data as is available from the socket (blocking until
+            some is available) into the free space at the end of the buffer """
+        received = self._socket.recv_into(memoryview(self._buffer)[self._end:])
+        if received == 0:
+            raise socket.error("Connection closed")
+        self._end += received
+
+    def _reserve(self, length):
+        """ Make space in the buffer for at least length bytes of unconsumed data """
+        buffered = self._end - self._start
+        if buffered == 0:
+            self._start = self._end = 0
+        if self._start + length > len(self._buffer):
+            if length > len(self._buffer):
+                # Grow the buffer. Copies into a new bytearray, so memoryviews
+                # returned by receive_message are not resized.
+                buf = bytearray(max(length, 2*len(self._buffer)))
+            else:
+                buf = self._buffer
+            buf[0:buffered] = self._buffer[self._start:self._end]
+            self._buffer = buf
+            self._start = 0
+            self._end = buffered
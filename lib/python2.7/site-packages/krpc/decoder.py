@@ -1,8 +1,9 @@
-from google.protobuf.internal import decoder as protobuf_decoder
 from krpc.types import Types, ValueType, MessageType, ClassType, EnumType
 from krpc.types import ListType, DictionaryType, SetType, TupleType
 import krpc.platform
 from krpc.platform import hexlify
+from krpc.lazy import LazyList, LazyDict
+import struct
 
 class Decoder(object):
     """ Routines for decoding messages and values from the protocol buffer serialization format """
@@ -21,38 +22,172 @@ class Decoder(object):
                          hexlify(data[8:10]), hexlify(data[10:16])))
 
     @classmethod
-    def decode(cls, data, typ):
-        """ Given a python type, and serialized data, decode the value """
+    def decode(cls, data, typ, numpy=False, lazy=False):
+        """ Given a python type, and serialized data, decode the value. If numpy is
+            true, tuples of doubles and floats, and lists of doubles or floats, are
+            decoded into numpy arrays of float64. If lazy is true, other lists and
+            dictionaries are decoded into a LazyList or LazyDict, whose items are
+            decoded when they are accessed. """
+        if numpy:
+            decoder = typ._numpy_decoder
+            if decoder is None:
+                decoder = typ._numpy_decoder = cls.compile_numpy(typ)
+            if lazy and decoder is typ._decoder:
+                # Not decoded into a numpy array
+                decoder = typ._lazy_decoder
+                if decoder is None:
+                    decoder = typ._lazy_decoder = cls.compile_lazy(typ)
+        elif lazy:
+            decoder = typ._lazy_decoder
+            if decoder is None:
+                decoder = typ._lazy_decoder = cls.compile_lazy(typ)
+        else:
+            decoder = typ._decoder
+            if decoder is None:
+                decoder = typ._decoder = cls.compile(typ)
+        return decoder(data)
+
+    @classmethod
+    def compile(cls, typ):
+        """ Build a function that decodes values of the given type. The function for a
+            collection type calls the functions for its value types directly. """
         if isinstance(typ, MessageType):
-            return cls._decode_message(data, typ)
+            return lambda data: cls._decode_message(data, typ)
         elif isinstance(typ, EnumType):
-            value = cls._decode_value(data, cls._types.as_type('int32'))
-            return typ.python_type(value)
+            decode_int32 = _value_decoders['int32']
+            # The python type of an enumeration is set after the type object is created
+            return lambda data: typ.python_type(decode_int32(data))
         elif isinstance(typ, ValueType):
-            return cls._decode_value(data, typ)
+            return _value_decoders[typ.protobuf_type]
         elif isinstance(typ, ClassType):
-            object_id_typ = cls._types.as_type('uint64')
-            object_id = cls._decode_value(data, object_id_typ)
-            return typ.python_type(object_id) if object_id != 0 else None
+            def decode_class(data):
+                object_id = _decode_varint(data, 0)[0]
+                return typ.python_type(object_id) if object_id != 0 else None
+            return decode_class
         elif isinstance(typ, ListType):
-            msg = cls._decode_message(data, cls._types.as_type('KRPC.List'))
-            return [cls.decode(item, typ.value_type) for item in msg.items]
+            decode_item = cls._compiled(typ.value_type)
+            list_type = cls._types.as_type('KRPC.List')
+            def decode_list(data):
+                items = _repeated_field(data)
+                if items is None:
+                    items = cls._decode_message(data, list_type).items
+                return [decode_item(item) for item in items]
+            return decode_list
         elif isinstance(typ, DictionaryType):
-            msg = cls._decode_message(data, cls._types.as_type('KRPC.Dictionary'))
-            return dict((cls.decode(entry.key, typ.key_type), cls.decode(entry.value, typ.value_type)) for entry in msg.entries)
+            decode_key = cls._compiled(typ.key_type)
+            decode_value = cls._compiled(typ.value_type)
+            dictionary_type = cls._types.as_type('KRPC.Dictionary')
+            def decode_dictionary(data):
+                entries = _repeated_field(data)
+                if entries is not None:
+                    entries = [_dictionary_entry(entry) for entry in entries]
+                if entries is None or None in entries:
+                    msg = cls._decode_message(data, dictionary_type)
+                    entries = [(entry.key, entry.value) for entry in msg.entries]
+                return dict((decode_key(key), decode_value(value)) for key,value in entries)
+            return decode_dictionary
         elif isinstance(typ, SetType):
-            msg = cls._decode_message(data, cls._types.as_type('KRPC.Set'))
-            return set(cls.decode(item, typ.value_type) for item in msg.items)
+            decode_item = cls._compiled(typ.value_type)
+            set_type = cls._types.as_type('KRPC.Set')
+            def decode_set(data):
+                items = _repeated_field(data)
+                if items is None:
+                    items = cls._decode_message(data, set_type).items
+                return set(decode_item(item) for item in items)
+            return decode_set
         elif isinstance(typ, TupleType):
-            msg = cls._decode_message(data, cls._types.as_type('KRPC.Tuple'))
-            return tuple(cls.decode(item, value_type) for item,value_type in zip(msg.items,typ.value_types))
+            decode_items = [cls._compiled(value_type) for value_type in typ.value_types]
+            tuple_type = cls._types.as_type('KRPC.Tuple')
+            # A tuple of doubles and floats is encoded as items with the same
+            # tag and size, so is unpacked in one go when the data has the expected length
+            fixed = _fixed_tuple_struct(typ.value_types)
+            def decode_tuple(data):
+                if fixed is not None and len(data) == fixed.size:
+                    return fixed.unpack(data)
+                items = _repeated_field(data)
+                if items is None:
+                    items = cls._decode_message(data, tuple_type).items
+                return tuple(decode(item) for item,decode in zip(items,decode_items))
+            return decode_tuple
         else:
             raise RuntimeError ('Cannot decode type %s' % str(typ))
 
+    @classmethod
+    def compile_numpy(cls, typ):
+        """ Build a function that decodes values of the given type into a numpy array,
+            for the types that numpy arrays are returned for. Returns the function built
+            by compile for other types. The items of a collection are read from the
+            data by a strided view, rather than decoded one at a time. """
+        import numpy
+        decode = cls._compiled(typ)
+        if isinstance(typ, TupleType) and _numpy_item_types(typ.value_types):
+            dtypes = _numpy_item_types(typ.value_types)
+            if len(set(dtypes)) > 1:
+                # Already unpacked in one go by the compiled decoder
+                return lambda data: numpy.array(decode(data), dtype=numpy.float64)
+            # Each item is its tag and size followed by the value, so the
+            # items are read as an array of (header, value) records
+            record_type = numpy.dtype([('header', '<u2'), ('value', dtypes[0])])
+            size = len(dtypes) * record_type.itemsize
+            def decode_tuple(data):
+                if len(data) != size:
+                    return numpy.array(decode(data), dtype=numpy.float64)
+                return numpy.frombuffer(data, record_type)['value'].astype(numpy.float64)
+            return decode_tuple
+        elif isinstance(typ, ListType) and _numpy_item_types([typ.value_type]):
+            dtype = _numpy_item_types([typ.value_type])[0]
+            record_type = numpy.dtype([('header', '<u2'), ('value', dtype)])
+            # Tag and size of each item, read as a little-endian uint16
+            header = _ITEM_TAG | ((record_type.itemsize - 2) << 8)
+            def decode_list(data):
+                if len(data) % record_type.itemsize != 0:
+                    return numpy.array(decode(data), dtype=numpy.float64)
+                records = numpy.frombuffer(data, record_type)
+                if not (records['header'] == header).all():
+                    return numpy.array(decode(data), dtype=numpy.float64)
+                return records['value'].astype(numpy.float64)
+            return decode_list
+        return decode
+
+    @classmethod
+    def compile_lazy(cls, typ):
+        """ Build a function that decodes lists into a LazyList, and dictionaries into
+            a LazyDict. Only the outermost collection is lazy. Returns the function
+            built by compile for other types. """
+        if isinstance(typ, ListType):
+            decode_item = cls._compiled(typ.value_type)
+            list_type = cls._types.as_type('KRPC.List')
+            def decode_list(data):
+                items = _repeated_field(data)
+                if items is None:
+                    items = list(cls._decode_message(data, list_type).items)
+                return LazyList(items, decode_item)
+            return decode_list
+        elif isinstance(typ, DictionaryType):
+            decode_key = cls._compiled(typ.key_type)
+            decode_value = cls._compiled(typ.value_type)
+            dictionary_type = cls._types.as_type('KRPC.Dictionary')
+            def decode_dictionary(data):
+                entries = _repeated_field(data)
+                if entries is not None:
+                    entries = [_dictionary_entry(entry) for entry in entries]
+                if entries is None or None in entries:
+                    msg = cls._decode_message(data, dictionary_type)
+                    entries = [(entry.key, entry.value) for entry in msg.entries]
+                return LazyDict(entries, decode_key, decode_value)
+            return decode_dictionary
+        return cls._compiled(typ)
+
+    @classmethod
+    def _compiled(cls, typ):
+        if typ._decoder is None:
+            typ._decoder = cls.compile(typ)
+        return typ._decoder
+
     @classmethod
     def decode_size_and_position(cls, data):
         """ Decode a varint and return the (size, position) """
-        return protobuf_decoder._DecodeVarint(data, 0)
+        return _decode_varint(data, 0)
 
     @classmethod
     def decode_delimited(cls, data, typ):
@@ -61,6 +196,13 @@ class Decoder(object):
         (size, position) = cls.decode_size_and_position(data)
         return cls.decode(data[position:position+size], typ)
 
+    @classmethod
+    def split_items(cls, data):
+        """ Split the encoded items of a message whose only field is a repeated
+            message field numbered 1, such as a KRPC.Services message, without
+            decoding them. Returns None if the message contains other fields. """
+        return _repeated_field(data)
+
     @classmethod
     def _decode_message(cls, data, typ):
         message = typ.python_type()
@@ -69,7 +211,99 @@ class Decoder(object):
 
     @classmethod
     def _decode_value(cls, data, typ):
-        return getattr(_ValueDecoder, 'decode_' + typ.protobuf_type)(data)
+        return _value_decoders[typ.protobuf_type](data)
+
+_byte = ord if krpc.platform.PY2 else int
+
+def _decode_varint(data, position):
+    """ Decode a varint starting at the given position, and return the (value, position)
+        after it. Raises IndexError if the data ends before the varint. """
+    value = _byte(data[position])
+    position += 1
+    if value < 128:
+        return value, position
+    value &= 0x7f
+    shift = 7
+    while True:
+        b = _byte(data[position])
+        position += 1
+        value |= (b & 0x7f) << shift
+        if b < 128:
+            return value, position
+        shift += 7
+
+# Tag of the repeated items/entries field (numbered 1) of KRPC.List, KRPC.Set,
+# KRPC.Tuple and KRPC.Dictionary, and of the key field of KRPC.DictionaryEntry
+_ITEM_TAG = 0x0a
+# Tag of the value field of KRPC.DictionaryEntry
+_VALUE_TAG = 0x12
+
+def _repeated_field(data):
+    """ Split the encoded items of a collection message, or return None if the
+        data contains fields other than the items """
+    items = []
+    position = 0
+    end = len(data)
+    try:
+        while position < end:
+            if _byte(data[position]) != _ITEM_TAG:
+                return None
+            size = _byte(data[position+1])
+            if size < 128:
+                position += 2
+            else:
+                size, position = _decode_varint(data, position+1)
+            items.append(data[position:position+size])
+            position += size
+    except IndexError:
+        return None
+    if position != end:
+        return None
+    return items
+
+def _dictionary_entry(data):
+    """ Split an encoded dictionary entry into its key and value, or return None
+        if it contains other fields """
+    key = value = b''
+    position = 0
+    end = len(data)
+    try:
+        while position < end:
+            tag = _byte(data[position])
+            size, position = _decode_varint(data, position+1)
+            if tag == _ITEM_TAG:
+                key = data[position:position+size]
+            elif tag == _VALUE_TAG:
+                value = data[position:position+size]
+            else:
+                return None
+            position += size
+    except IndexError:
+        return None
+    if position != end:
+        return None
+    return key, value
+
+def _fixed_tuple_struct(value_types):
+    """ Return a struct for unpacking an encoded tuple whose values are all doubles
+        or floats, skipping the tag and size of each item. Otherwise returns None. """
+    formats = {'double': '2xd', 'float': '2xf'}
+    if len(value_types) == 0 or not all(isinstance(typ, ValueType) and typ.protobuf_type in formats
+                                        for typ in value_types):
+        return None
+    return struct.Struct('<' + ''.join(formats[typ.protobuf_type] for typ in value_types))
+
+def _numpy_item_types(value_types):
+    """ Return the numpy dtypes of the encoded values if they are all doubles or floats.
+        Otherwise returns None. """
+    dtypes = {'double': '<f8', 'float': '<f4'}
+    if len(value_types) == 0 or not all(isinstance(typ, ValueType) and typ.protobuf_type in dtypes
+                                        for typ in value_types):
+        return None
+    return [dtypes[typ.protobuf_type] for typ in value_types]
+
+_double = struct.Struct('<d')
+_float = struct.Struct('<f')
 
 
 class _ValueDecoder(object):
@@ -77,11 +311,14 @@ class _ValueDecoder(object):
 
     @classmethod
     def _decode_signed_varint(cls, data):
-        return protobuf_decoder._DecodeSignedVarint(data, 0)[0]
+        value = _decode_varint(data, 0)[0]
+        if value > 0x7fffffffffffffff:
+            value -= (1 << 64)
+        return value
 
     @classmethod
     def _decode_varint(cls, data):
-        return protobuf_decoder._DecodeVarint(data, 0)[0]
+        return _decode_varint(data, 0)[0]
 
     @classmethod
     def decode_int32(cls, data):
@@ -99,70 +336,13 @@ class _ValueDecoder(object):
     def decode_uint64(cls, data):
         return cls._decode_varint(data)
 
-    # The code for the following two methods is taken from
-    # google.protobuf.internal.decoder._FloatDecoder and _DoubleDecoder
-    # Copyright 2008, Google Inc.
-    # See protobuf-license.txt distributed with this file
-
     @classmethod
     def decode_double(cls, data):
-        import struct
-        local_unpack = struct.unpack
-        b = (lambda x:x) if krpc.platform.PY2 else lambda x:x.encode('latin1')  ##PY25
-
-        # We expect a 64-bit value in little-endian byte order.  Bit 1 is the sign
-        # bit, bits 2-12 represent the exponent, and bits 13-64 are the significand.
-        double_bytes = data[0:8]
-
-        # If this value has all its exponent bits set and at least one significand
-        # bit set, it's not a number.  In Python 2.4, struct.unpack will treat it
-        # as inf or -inf.  To avoid that, we treat it specially.
-##!PY25    if ((double_bytes[7:8] in b'\x7F\xFF')
-##!PY25        and (double_bytes[6:7] >= b'\xF0')
-##!PY25        and (double_bytes[0:7] != b'\x00\x00\x00\x00\x00\x00\xF0')):
-        if ((double_bytes[7:8] in b('\x7F\xFF'))  ##PY25
-            and (double_bytes[6:7] >= b('\xF0'))  ##PY25
-            and (double_bytes[0:7] != b('\x00\x00\x00\x00\x00\x00\xF0'))):  ##PY25
-          return krpc.platform.NAN
-
-        # Note that we expect someone up-stack to catch struct.error and convert
-        # it to _DecodeError -- this way we don't have to set up exception-
-        # handling blocks every time we parse one value.
-        return local_unpack('<d', double_bytes)[0]
+        return _double.unpack(data[0:8])[0]
 
     @classmethod
     def decode_float(cls, data):
-        import struct
-        local_unpack = struct.unpack
-        b = (lambda x:x) if krpc.platform.PY2 else lambda x:x.encode('latin1')  ##PY25
-
-        # We expect a 32-bit value in little-endian byte order.  Bit 1 is the sign
-        # bit, bits 2-9 represent the exponent, and bits 10-32 are the significand.
-        float_bytes = data[0:4]
-
-        # If this value has all its exponent bits set, then it's non-finite.
-        # In Python 2.4, struct.unpack will convert it to a finite 64-bit value.
-        # To avoid that, we parse it specially.
-        if ((float_bytes[3:4] in b('\x7F\xFF'))  ##PY25
-##!PY25    if ((float_bytes[3:4] in b'\x7F\xFF')
-            and (float_bytes[2:3] >= b('\x80'))):  ##PY25
-##!PY25        and (float_bytes[2:3] >= b'\x80')):
-          # If at least one significand bit is set...
-          if float_bytes[0:3] != b('\x00\x00\x80'):  ##PY25
-##!PY25      if float_bytes[0:3] != b'\x00\x00\x80':
-            return krpc.platform.NAN
-          # If sign bit is set...
-          if float_bytes[3:4] == b('\xFF'):  ##PY25
-##!PY25      if float_bytes[3:4] == b'\xFF':
-            return krpc.platform.NEG_INF
-          return krpc.platform.POS_INF
-
-        # Note that we expect someone up-stack to catch struct.error and convert
-        # it to _DecodeError -- this way we don't have to set up exception-
-        # handling blocks every time we parse one value.
-        return local_unpack('<f', float_bytes)[0]
-
-    # End of code taken from google.protobuf.internal.decoder._FloatDecoder and _DoubleDecoder
+        return _float.unpack(data[0:4])[0]
 
     @classmethod
     def decode_bool(cls, data):
@@ -170,10 +350,14 @@ class _ValueDecoder(object):
 
     @classmethod
     def decode_string(cls, data):
-        (size, position) = protobuf_decoder._DecodeVarint(data, 0)
+        (size, position) = _decode_varint(data, 0)
         return data[position:position+size].decode('utf-8')
 
     @classmethod
     def decode_bytes(cls, data):
-        (size, position) = protobuf_decoder._DecodeVarint(data, 0)
+        (size, position) = _decode_varint(data, 0)
         return data[position:position+size]
+
+# Decoding functions for each protocol buffer value type
+_value_decoders = dict((name, getattr(_ValueDecoder, 'decode_' + name))
+                       for name in ('double', 'float', 'int32', 'int64', 'uint32', 'uint64', 'bool', 'string', 'bytes'))
@@ -1,7 +1,7 @@
-from google.protobuf.internal import encoder as protobuf_encoder
 from krpc.types import Types, ValueType, MessageType, ClassType, EnumType
 from krpc.types import ListType, DictionaryType, SetType, TupleType
 import platform
+import struct
 
 class Encoder(object):
     """ Routines for encoding messages and values in the protocol buffer serialization format """
@@ -31,89 +31,248 @@ class Encoder(object):
     @classmethod
     def encode(cls, x, typ):
         """ Encode a message or value of the given protocol buffer type """
+        encoder = typ._encoder
+        if encoder is None:
+            encoder = typ._encoder = cls.compile(typ)
+        return encoder(x)
+
+    @classmethod
+    def compile(cls, typ):
+        """ Build a function that encodes values of the given type. The function for a
+            collection type calls the functions for its value types directly. """
         if isinstance(typ, MessageType):
-            return x.SerializeToString()
+            return lambda x: x.SerializeToString()
         elif isinstance(typ, ValueType):
-            return cls._encode_value(x, typ)
+            return _value_encoders[typ.protobuf_type]
         elif isinstance(typ, EnumType):
-            return cls._encode_value(x.value, cls._types.as_type('int32'))
+            encode_int32 = _value_encoders['int32']
+            return lambda x: encode_int32(x.value)
         elif isinstance(typ, ClassType):
-            object_id = x._object_id if x is not None else 0
-            return cls._encode_value(object_id, cls._types.as_type('uint64'))
-        elif isinstance(typ, ListType):
-            msg = cls._types.as_type('KRPC.List').python_type()
-            msg.items.extend(cls.encode(item, typ.value_type) for item in x)
-            return msg.SerializeToString()
+            encode_uint64 = _value_encoders['uint64']
+            return lambda x: encode_uint64(x._object_id if x is not None else 0)
+        elif isinstance(typ, ListType) or isinstance(typ, SetType):
+            encode_item = cls._compiled(typ.value_type)
+            return lambda x: b''.join(_repeated_field(encode_item(item)) for item in x)
         elif isinstance(typ, DictionaryType):
-            msg = cls._types.as_type('KRPC.Dictionary').python_type()
-            entry_type = cls._types.as_type('KRPC.DictionaryEntry')
-            entries = []
-            for key,value in sorted(x.items(), key=lambda i: i[0]):
-                entry = entry_type.python_type()
-                entry.key = cls.encode(key, typ.key_type)
-                entry.value = cls.encode(value, typ.value_type)
-                entries.append(entry)
-            msg.entries.extend(entries)
-            return msg.SerializeToString()
-        elif isinstance(typ, SetType):
-            msg = cls._types.as_type('KRPC.Set').python_type()
-            msg.items.extend(cls.encode(item, typ.value_type) for item in x)
-            return msg.SerializeToString()
+            encode_key = cls._compiled(typ.key_type)
+            encode_value = cls._compiled(typ.value_type)
+            def encode_dictionary(x):
+                entries = []
+                for key,value in sorted(x.items(), key=lambda i: i[0]):
+                    # Fields with the default value (empty bytes) are omitted
+                    key = encode_key(key)
+                    value = encode_value(value)
+                    entry = (_bytes_field(_KEY_TAG, key) if len(key) > 0 else b'') + \
+                            (_bytes_field(_VALUE_TAG, value) if len(value) > 0 else b'')
+                    entries.append(_repeated_field(entry))
+                return b''.join(entries)
+            return encode_dictionary
         elif isinstance(typ, TupleType):
-            msg = cls._types.as_type('KRPC.Tuple').python_type()
-            msg.items.extend(cls.encode(item, value_type) for item,value_type in zip(x,typ.value_types))
-            return msg.SerializeToString()
+            encode_items = [cls._compiled(value_type) for value_type in typ.value_types]
+            return lambda x: b''.join(_repeated_field(encode(item)) for item,encode in zip(x,encode_items))
         else:
-            raise RuntimeError ('Cannot encode objects of type ' + str(type(x)))
+            raise RuntimeError ('Cannot encode objects of type ' + str(typ))
+
+    @classmethod
+    def encode_numpy(cls, x, typ):
+        """ Encode a numpy scalar or 1-dimensional numpy array as a value of the given
+            type. Returns None if the value cannot be encoded as that type. """
+        encoder = typ._numpy_encoder
+        if encoder is None:
+            encoder = typ._numpy_encoder = cls.compile_numpy(typ)
+        return encoder(x)
+
+    @classmethod
+    def compile_numpy(cls, typ):
+        """ Build a function that encodes numpy values as values of the given type, or
+            returns None for values it cannot encode. Numeric scalars are encoded as
+            numeric value types, and 1-dimensional arrays as lists and tuples. """
+        import numpy
+        if isinstance(typ, ValueType) and typ.protobuf_type in _numpy_scalar_kinds:
+            kinds = _numpy_scalar_kinds[typ.protobuf_type]
+            scalar_types = frozenset(t for t in numpy.sctypeDict.values() if numpy.dtype(t).kind in kinds)
+            encode = _value_encoders[typ.protobuf_type]
+            if typ.protobuf_type in ('double', 'float'):
+                # Packed directly, as numpy scalars can be converted to floats by struct
+                return lambda x: encode(x) if type(x) in scalar_types else None
+            convert = typ.python_type
+            return lambda x: encode(convert(x)) if type(x) in scalar_types else None
+        elif isinstance(typ, ListType) or isinstance(typ, TupleType):
+            if isinstance(typ, ListType):
+                value_types = None
+                count = None
+            else:
+                value_types = typ.value_types
+                count = len(value_types)
+            # Items that are all doubles or all floats are encoded in one go, as an
+            # array of (tag+size, value) records
+            item_types = value_types or [typ.value_type]
+            if all(isinstance(t, ValueType) for t in item_types) and \
+               len(set(t.protobuf_type for t in item_types)) == 1 and \
+               item_types[0].protobuf_type in ('double', 'float'):
+                dtype = '<f8' if item_types[0].protobuf_type == 'double' else '<f4'
+                record_type = numpy.dtype([('header', '<u2'), ('value', dtype)])
+                header = ord(_ITEM_TAG) | ((record_type.itemsize - 2) << 8)
+                if count is not None:
+                    # Tuples are short, so are packed with a struct
+                    fixed = struct.Struct('<' + ('Hd' if dtype == '<f8' else 'Hf') * count)
+                    def encode_tuple(x):
+                        if not isinstance(x, numpy.ndarray) or x.shape != (count,) or x.dtype.kind not in 'fiu':
+                            return None
+                        args = [header] * (2*count)
+                        args[1::2] = x.tolist()
+                        return fixed.pack(*args)
+                    return encode_tuple
+                def encode_array(x):
+                    if not isinstance(x, numpy.ndarray) or x.ndim != 1 or x.dtype.kind not in 'fiu':
+                        return None
+                    records = numpy.empty(len(x), record_type)
+                    records['header'] = header
+                    records['value'] = x
+                    return records.tobytes()
+                return encode_array
+            encode_items = [cls._compiled_numpy(t) for t in item_types]
+            def encode_items_array(x):
+                if not isinstance(x, numpy.ndarray) or x.ndim != 1 or \
+                   (count is not None and len(x) != count):
+                    return None
+                items = []
+                for i,item in enumerate(x):
+                    data = encode_items[i if count is not None else 0](item)
+                    if data is None:
+                        return None
+                    items.append(_repeated_field(data))
+                return b''.join(items)
+            return encode_items_array
+        return lambda x: None
+
+    @classmethod
+    def _compiled_numpy(cls, typ):
+        if typ._numpy_encoder is None:
+            typ._numpy_encoder = cls.compile_numpy(typ)
+        return typ._numpy_encoder
+
+    @classmethod
+    def _compiled(cls, typ):
+        if typ._encoder is None:
+            typ._encoder = cls.compile(typ)
+        return typ._encoder
 
     @classmethod
     def encode_delimited(cls, x, typ):
         """ Encode a message or value with size information
             (for use in a delimited communication stream) """
         data = cls.encode(x, typ)
-        delimiter = protobuf_encoder._VarintBytes(len(data))
-        return delimiter + data
+        return _varint(len(data)) + data
 
     @classmethod
     def _encode_value(cls, value, typ):
-        return getattr(_ValueEncoder, 'encode_' + typ.protobuf_type)(value)
+        return _value_encoders[typ.protobuf_type](value)
+
+class RequestTemplate(object):
+    """ Encodes KRPC.Request messages for calls to one procedure. The service and
+        procedure fields are encoded once, and the encoded arguments for each call
+        are appended to them, without building a message object. The result is the
+        same as encoding the message with Encoder.encode_delimited. """
+
+    # Tags of the KRPC.Request service, procedure and arguments fields, and the
+    # KRPC.Argument position and value fields
+    _SERVICE_TAG = b'\x0a'
+    _PROCEDURE_TAG = b'\x12'
+    _ARGUMENT_TAG = b'\x1a'
+    _POSITION_TAG = b'\x08'
+    _VALUE_TAG = b'\x12'
+
+    def __init__(self, service, procedure, nparams=0):
+        # Empty strings are not encoded, as in a proto3 message
+        self._prefix = b''.join(_bytes_field(tag, value.encode('utf-8'))
+                                for tag, value in ((self._SERVICE_TAG, service), (self._PROCEDURE_TAG, procedure))
+                                if value)
+        self._encoded = _varint(len(self._prefix)) + self._prefix
+        # Encoded position fields, indexed by argument position, for the procedure's
+        # nparams parameters. Not added to later, so templates can be shared by threads.
+        # The position field is omitted when it has the default value of 0.
+        self._positions = [self._POSITION_TAG + _varint(i) if i > 0 else b'' for i in range(nparams)]
+
+    def encode_delimited(self, arguments=None):
+        """ Encode a request, with size information, given a list of
+            (position, encoded value) pairs for its arguments """
+        if not arguments:
+            return self._encoded
+        varint = _varint
+        positions = self._positions
+        parts = [self._prefix]
+        for position, value in arguments:
+            if position < len(positions):
+                header = positions[position]
+            else:
+                header = self._POSITION_TAG + varint(position) if position > 0 else b''
+            field = self._VALUE_TAG + varint(len(value)) if len(value) > 0 else b''
+            parts.append(self._ARGUMENT_TAG + varint(len(header) + len(field) + len(value)) + header + field)
+            parts.append(value)
+        data = b''.join(parts)
+        return varint(len(data)) + data
+
+# Tags of the repeated items/entries field (numbered 1) of KRPC.List, KRPC.Set,
+# KRPC.Tuple and KRPC.Dictionary, and of the key and value fields of KRPC.DictionaryEntry
+_ITEM_TAG = b'\x0a'
+_KEY_TAG = b'\x0a'
+_VALUE_TAG = b'\x12'
+
+# The kinds of numpy scalar that are encoded as each numeric value type
+_numpy_scalar_kinds = {
+    'double': 'fiu', 'float': 'fiu',
+    'int32': 'iu', 'int64': 'iu', 'uint32': 'iu', 'uint64': 'iu',
+    'bool': 'b'
+}
+
+# Encoded varints for small values
+_small_varints = [struct.pack('B', i) for i in range(128)]
+
+def _varint(value):
+    """ Encode a non-negative integer as a varint """
+    if value < 128:
+        # Checked here, as a negative value would index the table from the end
+        if value < 0:
+            raise ValueError('Value must be non-negative, got %d' % value)
+        return _small_varints[value]
+    data = []
+    while value >= 128:
+        data.append(0x80 | (value & 0x7f))
+        value >>= 7
+    data.append(value)
+    return struct.pack('%dB' % len(data), *data)
+
+def _repeated_field(data):
+    return _ITEM_TAG + _varint(len(data)) + data
+
+def _bytes_field(tag, data):
+    return tag + _varint(len(data)) + data
+
+_double = struct.Struct('<d')
+_float = struct.Struct('<f')
 
 class _ValueEncoder(object):
     """ Routines for encoding values in the protocol buffer serialization format """
 
     @classmethod
     def encode_double(cls, value):
-        data = []
-        def write(x):
-            data.append(x)
-        encoder = protobuf_encoder.DoubleEncoder(1,False,False)
-        encoder(write, value)
-        return b''.join(data[1:]) # strips the tag value
+        return _double.pack(value)
 
     @classmethod
     def encode_float(cls, value):
-        data = []
-        def write(x):
-            data.append(x)
-        encoder = protobuf_encoder.FloatEncoder(1,False,False)
-        encoder(write, value)
-        return b''.join(data[1:]) # strips the tag value
+        return _float.pack(value)
 
     @classmethod
     def _encode_varint(cls, value):
-        data = []
-        def write(x):
-            data.append(x)
-        protobuf_encoder._VarintEncoder()(write, value)
-        return b''.join(data)
+        return _varint(value)
 
     @classmethod
     def _encode_signed_varint(cls, value):
-        data = []
-        def write(x):
-            data.append(x)
-        protobuf_encoder._SignedVarintEncoder()(write, value)
-        return b''.join(data)
+        if value < 0:
+            # Negative values are encoded as 64-bit two's complement
+            value += (1 << 64)
+        return _varint(value)
 
     @classmethod
     def encode_int32(cls, value):
@@ -125,26 +284,27 @@ class _ValueEncoder(object):
 
     @classmethod
     def encode_uint32(cls, value):
-        if value < 0:
-            raise ValueError('Value must be non-negative, got %d' % value)
         return cls._encode_varint(value)
 
     @classmethod
     def encode_uint64(cls, value):
-        if value < 0:
-            raise ValueError('Value must be non-negative, got %d' % value)
         return cls._encode_varint(value)
 
     @classmethod
     def encode_bool(cls, value):
-        return cls._encode_varint(value)
+        return b'\x01' if value else b'\x00'
 
     @classmethod
     def encode_string(cls, value):
-        size = cls._encode_varint(platform.bytelength(value))
         data = value.encode('utf-8')
-        return size + data
+        return _varint(len(data)) + data
 
     @classmethod
     def encode_bytes(cls, value):
-        return b''.join([cls._encode_varint(len(value)), value])
+        return _varint(len(value)) + value
+
+# Encoding functions for each protocol buffer value type
+_value_encoders = dict((name, getattr(_ValueEncoder, 'encode_' + name))
+                       for name in ('int32', 'int64', 'uint32', 'uint64', 'bool', 'string', 'bytes'))
+_value_encoders['double'] = _double.pack
+_value_encoders['float'] = _float.pack
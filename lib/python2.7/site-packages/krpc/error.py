@@ -3,6 +3,11 @@ class RPCError(RuntimeError):
     def __init__(self, message):
         super(RPCError, self).__init__(message)
 
+class RPCTimeoutError(RuntimeError):
+    """ Error raised when the response to an RPC is not received before its deadline """
+    def __init__(self, message):
+        super(RPCTimeoutError, self).__init__(message)
+
 class NetworkError(RuntimeError):
     """ Error raised when something goes wrong with the network connection """
     def __init__(self, address, port, message):
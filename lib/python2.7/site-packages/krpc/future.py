@@ -0,0 +1,117 @@
+from krpc.decoder import Decoder
+from krpc.error import RPCError, RPCTimeoutError
+import threading
+import time
+
+_callback_lock = threading.Lock()
+
+class Future(object):
+    """ The result of an RPC that has been sent to the server, but whose response
+        may not have been received yet. Calling result() blocks until the response
+        arrives, then returns the decoded return value (or raises the RPC's error).
+        A Future created without a client is completed by calling set_result or
+        set_exception. If raw is true, the result is the serialized return value,
+        rather than the value decoded as return_type. """
+
+    def __init__(self, client=None, return_type=None, raw=False):
+        self._client = client
+        self._return_type = return_type
+        self._raw = raw
+        self._response = None
+        self._sent = False
+        self._channel = None
+        self._sequence = None
+        # Set if callers of a coalesced property getter share the response
+        self._joined = False
+        # Set if a caller stopped waiting for the response because its deadline passed
+        self._timed_out = False
+        self._done = False
+        self._value = None
+        self._decoded = False
+        self._callbacks = []
+
+    def done(self):
+        """ Return true if the response for this RPC has been received """
+        return self._done
+
+    def result(self, timeout=None):
+        """ Wait for the response and return the result of the RPC. If a timeout is
+            given, raises RPCTimeoutError if the response has not been received within
+            that many seconds. The response is still received when it arrives. """
+        if not self._done:
+            if self._client is None:
+                raise RuntimeError('Result is not available yet')
+            if not self._sent:
+                raise RuntimeError('RPC has not been sent to the server')
+            deadline = None
+            if timeout is not None:
+                deadline = time.time() + timeout
+            if not self._client._wait_for(self, deadline):
+                raise RPCTimeoutError('Timed out waiting for the response to an RPC')
+        if not self._decoded:
+            self._decode()
+        if isinstance(self._value, Exception):
+            raise self._value
+        return self._value
+
+    def exception(self, timeout=None):
+        """ Wait for the response and return the error raised by the RPC, or None """
+        try:
+            self.result(timeout)
+        except Exception as e:
+            return e
+        return None
+
+    def add_done_callback(self, callback):
+        """ Call callback(future) when the future completes. If the future has
+            already completed, the callback is called immediately. """
+        with _callback_lock:
+            if not self._done:
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def set_result(self, value):
+        """ Complete the future with the given result """
+        self._value = value
+        self._decoded = True
+        self._complete()
+
+    def set_exception(self, exception):
+        """ Complete the future with the given error """
+        self.set_result(exception)
+
+    @property
+    def return_type(self):
+        """ The return type of the RPC """
+        return self._return_type
+
+    def _set_response(self, response):
+        """ Called by the client when the response for this RPC has been received """
+        self._response = response
+        self._complete()
+
+    def _complete(self):
+        with _callback_lock:
+            self._done = True
+            callbacks = self._callbacks
+            self._callbacks = []
+        for callback in callbacks:
+            callback(self)
+
+    def _decode(self):
+        response = self._response
+        if response is None:
+            # Decoded by another thread waiting for the same response
+            return
+        value = None
+        if response.has_error:
+            value = RPCError(response.error)
+        elif self._raw:
+            value = response.return_value
+        elif self._return_type is not None:
+            value = Decoder.decode(response.return_value, self._return_type,
+                                   self._client._numpy_results, self._client._lazy_collections)
+        self._value = value
+        self._decoded = True
+        self._response = None
@@ -0,0 +1,87 @@
+import collections
+
+_unset = object()
+
+class LazyList(collections.Sequence):
+    """ A list returned by an RPC, whose items are decoded when they are first
+        accessed. Supports len, indexing, slicing and iteration like a list.
+        A slice shares the decoded items with the list it was taken from. """
+
+    def __init__(self, items, decode, values=None, indices=None):
+        self._items = items
+        self._decode = decode
+        self._values = values if values is not None else [_unset] * len(items)
+        # Positions in items of the elements of a slice
+        self._indices = indices
+
+    def __len__(self):
+        if self._indices is not None:
+            return len(self._indices)
+        return len(self._items)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            indices = range(*index.indices(len(self)))
+            if self._indices is not None:
+                indices = [self._indices[i] for i in indices]
+            return LazyList(self._items, self._decode, self._values, indices)
+        if self._indices is not None:
+            index = self._indices[index]
+        value = self._values[index]
+        if value is _unset:
+            value = self._values[index] = self._decode(self._items[index])
+        return value
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __eq__(self, other):
+        if isinstance(other, (LazyList, list)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(list(self))
+
+class LazyDict(collections.Mapping):
+    """ A dictionary returned by an RPC. The keys are decoded when the dictionary
+        is first looked up or iterated over, and each value when it is first accessed. """
+
+    def __init__(self, entries, decode_key, decode_value):
+        self._entries = entries
+        self._decode_key = decode_key
+        self._decode_value = decode_value
+        self._values = [_unset] * len(entries)
+        self._indices = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __getitem__(self, key):
+        i = self._index()[key]
+        value = self._values[i]
+        if value is _unset:
+            value = self._values[i] = self._decode_value(self._entries[i][1])
+        return value
+
+    def __iter__(self):
+        return iter(self._index())
+
+    def __contains__(self, key):
+        return key in self._index()
+
+    def _index(self):
+        """ Return a dictionary mapping the decoded keys to entry indices """
+        if self._indices is None:
+            self._indices = dict((self._decode_key(key), i) for i,(key,_) in enumerate(self._entries))
+        return self._indices
+
+    def __repr__(self):
+        return repr(dict(self.items()))
@@ -0,0 +1,68 @@
+import hashlib
+import os
+import re
+import tempfile
+
+# Directory used when a cache directory is not given
+DEFAULT_DIRECTORY = os.path.join(os.path.expanduser('~'), '.krpc', 'services')
+
+def fingerprint(data):
+    """ Return the fingerprint of a serialized KRPC.Services message """
+    return hashlib.sha1(data).hexdigest()
+
+class SchemaCache(object):
+    """ Stores the serialized KRPC.Services messages received from servers on disk, so
+        that reconnecting to a server does not need to download them again. Entries are
+        keyed by the address, port and version of the server, and hold the fingerprint
+        of the message, which is checked when it is loaded. A server whose services
+        change without its version changing, for example when a mod is installed,
+        needs its entry to be removed. """
+
+    def __init__(self, directory=None):
+        self._directory = directory or DEFAULT_DIRECTORY
+
+    def load(self, address, port, version):
+        """ Return the serialized Services message stored for a server, or None if there
+            is no entry for it, or the entry does not match its fingerprint """
+        try:
+            with open(self._path(address, port, version), 'rb') as f:
+                expected = f.readline().strip().decode('ascii')
+                data = f.read()
+        except (IOError, OSError, UnicodeDecodeError):
+            return None
+        if fingerprint(data) != expected:
+            return None
+        return data
+
+    def store(self, address, port, version, data):
+        """ Store the serialized Services message for a server. Errors writing the
+            entry are ignored, as the message is fetched again on the next connect. """
+        path = self._path(address, port, version)
+        try:
+            if not os.path.isdir(self._directory):
+                os.makedirs(self._directory)
+            # Write to a temporary file first, so that clients connecting at the same
+            # time never read a partly written entry
+            fd, tmp_path = tempfile.mkstemp(dir=self._directory)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(fingerprint(data).encode('ascii') + b'\n')
+                f.write(data)
+            try:
+                os.rename(tmp_path, path)
+            except OSError:
+                # Windows does not replace existing files
+                os.remove(path)
+                os.rename(tmp_path, path)
+        except (IOError, OSError):
+            pass
+
+    def remove(self, address, port, version):
+        """ Remove the entry for a server, if there is one """
+        try:
+            os.remove(self._path(address, port, version))
+        except OSError:
+            pass
+
+    def _path(self, address, port, version):
+        name = '%s-%d-%s.services' % (address, port, version)
+        return os.path.join(self._directory, re.sub(r'[^A-Za-z0-9_.-]', '_', name))
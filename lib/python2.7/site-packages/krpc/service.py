@@ -1,10 +1,19 @@
 import keyword
-from collections import defaultdict
-import xml.etree.ElementTree as ElementTree
+import logging
+import re
+import importlib
+import threading
+from collections import defaultdict, OrderedDict
 from krpc.attributes import Attributes
-from krpc.types import Types, DynamicType, DefaultArgument
+from krpc.types import Types, DynamicType, ClassBase, DefaultArgument, _create_enum_type
 from krpc.decoder import Decoder
-from krpc.utils import snake_case
+from krpc.utils import snake_case, LazyPattern
+from krpc.schemacache import fingerprint
+
+# Package that krpc.stubgen writes the generated service modules to
+STUBS_PACKAGE = 'krpc_stubs'
+
+_logger = logging.getLogger(__name__)
 
 def _signature(param_types, return_type):
     """ Generate a signature for a procedure that can be used as its docstring """
@@ -37,10 +46,9 @@ def _update_param_names(names):
         newnames.append(name)
     return newnames
 
-def _construct_func(invoke, service_name, procedure_name, prefix_param_names, param_names,
-                    param_types, param_required, param_default, return_type):
-    """ Build function to invoke a remote procedure """
-
+def _func_params(prefix_param_names, param_names, param_types, param_required, param_default):
+    """ Return the source of the parameter list of a function to invoke a remote
+        procedure, the source of the list of arguments it passes, and the parameter names """
     prefix_param_names = _update_param_names(prefix_param_names)
     param_names = _update_param_names(param_names)
 
@@ -50,22 +58,38 @@ def _construct_func(invoke, service_name, procedure_name, prefix_param_names, pa
             name += ' = DefaultArgument('+repr(_as_literal(default,typ))+')'
         params.append(name)
 
+    return ', '.join(prefix_param_names + params), '['+','.join(param_names)+']', param_names
+
+def _receiver_name(name, param_names):
+    """ Return a name for the parameter a function is bound with, that does not
+        clash with the names of the procedure's parameters """
+    while name in param_names:
+        name = '_' + name
+    return name
+
+def _construct_func(method, service_name, procedure_name, prefix_param_names, param_names,
+                    param_types, param_required, param_default, signature):
+    """ Build function to invoke a remote procedure. The function's first parameter is
+        the service object, class or class instance it is bound to, and the procedure
+        is invoked by calling the given method of its client. """
+
+    params, args, param_names = _func_params(prefix_param_names, param_names, param_types,
+                                             param_required, param_default)
+    client = (prefix_param_names + param_names)[0] + '._client'
+
     invoke_args = [
         '\''+str(service_name)+'\'',
         '\''+str(procedure_name)+'\'',
-        '['+','.join(param_names)+']',
+        args,
         '{}',
         'param_names',
-        'param_types',
-        'return_type'
+        '*signature.types('+client+')'
     ]
-    code = 'lambda ' + ', '.join(prefix_param_names + params) + ': invoke('+', '.join(invoke_args)+')'
+    code = 'lambda ' + params + ': '+client+'.'+method+'('+', '.join(invoke_args)+')'
     context = {
-        'invoke': invoke,
         'DefaultArgument': DefaultArgument,
         'param_names': param_names,
-        'param_types': param_types,
-        'return_type': return_type
+        'signature': signature
     }
     return eval(code, context)
 
@@ -114,6 +138,7 @@ def _parse_documentation_content(node):
 def _parse_documentation(xml):
     if xml.strip() == '':
         return ''
+    import xml.etree.ElementTree as ElementTree
     parser = ElementTree.XMLParser(encoding='UTF-8')
     root = ElementTree.XML(xml.encode('UTF-8'), parser=parser)
     summary = ''
@@ -136,32 +161,364 @@ def _parse_documentation(xml):
         params = ''
     return '\n\n'.join(filter(lambda x: x != '', [summary, params, returns, note]))
 
-def create_service(client, service):
-    """ Create a new service type """
-    cls = type(
-        str(service.name),
+class _Documentation(object):
+    """ A docstring, parsed from its XML documentation when it is first read """
+
+    def __init__(self, xml):
+        self._xml = xml
+        self._doc = None
+
+    def __get__(self, obj, cls=None):
+        if self._doc is None:
+            self._doc = _parse_documentation(self._xml)
+        return self._doc
+
+class _ServiceDocumentation(_Documentation):
+    """ The docstring of a service, parsed when it is first read """
+
+    def __init__(self):
+        super(_ServiceDocumentation, self).__init__(None)
+
+    def __get__(self, obj, cls=None):
+        module = _stub_module(cls)
+        if module is not None:
+            return module.DOCUMENTATION
+        if self._xml is None:
+            self._xml = _service_message(cls).documentation
+        return super(_ServiceDocumentation, self).__get__(obj, cls)
+
+class _LazyMember(object):
+    """ A method or property whose docstring is parsed from its XML documentation when
+        it is first used. The member is then added to the class in its place. """
+
+    def __init__(self, name, add, xml):
+        self._name = name
+        # Called with the docstring to add the member
+        self._add = add
+        self._xml = xml
+        self._added = False
+
+    def _owner(self, obj, cls):
+        """ Add the member, and return the object or class to look it up on """
+        if not self._added:
+            self._add(_parse_documentation(self._xml))
+            self._added = True
+        return obj if obj is not None else cls
+
+    def __get__(self, obj, cls=None):
+        return getattr(self._owner(obj, cls), self._name)
+
+    def __set__(self, obj, value):
+        setattr(self._owner(obj, None), self._name, value)
+
+    def __delete__(self, obj):
+        delattr(self._owner(obj, None), self._name)
+
+def _add_lazy_member(cls, name, add, xml):
+    """ Add a member to a class, whose docstring is parsed when it is first used """
+    setattr(cls, name, _LazyMember(name, add, xml))
+
+class _ClassDocumentation(object):
+    """ The docstring of a class type. It is set when the types of the class's
+        service are added, which is done when it is first read if need be. """
+
+    def __init__(self, schema, service_name):
+        self._schema = schema
+        self._service_name = service_name
+        # The docstring, or a _Documentation to parse it from
+        self.doc = None
+
+    def __get__(self, obj, cls=None):
+        if self.doc is None and self._service_name in self._schema.services:
+            _add_types(self._schema.services[self._service_name])
+        if isinstance(self.doc, _Documentation):
+            return self.doc.__get__(obj, cls)
+        return self.doc
+
+class _Signature(object):
+    """ The parameter and return types of a procedure, as type strings. The functions
+        that invoke a procedure are shared by clients, and use it to get the type
+        objects of the client making the call. """
+
+    __slots__ = ('_param_types', '_return_type')
+
+    def __init__(self, param_types, return_type):
+        self._param_types = param_types
+        self._return_type = return_type
+
+    def types(self, client):
+        """ Return the parameter types and return type of the procedure, as type objects
+            of the given client. They are created on the client's first call. """
+        types = client._signatures.get(self)
+        if types is None:
+            as_type = client._types.as_type
+            types = ([as_type(x) for x in self._param_types],
+                     as_type(self._return_type) if self._return_type is not None else None)
+            client._signatures[self] = types
+        return types
+
+def _bind_func(service_name, procedure_name, prefix_param_names, param_names,
+               param_types, param_required, param_default, return_type, build=True):
+    """ Build the function to invoke a remote procedure, with the function that builds
+        its request, unless build is false """
+    signature = _Signature([typ.protobuf_type for typ in param_types],
+                           return_type.protobuf_type if return_type is not None else None)
+    func = _construct_func('_invoke', service_name, procedure_name, prefix_param_names, param_names,
+                           param_types, param_required, param_default, signature)
+    if build:
+        build_request = _construct_func('_build_request', service_name, procedure_name, prefix_param_names,
+                                        param_names, param_types, param_required, param_default, signature)
+        setattr(func, '_build_request', build_request)
+    setattr(func, '_signature', signature)
+    return func
+
+# Matches the name of the service that a class or enumeration type string refers to
+_re_type_service_name = LazyPattern(r'(?:Class|Enum)\(([^\.\(\)]+)\.')
+
+def _referenced_services(service):
+    """ Return the names of the other services whose classes and enumerations
+        are used by the procedures of a service """
+    names = set()
+    for procedure in service.procedures:
+        for param in procedure.parameters:
+            names.update(_re_type_service_name.findall(param.type))
+        if procedure.has_return_type:
+            names.update(_re_type_service_name.findall(procedure.return_type))
+        for attr in procedure.attributes:
+            names.update(_re_type_service_name.findall(attr))
+    names.discard(service.name)
+    return names
+
+def split_services(data):
+    """ Split a serialized KRPC.Services message into the name and serialized
+        Service message of each service, without decoding the services """
+    items = Decoder.split_items(data)
+    if items is None:
+        import krpc.schema.KRPC
+        services = krpc.schema.KRPC.Services()
+        services.ParseFromString(data)
+        return [(service.name, service.SerializeToString()) for service in services.services]
+    return [(_service_name(item), item) for item in items]
+
+def _service_name(data):
+    """ Return the name of a service from its serialized Service message """
+    # The name is field 1, so is normally encoded first
+    if data[:1] == b'\x0a':
+        size, position = Decoder.decode_size_and_position(data[1:11])
+        return data[1+position:1+position+size].decode('utf-8')
+    import krpc.schema.KRPC
+    service = krpc.schema.KRPC.Service()
+    service.ParseFromString(data)
+    return service.name
+
+def load_stubs(services_fingerprint, package=STUBS_PACKAGE):
+    """ Return the package of service modules generated by krpc.stubgen, if it can be
+        imported and was generated from the Services message with the given fingerprint """
+    try:
+        stubs = importlib.import_module(package)
+    except ImportError:
+        return None
+    except Exception:
+        _logger.exception('Failed to import %s, building the services at runtime', package)
+        return None
+    if getattr(stubs, 'FINGERPRINT', None) != services_fingerprint:
+        return None
+    return stubs
+
+def bind_procedure(factory, param_types, return_type):
+    """ Create the function that invokes a procedure, from its factory in a module
+        generated by krpc.stubgen and the type strings of its parameters and return value """
+    signature = _Signature(param_types, return_type)
+    func = factory(signature)
+    setattr(func, '_signature', signature)
+    return func
+
+# Schemas shared by the clients in this process, keyed by the fingerprint
+# of their serialized KRPC.Services message
+_schemas = {}
+_schemas_lock = threading.Lock()
+
+def load_schema(data):
+    """ Return the schema for a serialized KRPC.Services message. Clients connected
+        to servers with the same services share a schema. """
+    key = fingerprint(data)
+    with _schemas_lock:
+        schema = _schemas.get(key)
+        if schema is None:
+            schema = _schemas[key] = Schema(data, key)
+        return schema
+
+class Schema(object):
+    """ The services described by a serialized KRPC.Services message. Holds the type of
+        each service and the base type of each class type, to which their members are
+        added, and is shared by the clients connected to servers with these services.
+        Each client subclasses these types to bind them to its connection. Modules
+        generated by krpc.stubgen for the services are used, if present. """
+
+    def __init__(self, data, key=None):
+        self.fingerprint = key or fingerprint(data)
+        # Held while decoding services, and adding their types and members
+        self.lock = threading.RLock()
+        # Types used to parse the procedures of the services
+        self.types = Types(self)
+        # Property getters of the services, as (service, procedure)
+        self.property_getters = set()
+        # Base types of the class types, keyed by (service, class), the names of the
+        # classes defined by each service, and the enumeration types, keyed by
+        # (service, enumeration)
+        self._class_bases = {}
+        self._class_names = defaultdict(set)
+        self._enum_types = {}
+        # Service types, keyed by name
+        stubs = load_stubs(self.fingerprint)
+        self.services = OrderedDict()
+        for name, service in split_services(data):
+            self.services[name] = _create_service_type(self, name, service, stubs)
+
+    def class_base(self, service_name, class_name):
+        """ Return the base type of a class type, which holds the class's members """
+        key = (service_name, class_name)
+        base = self._class_bases.get(key)
+        if base is None:
+            with self.lock:
+                base = self._class_bases.get(key)
+                if base is None:
+                    base = self._class_bases[key] = type(
+                        str(class_name), (ClassBase,),
+                        {'_service_name': service_name, '_class_name': class_name, '__slots__': (),
+                         '__doc__': _ClassDocumentation(self, service_name)})
+        return base
+
+    def add_class(self, service_name, class_name, doc):
+        """ Add a class type defined by a service """
+        self.class_base(service_name, class_name).__dict__['__doc__'].doc = doc
+        self._class_names[service_name].add(class_name)
+
+    def class_names(self, service_name):
+        """ Return the names of the class types defined by a service, whose types have been added """
+        return self._class_names.get(service_name, ())
+
+    def add_enumeration(self, service_name, enum_name, values, doc):
+        """ Add an enumeration type defined by a service, and return its python type """
+        typ = _create_enum_type(service_name, enum_name, values, doc)
+        self._enum_types[(service_name, enum_name)] = typ
+        return typ
+
+    def enum_type(self, service_name, enum_name):
+        """ Return the python type of an enumeration type, or None if the services do not define it """
+        if service_name in self.services:
+            _add_types(self.services[service_name])
+        return self._enum_types.get((service_name, enum_name))
+
+def _create_service_type(schema, name, data, stubs):
+    """ Create the type of a service, from its name and serialized Service message.
+        The message is decoded, and the service's classes, enumerations and members added,
+        when the service is first used. If the package of generated service modules is
+        given, they are added by the service's module instead. """
+    return type(
+        str(name),
         (ServiceBase,),
         {
-            '_client': client,
-            '_name': service.name,
-            '__doc__': _parse_documentation(service.documentation)
+            '_schema': schema,
+            '_name': name,
+            '_service': None,
+            '_service_data': data,
+            '_stub': stubs.SERVICES.get(name) if stubs is not None else None,
+            '_types_added': False,
+            '_materializing': False,
+            '_materialized': False,
+            '__doc__': _ServiceDocumentation()
         }
     )
 
-    # Add class types to service
-    for cls2 in service.classes:
-        cls._add_service_class(cls2)
+def create_service(client, cls):
+    """ Create the service object of a client, from the type of the service in its schema """
+    client_cls = type(cls.__name__, (cls,), {'_client': client, '__doc__': cls.__dict__['__doc__']})
+    client._services[cls._name] = client_cls
+    return client_cls()
 
-    # Add enumeration types to service
-    for enum in service.enumerations:
-        cls._add_service_enumeration(enum)
+def _shared(cls):
+    """ Return the type of a service in its schema, given the service type of a client """
+    return cls._schema.services[cls._name]
 
-    # Add procedures
-    for procedure in service.procedures:
-        if Attributes.is_a_procedure(procedure.attributes):
-            cls._add_service_procedure(procedure)
+def _service_message(cls):
+    """ Return the Service message of a service, decoding it if it has not been decoded """
+    cls = _shared(cls)
+    with cls._schema.lock:
+        if cls._service is None:
+            cls._service = Decoder.decode(cls._service_data, cls._schema.types.as_type('KRPC.Service'))
+            cls._service_data = None
+    return cls._service
+
+def _stub_module(cls):
+    """ Return the generated module of a service, or None if it does not have one. If the
+        module cannot be imported, it is logged and the service is built at runtime instead. """
+    cls = _shared(cls)
+    stub = cls._stub
+    if stub is None:
+        return None
+    try:
+        return importlib.import_module(stub)
+    except Exception:
+        _logger.exception('Failed to import %s, building the %s service at runtime', stub, cls._name)
+        cls._stub = None
+        return None
+
+def _add_types(cls):
+    """ Add the class and enumeration types of a service """
+    cls = _shared(cls)
+    if cls._types_added:
+        return
+    with cls._schema.lock:
+        if cls._types_added:
+            return
+
+        module = _stub_module(cls)
+        if module is not None:
+            module.add_types(cls)
+        else:
+            service = _service_message(cls)
+
+            # Add class types to service
+            for cls2 in service.classes:
+                cls._add_service_class(cls2)
 
-    # Add properties
+            # Add enumeration types to service
+            for enum in service.enumerations:
+                cls._add_service_enumeration(enum)
+
+        cls._types_added = True
+
+def _add_members(cls):
+    """ Add the procedures, properties and class members of a service """
+    module = _stub_module(cls)
+    if module is not None:
+        module.add_members(cls)
+        return
+    procedures, properties, class_methods, class_static_methods, class_properties = \
+        _group_members(_service_message(cls))
+    for procedure in procedures:
+        cls._add_service_procedure(procedure)
+    for name, getter, setter in properties:
+        cls._add_service_property(name, getter, setter)
+    for class_name, method_name, procedure in class_methods:
+        cls._add_service_class_method(class_name, method_name, procedure)
+    for class_name, method_name, procedure in class_static_methods:
+        cls._add_service_class_static_method(class_name, method_name, procedure)
+    for class_name, property_name, getter, setter in class_properties:
+        cls._add_service_class_property(class_name, property_name, getter, setter)
+
+def _group_members(service):
+    """ Group the procedures of a service into its members. Returns its procedures,
+        the (name, getter, setter) of its properties, the (class name, method name,
+        procedure) of its class methods and static class methods, and the (class name,
+        property name, getter, setter) of its class properties. """
+
+    # Procedures
+    procedures = [procedure for procedure in service.procedures
+                  if Attributes.is_a_procedure(procedure.attributes)]
+
+    # Properties
     properties = defaultdict(lambda: [None,None])
     for procedure in service.procedures:
         if Attributes.is_a_property_accessor(procedure.attributes):
@@ -170,61 +527,118 @@ def create_service(client, service):
                 properties[name][0] = procedure
             else:
                 properties[name][1] = procedure
-    for name, procedures in properties.items():
-        cls._add_service_property(name, procedures[0], procedures[1])
+    properties = [(name, getter, setter) for name, (getter, setter) in properties.items()]
 
-    # Add class methods
+    # Class methods
+    class_methods = []
     for procedure in service.procedures:
         if Attributes.is_a_class_method(procedure.attributes):
             class_name = Attributes.get_class_name(procedure.attributes)
             method_name = Attributes.get_class_method_name(procedure.attributes)
-            cls._add_service_class_method(class_name, method_name, procedure)
+            class_methods.append((class_name, method_name, procedure))
 
-    # Add static class methods
+    # Static class methods
+    class_static_methods = []
     for procedure in service.procedures:
         if Attributes.is_a_class_static_method(procedure.attributes):
             class_name = Attributes.get_class_name(procedure.attributes)
             method_name = Attributes.get_class_method_name(procedure.attributes)
-            cls._add_service_class_static_method(class_name, method_name, procedure)
+            class_static_methods.append((class_name, method_name, procedure))
 
-    # Add class properties
-    properties = defaultdict(lambda: [None,None])
+    # Class properties
+    class_properties = defaultdict(lambda: [None,None])
     for procedure in service.procedures:
         if Attributes.is_a_class_property_accessor(procedure.attributes):
             class_name = Attributes.get_class_name(procedure.attributes)
             property_name = Attributes.get_class_property_name(procedure.attributes)
             key = (class_name, property_name)
             if Attributes.is_a_class_property_getter(procedure.attributes):
-                properties[key][0] = procedure
+                class_properties[key][0] = procedure
             else:
-                properties[key][1] = procedure
-    for (class_name, property_name), procedures in properties.items():
-        cls._add_service_class_property(class_name, property_name, procedures[0], procedures[1])
+                class_properties[key][1] = procedure
+    class_properties = [(class_name, property_name, getter, setter)
+                        for (class_name, property_name), (getter, setter) in class_properties.items()]
 
-    return cls()
+    return procedures, properties, class_methods, class_static_methods, class_properties
 
 class ServiceBase(DynamicType):
-    """ Base class for service objects, created at runtime using information received from the server. """
+    """ Base class for service objects, created at runtime using information received from the server.
+        The members of a service are added when one of its attributes is first accessed.
+        Each client has a subclass of the service's type, which binds it to the client. """
+
+    _client = None
+
+    def __getattr__(self, name):
+        cls = type(self)
+        if not name.startswith('__'):
+            materialized = cls._materialized
+            if not materialized:
+                cls._materialize()
+            # Class types are bound to the client, so are added to its subclass
+            if name in cls._schema.class_names(cls._name):
+                python_type = cls._client._types.as_type('Class(' + cls._name + '.' + name + ')').python_type
+                setattr(cls, name, python_type)
+                return python_type
+            # Not materialized if called while the service is being materialized
+            if not materialized and cls._materialized:
+                return getattr(self, name)
+        raise AttributeError('\'%s\' object has no attribute \'%s\'' % (cls.__name__, name))
+
+    def __setattr__(self, name, value):
+        type(self)._materialize()
+        super(ServiceBase, self).__setattr__(name, value)
+
+    def __dir__(self):
+        cls = type(self)
+        cls._materialize()
+        return sorted(set(dir(cls)) | set(self.__dict__) | set(cls._schema.class_names(cls._name)))
+
+    @classmethod
+    def _materialize(cls):
+        """ Add the types and members of the service, if not already added. The services
+            it refers to are then materialized too, so that the objects and enumeration
+            values this service returns can be used. """
+        if cls._materialized:
+            return
+        cls = _shared(cls)
+        schema = cls._schema
+        with schema.lock:
+            # Services can refer to each other
+            if cls._materialized or cls._materializing:
+                return
+            cls._materializing = True
+            try:
+                module = _stub_module(cls)
+                if module is not None:
+                    referenced = module.REFERENCED_SERVICES
+                else:
+                    referenced = sorted(_referenced_services(_service_message(cls)))
+                _add_types(cls)
+                _add_members(cls)
+                for name in referenced:
+                    if name in schema.services:
+                        schema.services[name]._materialize()
+                cls._materialized = True
+            finally:
+                cls._materializing = False
 
     @classmethod
     def _add_service_class(cls, remote_cls):
         """ Add a class type """
-        name = remote_cls.name
-        class_type = cls._client._types.as_type('Class(' + cls._name + '.' + name + ')', _parse_documentation(remote_cls.documentation))
-        setattr(cls, name, class_type.python_type)
+        cls._schema.add_class(cls._name, remote_cls.name, _Documentation(remote_cls.documentation))
 
     @classmethod
     def _add_service_enumeration(cls, enum):
         """ Add an enumeration type """
         name = enum.name
-        enum_type = cls._client._types.as_type('Enum(' + cls._name + '.' + name + ')', _parse_documentation(enum.documentation))
-        enum_type.set_values(dict((str(snake_case(x.name)), x.value) for x in enum.values))
-        setattr(cls, name, enum_type.python_type)
+        values = dict((str(snake_case(x.name)), x.value) for x in enum.values)
+        setattr(cls, name, cls._schema.add_enumeration(cls._name, name, values, _Documentation(enum.documentation)))
 
     @classmethod
     def _parse_procedure(cls, procedure):
+        types = cls._schema.types
         param_names = [snake_case(param.name) for param in procedure.parameters]
-        param_types = [cls._client._types.get_parameter_type(i, param.type, procedure.attributes) for i,param in enumerate(procedure.parameters)]
+        param_types = [types.get_parameter_type(i, param.type, procedure.attributes) for i,param in enumerate(procedure.parameters)]
         param_required = [not param.has_default_argument for param in procedure.parameters]
         param_default = []
         for param,typ in zip(procedure.parameters, param_types):
@@ -234,89 +648,72 @@ class ServiceBase(DynamicType):
                 param_default.append(None)
         return_type = None
         if procedure.has_return_type:
-            return_type = cls._client._types.get_return_type(procedure.return_type, procedure.attributes)
+            return_type = types.get_return_type(procedure.return_type, procedure.attributes)
         return param_names, param_types, param_required, param_default, return_type
 
     @classmethod
     def _add_service_procedure(cls, procedure):
         """ Add a procedure """
         param_names, param_types, param_required, param_default, return_type = cls._parse_procedure(procedure)
-        func = _construct_func(cls._client._invoke, cls._name, procedure.name, [], param_names, param_types, param_required, param_default, return_type)
-        build_request = _construct_func(cls._client._build_request, cls._name, procedure.name, [], param_names, param_types, param_required, param_default, return_type)
-        setattr(func, '_build_request', build_request)
-        setattr(func, '_return_type', return_type)
+        func = _bind_func(cls._name, procedure.name, [_receiver_name('self', param_names)], param_names, param_types, param_required, param_default, return_type)
         name = str(snake_case(procedure.name))
-        return cls._add_static_method(name, func, doc=_parse_documentation(procedure.documentation))
+        _add_lazy_member(cls, name, lambda doc: cls._add_method(name, func, doc=doc), procedure.documentation)
 
     @classmethod
     def _add_service_property(cls, name, getter=None, setter=None):
         """ Add a property """
-        doc = None
-        if getter:
-            doc = _parse_documentation(getter.documentation)
-        elif setter:
-            doc = _parse_documentation(setter.documentation)
+        xml = getter.documentation if getter else setter.documentation
         if getter:
             getter_name = getter.name
+            cls._schema.property_getters.add((cls._name, getter_name))
             _,_,_,_,return_type = cls._parse_procedure(getter)
-            getter = _construct_func(cls._client._invoke, cls._name, getter_name, ['self'], [], [], [], [], return_type)
-            build_request = _construct_func(cls._client._build_request, cls._name, getter_name, ['self'], [], [], [], [], return_type)
-            setattr(getter, '_build_request', build_request)
-            setattr(getter, '_return_type', return_type)
+            getter = _bind_func(cls._name, getter_name, ['self'], [], [], [], [], return_type)
         if setter:
             param_names, param_types, _,_,_ = cls._parse_procedure(setter)
-            setter = _construct_func(cls._client._invoke, cls._name, setter.name, ['self'], param_names, param_types, [True], [None], None)
+            setter = _bind_func(cls._name, setter.name, [_receiver_name('self', param_names)], param_names, param_types, [True], [None], None, build=False)
         name = str(snake_case(name))
-        return cls._add_property(name, getter, setter, doc=doc)
+        _add_lazy_member(cls, name, lambda doc: cls._add_property(name, getter, setter, doc=doc), xml)
 
     @classmethod
     def _add_service_class_method(cls, class_name, method_name, procedure):
         """ Add a method to a class """
-        class_cls = cls._client._types.as_type('Class('+cls._name+'.'+class_name+')').python_type
+        class_cls = cls._schema.class_base(cls._name, class_name)
         param_names, param_types, param_required, param_default, return_type = cls._parse_procedure(procedure)
         # Rename this to self if it doesn't cause a name clash
         if 'self' not in param_names:
             param_names[0] = 'self'
-        func = _construct_func(cls._client._invoke, cls._name, procedure.name, [], param_names, param_types, param_required, param_default, return_type)
-        build_request = _construct_func(cls._client._build_request, cls._name, procedure.name, [], param_names, param_types, param_required, param_default, return_type)
-        setattr(func, '_build_request', build_request)
-        setattr(func, '_return_type', return_type)
+        func = _bind_func(cls._name, procedure.name, [], param_names, param_types, param_required, param_default, return_type)
         name = str(snake_case(method_name))
-        class_cls._add_method(name, func, doc=_parse_documentation(procedure.documentation))
+        _add_lazy_member(class_cls, name, lambda doc: class_cls._add_method(name, func, doc=doc),
+                         procedure.documentation)
 
     @classmethod
     def _add_service_class_static_method(cls, class_name, method_name, procedure):
-        """ Add a static method to a class """
-        class_cls = cls._client._types.as_type('Class('+cls._name+'.'+class_name+')').python_type
+        """ Add a static method to a class. It is added as a class method, whose
+            class is bound to the client that invokes the procedure. """
+        class_cls = cls._schema.class_base(cls._name, class_name)
         param_names, param_types, param_required, param_default, return_type = cls._parse_procedure(procedure)
-        func = _construct_func(cls._client._invoke, cls._name, procedure.name, [], param_names, param_types, param_required, param_default, return_type)
-        build_request = _construct_func(cls._client._build_request, cls._name, procedure.name, [], param_names, param_types, param_required, param_default, return_type)
-        setattr(func, '_build_request', build_request)
-        setattr(func, '_return_type', return_type)
+        func = _bind_func(cls._name, procedure.name, [_receiver_name('cls', param_names)], param_names, param_types, param_required, param_default, return_type)
         name = str(snake_case(method_name))
-        class_cls._add_static_method(name, func, doc=_parse_documentation(procedure.documentation))
+        _add_lazy_member(class_cls, name, lambda doc: class_cls._add_class_method(name, func, doc=doc),
+                         procedure.documentation)
 
     @classmethod
     def _add_service_class_property(cls, class_name, property_name, getter=None, setter=None):
         """ Add a property to a class """
-        class_cls = cls._client._types.as_type('Class('+cls._name+'.'+class_name+')').python_type
-        doc = None
-        if getter:
-            doc = _parse_documentation(getter.documentation)
-        elif setter:
-            doc = _parse_documentation(setter.documentation)
+        class_cls = cls._schema.class_base(cls._name, class_name)
+        xml = getter.documentation if getter else setter.documentation
         if getter:
             getter_name = getter.name
+            cls._schema.property_getters.add((cls._name, getter_name))
             param_names, param_types, param_required, param_default, return_type = cls._parse_procedure(getter)
             # Rename this to self if it doesn't cause a name clash
             if 'self' not in param_names:
                 param_names[0] = 'self'
-            getter = _construct_func(cls._client._invoke, cls._name, getter_name, [], param_names, param_types, [True], [None], return_type)
-            build_request = _construct_func(cls._client._build_request, cls._name, getter_name, [], param_names, param_types, [True], [None], return_type)
-            setattr(getter, '_build_request', build_request)
-            setattr(getter, '_return_type', return_type)
+            getter = _bind_func(cls._name, getter_name, [], param_names, param_types, [True], [None], return_type)
         if setter:
             param_names, param_types, param_required, param_default, return_type = cls._parse_procedure(setter)
-            setter = _construct_func(cls._client._invoke, cls._name, setter.name, [], param_names, param_types, [True,True], [None,None], None)
+            setter = _bind_func(cls._name, setter.name, [], param_names, param_types, [True,True], [None,None], None, build=False)
         property_name = str(snake_case(property_name))
-        return class_cls._add_property(property_name, getter, setter, doc=doc)
+        _add_lazy_member(class_cls, property_name,
+                         lambda doc: class_cls._add_property(property_name, getter, setter, doc=doc), xml)
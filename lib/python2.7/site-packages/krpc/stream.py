@@ -1,49 +1,29 @@
 from krpc.types import Types
 from krpc.decoder import Decoder
 from krpc.error import RPCError
+import logging
 import socket
 import threading
 
 _stream_cache = {}
 _stream_cache_lock = threading.Lock()
-
-class StreamExistsError(RuntimeError):
-    def __init__(self, stream_id):
-        self.stream_id = stream_id
+# Types of the messages received from the stream server
+_types = Types()
+_logger = logging.getLogger(__name__)
 
 class Stream(object):
     """ A streamed request. When invoked, returns the most recent value of the request. """
 
-    def __init__(self, conn, func, *args, **kwargs):
+    def __init__(self, conn, stream_id, request, return_type, value):
         self._conn = conn
-        self._func = func
-        self._args = args
-        self._kwargs = kwargs
-        # Get the request and return type
-        if func == getattr:
-            # A property or class property getter
-            attr = func(args[0].__class__, args[1])
-            self._request = attr.fget._build_request(args[0])
-            self._return_type = attr.fget._return_type
-        elif func == setattr:
-            # A property setter
-            raise ValueError('Cannot stream a property setter')
-        elif hasattr(func, '__self__'):
-            # A method
-            self._request = func._build_request(func.__self__, *args, **kwargs)
-            self._return_type = func._return_type
-        else:
-            # A class method
-            self._request = func._build_request(*args, **kwargs)
-            self._return_type = func._return_type
-        # Set the initial value by running the RPC once
-        self._value = func(*args, **kwargs)
-        # Add the stream to the server and add the initial value to the cache
-        with _stream_cache_lock:
-            self._stream_id = self._conn.krpc.add_stream(self._request)
-            if self._stream_id in _stream_cache:
-                raise StreamExistsError(self._stream_id)
-            _stream_cache[self._stream_id] = self
+        self._stream_id = stream_id
+        self._request = request
+        self._return_type = return_type
+        self._value = value
+        self._callbacks = []
+        # Set while the stream was added by the client's AutoStreamer, and not also by
+        # a call to add_stream, so may be removed by the AutoStreamer once unused
+        self._auto = False
 
     def __call__(self):
         """ Get the most recent value for this stream """
@@ -54,66 +34,109 @@ class Stream(object):
     def remove(self):
         """ Remove the stream """
         with _stream_cache_lock:
-            if self._stream_id in _stream_cache:
-                self._conn.krpc.remove_stream(self._stream_id)
-                del _stream_cache[self._stream_id]
-                self._value = RuntimeError('Stream has been removed')
+            self._remove()
+
+    def _remove(self):
+        """ Remove the stream. Must be called with _stream_cache_lock held. """
+        if self._stream_id in _stream_cache:
+            self._conn.krpc.remove_stream(self._stream_id)
+            del _stream_cache[self._stream_id]
+            self._value = RuntimeError('Stream has been removed')
 
     @property
     def return_type(self):
         """ The return type of this stream """
         return self._return_type
 
+    def add_callback(self, callback):
+        """ Call callback(value) whenever the stream receives a new value. Callbacks are
+            called from the thread that receives stream updates, so should return quickly. """
+        self._callbacks.append(callback)
+
+    def remove_callback(self, callback):
+        """ Remove a callback added using add_callback """
+        self._callbacks.remove(callback)
+
     def update(self, value):
-        """ Update the stream's most recent value """
-        self._value = value
+        """ Update the stream's most recent value, then run the callbacks.
+            Callbacks are run without _stream_cache_lock held, and an exception
+            raised by one is logged so that it does not stop the stream thread. """
+        with _stream_cache_lock:
+            if _stream_cache.get(self._stream_id) is not self:
+                # Removed while the update was being delivered
+                return
+            self._value = value
+        for callback in list(self._callbacks):
+            try:
+                callback(value)
+            except Exception:
+                _logger.exception('Stream callback %r raised an exception', callback)
 
 def add_stream(conn, func, *args, **kwargs):
     """ Create a stream and return it """
-    try:
-        return Stream(conn, func, *args, **kwargs)
-    except StreamExistsError as e:
-        return _stream_cache[e.stream_id]
+    if func == setattr:
+        # A property setter
+        raise ValueError('Cannot stream a property setter')
+    request, return_type = conn._build_call(func, *args, **kwargs)
+    # Set the initial value by running the RPC once
+    value = func(*args, **kwargs)
+    # Add the stream to the server and add the initial value to the cache
+    with _stream_cache_lock:
+        stream_id = conn.krpc.add_stream(request)
+        stream = _add_to_cache(conn, stream_id, request, return_type, value)
+        # The caller now removes the stream, if it was added by the AutoStreamer
+        stream._auto = False
+        return stream
+
+def _add_to_cache(conn, stream_id, request, return_type, value):
+    """ Add a stream that has been added to the server to the cache, and return it.
+        If the server returned the id of an existing stream, returns the existing
+        stream. Must be called with _stream_cache_lock held. """
+    if stream_id in _stream_cache:
+        return _stream_cache[stream_id]
+    stream = Stream(conn, stream_id, request, return_type, value)
+    _stream_cache[stream_id] = stream
+    return stream
 
 def update_thread(connection, stop):
-    stream_message_type = Types().as_type('KRPC.StreamMessage')
-    response_type = Types().as_type('KRPC.Response')
-
-    while True:
-
-        # Read the size and position of the response message
-        data = b''
-        while True:
-            try:
-                data += connection.partial_receive(1)
-                size,position = Decoder.decode_size_and_position(data)
-                break
-            except IndexError:
-                pass
-            except:
-                #TODO: is there a better way to catch exceptions when the thread is forcibly stopped (e.g. by CTRL+c)?
-                return
-            if stop.is_set():
-                connection.close()
-                return
-
-        # Read and decode the response message
-        data = connection.receive(size)
-        response = Decoder.decode(data, stream_message_type)
-
-        # Add the data to the cache
-        with _stream_cache_lock:
-            for response in response.responses:
-                id = response.id
-                if id not in _stream_cache:
-                    continue
-
-                # Check for an error response
-                if response.response.has_error:
-                    _stream_cache[id].value = RPCError(response.response.error)
-                    continue
-
-                # Decode the return value and store it in the cache
-                typ = _stream_cache[id].return_type
-                value = Decoder.decode(response.response.return_value, typ)
-                _stream_cache[id].update(value)
+    """ Receive stream messages from the server and update the stream cache.
+        Blocks until data arrives, and decodes every complete message that
+        has been received before blocking again. Exits when the connection
+        is shut down or closed. """
+    while not stop.is_set():
+
+        # Read the next stream message
+        try:
+            data = connection.receive_message()
+        except (socket.error, ValueError):
+            # Raised when the connection is shut down or closed
+            return
+        if stop.is_set():
+            return
+        process_message(data)
+
+def process_message(data):
+    """ Decode a KRPC.StreamMessage and update the streams in the cache """
+    message = Decoder.decode(data.tobytes(), _types.as_type('KRPC.StreamMessage'))
+
+    # Look up the streams and decode their values
+    updates = []
+    with _stream_cache_lock:
+        for response in message.responses:
+            id = response.id
+            if id not in _stream_cache:
+                continue
+            stream = _stream_cache[id]
+
+            # Check for an error response
+            if response.response.has_error:
+                updates.append((stream, RPCError(response.response.error)))
+                continue
+
+            value = Decoder.decode(response.response.return_value, stream.return_type,
+                                   stream._conn._numpy_results, stream._conn._lazy_collections)
+            updates.append((stream, value))
+
+    # Store the values in the cache and run the callbacks, without holding the lock
+    for stream, value in updates:
+        stream.update(value)
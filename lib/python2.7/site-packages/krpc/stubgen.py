@@ -0,0 +1,261 @@
+""" Generates a package of Python modules for the services of a kRPC server, which
+    clients use instead of building the services at runtime when connecting to a
+    server with the same services. Run with:
+
+        python -m krpc.stubgen [--address ADDRESS] [--rpc-port PORT] [--output DIRECTORY]
+
+    The package is written to DIRECTORY/krpc_stubs, and is used by clients that can
+    import it, for example scripts run from DIRECTORY. """
+
+import argparse
+import compileall
+import keyword
+import os
+import krpc
+from krpc.service import STUBS_PACKAGE, split_services, _service_message, _referenced_services, \
+    _group_members, _func_params, _receiver_name, _parse_documentation
+from krpc.schemacache import fingerprint
+from krpc.utils import snake_case
+
+_HEADER = '# Generated by krpc.stubgen from the services of a kRPC %s server. Do not edit.\n'
+
+def generate(conn, directory):
+    """ Write the package of modules for the services of the server a client is
+        connected to, in the given directory. Returns the path of the package. """
+    data = conn._get_services(False)
+    version = conn.krpc.get_status().version
+    files = {}
+    modules = {}
+    for name, _ in split_services(data):
+        module = _module_name(name)
+        service = conn._services[name]
+        service._materialize()
+        files[module + '.py'] = _service_source(service, version)
+        modules[name] = STUBS_PACKAGE + '.' + module
+    files['__init__.py'] = _package_source(version, fingerprint(data), modules)
+
+    path = os.path.join(directory, STUBS_PACKAGE)
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    # Remove the modules of services the server no longer has
+    for filename in os.listdir(path):
+        if filename.endswith(('.py', '.pyc')):
+            os.remove(os.path.join(path, filename))
+    for filename, source in files.items():
+        with open(os.path.join(path, filename), 'w') as f:
+            f.write(source)
+    compileall.compile_dir(path, quiet=True)
+    return path
+
+def _module_name(service_name):
+    name = str(snake_case(service_name))
+    if keyword.iskeyword(name):
+        name += '_'
+    return name
+
+def _package_source(version, services_fingerprint, modules):
+    lines = [_HEADER % version]
+    lines.append('VERSION = %r' % str(version))
+    lines.append('# Fingerprint of the KRPC.Services message the modules were generated from')
+    lines.append('FINGERPRINT = %r' % str(services_fingerprint))
+    lines.append('# Modules of the services, keyed by service name')
+    lines.append('SERVICES = {')
+    for name, module in sorted(modules.items()):
+        lines.append('    %r: %r,' % (str(name), module))
+    lines.append('}')
+    return '\n'.join(lines) + '\n'
+
+def _type_string(typ):
+    if typ is None:
+        return None
+    return str(typ.protobuf_type)
+
+def _type_strings(types):
+    return [_type_string(typ) for typ in types]
+
+class _ServiceSource(object):
+    """ Builds the source of the module for a service """
+
+    def __init__(self, cls):
+        self._cls = cls
+        self._name = str(cls._name)
+        # Functions that create the functions invoking each procedure
+        self._factories = []
+        self._members = []
+
+    def factory(self, procedure, member_name, prefix_param_names, param_names, param_types,
+                param_required, param_default, build=True):
+        """ Add the factory for a function that invokes a procedure, and return its name.
+            Unless build is false, the function also has a function that builds its request.
+            The function is named after the member it is added as, with a prefix so that
+            members named after keywords, such as print, are valid function names. """
+        func_name = '_invoke_' + member_name
+        params, args, param_names = _func_params(prefix_param_names, param_names, param_types,
+                                                 param_required, param_default)
+        client = (prefix_param_names + param_names)[0] + '._client'
+        call_args = '%r, %r, %s, {}, param_names, *signature.types(%s)' % \
+            (self._name, str(procedure.name), args, client)
+        name = '_' + str(procedure.name)
+        self._factories.extend([
+            'def %s(signature):' % name,
+            '    param_names = %r' % [str(x) for x in param_names],
+            '    def %s(%s):' % (func_name, params),
+            '        return %s._invoke(%s)' % (client, call_args)
+        ])
+        if build:
+            self._factories.extend([
+                '    def build_request(%s):' % params,
+                '        return %s._build_request(%s)' % (client, call_args),
+                '    %s._build_request = build_request' % func_name
+            ])
+        self._factories.extend([
+            '    return %s' % func_name,
+            ''
+        ])
+        return name
+
+    def member(self, *lines):
+        self._members.extend(lines)
+
+    def add_procedure(self, procedure):
+        param_names, param_types, param_required, param_default, return_type = \
+            self._cls._parse_procedure(procedure)
+        name = str(snake_case(procedure.name))
+        factory = self.factory(procedure, name, [_receiver_name('self', param_names)], param_names,
+                               param_types, param_required, param_default)
+        self.member(
+            'func = bind_procedure(%s, %r, %r)' % (factory, _type_strings(param_types), _type_string(return_type)),
+            'cls._add_method(%r, func, doc=%r)' % (name, _parse_documentation(procedure.documentation)))
+
+    def add_property(self, name, getter, setter):
+        name = str(snake_case(name))
+        doc = _parse_documentation((getter or setter).documentation)
+        getter_source = setter_source = 'None'
+        if getter:
+            _,_,_,_,return_type = self._cls._parse_procedure(getter)
+            factory = self.factory(getter, name, ['self'], [], [], [], [])
+            self.member('property_getters.add((%r, %r))' % (self._name, str(getter.name)))
+            getter_source = 'bind_procedure(%s, [], %r)' % (factory, _type_string(return_type))
+        if setter:
+            param_names, param_types, _,_,_ = self._cls._parse_procedure(setter)
+            factory = self.factory(setter, name, [_receiver_name('self', param_names)], param_names,
+                                   param_types, [True], [None], build=False)
+            setter_source = 'bind_procedure(%s, %r, None)' % (factory, _type_strings(param_types))
+        self.member(
+            'getter = %s' % getter_source,
+            'setter = %s' % setter_source,
+            'cls._add_property(%r, getter, setter, doc=%r)' % (name, doc))
+
+    def add_class_method(self, class_name, method_name, procedure, static):
+        param_names, param_types, param_required, param_default, return_type = \
+            self._cls._parse_procedure(procedure)
+        if static:
+            # Static methods are added as class methods, bound to the client's class
+            prefix_param_names = [_receiver_name('cls', param_names)]
+        else:
+            prefix_param_names = []
+            # Rename this to self if it doesn't cause a name clash
+            if 'self' not in param_names:
+                param_names[0] = 'self'
+        name = str(snake_case(method_name))
+        factory = self.factory(procedure, name, prefix_param_names, param_names, param_types,
+                               param_required, param_default)
+        self.member(
+            'func = bind_procedure(%s, %r, %r)' % (factory, _type_strings(param_types), _type_string(return_type)),
+            'class_base(%r, %r).%s(%r, func, doc=%r)' % \
+                (self._name, str(class_name), '_add_class_method' if static else '_add_method',
+                 name, _parse_documentation(procedure.documentation)))
+
+    def add_class_property(self, class_name, property_name, getter, setter):
+        name = str(snake_case(property_name))
+        doc = _parse_documentation((getter or setter).documentation)
+        getter_source = setter_source = 'None'
+        if getter:
+            param_names, param_types, _,_, return_type = self._cls._parse_procedure(getter)
+            # Rename this to self if it doesn't cause a name clash
+            if 'self' not in param_names:
+                param_names[0] = 'self'
+            factory = self.factory(getter, name, [], param_names, param_types, [True], [None])
+            self.member('property_getters.add((%r, %r))' % (self._name, str(getter.name)))
+            getter_source = 'bind_procedure(%s, %r, %r)' % \
+                (factory, _type_strings(param_types), _type_string(return_type))
+        if setter:
+            param_names, param_types, _,_,_ = self._cls._parse_procedure(setter)
+            factory = self.factory(setter, name, [], param_names, param_types, [True,True], [None,None],
+                                   build=False)
+            setter_source = 'bind_procedure(%s, %r, None)' % (factory, _type_strings(param_types))
+        self.member(
+            'getter = %s' % getter_source,
+            'setter = %s' % setter_source,
+            'class_base(%r, %r)._add_property(%r, getter, setter, doc=%r)' % \
+                (self._name, str(class_name), name, doc))
+
+    def source(self, service, version):
+        lines = [
+            _HEADER % version,
+            'from __future__ import absolute_import',
+            'from krpc.service import bind_procedure',
+            'from krpc.types import DefaultArgument',
+            '',
+            'DOCUMENTATION = %r' % _parse_documentation(service.documentation),
+            '',
+            '# Services whose classes and enumerations are used by this service',
+            'REFERENCED_SERVICES = %r' % [str(x) for x in sorted(_referenced_services(service))],
+            '',
+            'def add_types(cls):',
+            '    """ Add the class and enumeration types of the service """',
+            '    schema = cls._schema'
+        ]
+        for remote_cls in service.classes:
+            lines.append('    schema.add_class(%r, %r, %r)' % \
+                (self._name, str(remote_cls.name), _parse_documentation(remote_cls.documentation)))
+        for enum in service.enumerations:
+            values = sorted((str(snake_case(x.name)), x.value) for x in enum.values)
+            lines.append('    cls.%s = schema.add_enumeration(%r, %r, dict(%r), %r)' % \
+                (enum.name, self._name, str(enum.name), values, _parse_documentation(enum.documentation)))
+        lines.extend([
+            '',
+            'def add_members(cls):',
+            '    """ Add the procedures, properties and class members of the service """',
+            '    schema = cls._schema',
+            '    class_base = schema.class_base',
+            '    property_getters = schema.property_getters'
+        ])
+        lines.extend('    ' + line for line in self._members)
+        lines.append('')
+        lines.extend(self._factories)
+        return '\n'.join(lines)
+
+def _service_source(cls, version):
+    """ Return the source of the module for a service """
+    service = _service_message(cls)
+    source = _ServiceSource(cls)
+    procedures, properties, class_methods, class_static_methods, class_properties = _group_members(service)
+    for procedure in procedures:
+        source.add_procedure(procedure)
+    for name, getter, setter in properties:
+        source.add_property(name, getter, setter)
+    for class_name, method_name, procedure in class_methods:
+        source.add_class_method(class_name, method_name, procedure, False)
+    for class_name, method_name, procedure in class_static_methods:
+        source.add_class_method(class_name, method_name, procedure, True)
+    for class_name, property_name, getter, setter in class_properties:
+        source.add_class_property(class_name, property_name, getter, setter)
+    return source.source(service, version)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m krpc.stubgen',
+                                     description='Generate Python modules for the services of a kRPC server.')
+    parser.add_argument('--address', default=krpc.DEFAULT_ADDRESS, help='address of the server')
+    parser.add_argument('--rpc-port', type=int, default=krpc.DEFAULT_RPC_PORT, help='RPC port of the server')
+    parser.add_argument('--output', default='.', help='directory to write the %s package to' % STUBS_PACKAGE)
+    args = parser.parse_args(argv)
+    conn = krpc.connect(address=args.address, rpc_port=args.rpc_port, stream_port=None, name='stubgen')
+    try:
+        path = generate(conn, args.output)
+    finally:
+        conn.close()
+    print('Wrote %s' % path)
+
+if __name__ == '__main__':
+    main()
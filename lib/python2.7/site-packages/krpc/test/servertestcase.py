@@ -12,7 +12,7 @@ class ServerTestCase(object):
     def tearDown(self):
         self.conn.close()
 
-    def connect(self):
+    def connect(self, **kwargs):
         return krpc.connect(name='Python2ClientTest', address='localhost',
                             rpc_port=int(os.getenv('RPC_PORT', 50000)),
-                            stream_port=int(os.getenv('STREAM_PORT', 50001)))
+                            stream_port=int(os.getenv('STREAM_PORT', 50001)), **kwargs)
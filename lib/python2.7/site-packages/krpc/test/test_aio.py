@@ -0,0 +1,131 @@
+import unittest
+import os
+import time
+import krpc
+import krpc.aio
+from krpc.aio import Return
+
+class TestAio(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = krpc.aio.connect(name='Python2ClientTest', address='localhost',
+                                     rpc_port=int(os.getenv('RPC_PORT', 50000)),
+                                     stream_port=int(os.getenv('STREAM_PORT', 50001)))
+        self.loop = krpc.aio.EventLoop(self.conn)
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_procedure(self):
+        def main():
+            value = yield self.conn.test_service.float_to_string(3.14159)
+            raise Return(value)
+        self.assertEqual('3.14159', self.loop.run_until_complete(main()))
+
+    def test_property(self):
+        def main():
+            self.conn.test_service.string_property = 'foo'
+            value = yield self.conn.test_service.string_property
+            raise Return(value)
+        self.assertEqual('foo', self.loop.run_until_complete(main()))
+
+    def test_class_method(self):
+        def main():
+            obj = yield self.conn.test_service.create_test_object('bob')
+            value = yield obj.float_to_string(3.14159)
+            raise Return(value)
+        self.assertEqual('bob3.14159', self.loop.run_until_complete(main()))
+
+    def test_error(self):
+        def main():
+            try:
+                yield self.conn.test_service.throw_argument_exception()
+            except krpc.client.RPCError as e:
+                raise Return(str(e))
+        self.assertEqual('Invalid argument', self.loop.run_until_complete(main()))
+
+    def test_many_requests_in_flight(self):
+        def main():
+            futures = [self.conn.test_service.int32_to_string(i) for i in range(20)]
+            values = []
+            for future in futures:
+                values.append((yield future))
+            raise Return(values)
+        self.assertEqual([str(i) for i in range(20)], self.loop.run_until_complete(main()))
+
+    def test_concurrent_coroutines(self):
+        log = []
+        def worker(name, n):
+            for i in range(n):
+                value = yield self.conn.test_service.int32_to_string(i)
+                log.append((name, value))
+            raise Return(name)
+        def main():
+            tasks = [self.loop.spawn(worker(name, 5)) for name in ('guidance', 'ui', 'logger')]
+            results = []
+            for task in tasks:
+                results.append((yield task))
+            raise Return(results)
+        self.assertEqual(['guidance', 'ui', 'logger'], self.loop.run_until_complete(main()))
+        self.assertEqual(15, len(log))
+        # The coroutines were interleaved
+        self.assertNotEqual(['guidance']*5, [name for name,_ in log[:5]])
+
+    def test_nested_coroutine(self):
+        def inner(x):
+            value = yield self.conn.test_service.int32_to_string(x)
+            raise Return(value + '!')
+        def outer():
+            value = yield inner(42)
+            raise Return(value)
+        self.assertEqual('42!', self.loop.run_until_complete(outer()))
+
+    def test_buffered_responses(self):
+        futures = [self.conn.test_service.int32_to_string(i) for i in range(2)]
+        # Receive both responses into the connection's buffer, so the socket has
+        # nothing left for select to report
+        time.sleep(0.1)
+        connection = self.conn._rpc_channels[0].connection
+        connection._reserve(connection.BUFFER_SIZE)
+        connection._receive_into_buffer()
+        self.assertTrue(connection.has_message())
+        self.loop.sleep(1)
+        start = time.time()
+        self.loop._run_once()
+        self.assertLess(time.time() - start, 0.5)
+        self.assertEqual(['0', '1'], [future.result() for future in futures])
+
+    def test_sleep(self):
+        def main():
+            start = time.time()
+            yield self.loop.sleep(0.1)
+            raise Return(time.time() - start)
+        self.assertGreaterEqual(self.loop.run_until_complete(main()), 0.1)
+
+    def test_stream(self):
+        def main():
+            stream = yield self.conn.add_stream(self.conn.test_service.float_to_string, 3.14159)
+            self.assertEqual('3.14159', stream())
+            updates = krpc.aio.updates(stream)
+            values = []
+            for _ in range(3):
+                values.append((yield updates.next()))
+            updates.close()
+            stream.remove()
+            raise Return(values)
+        self.assertEqual(['3.14159']*3, self.loop.run_until_complete(main()))
+
+    def test_stream_counter(self):
+        def main():
+            stream = yield self.conn.add_stream(self.conn.test_service.counter)
+            updates = krpc.aio.updates(stream)
+            count = -1
+            for _ in range(3):
+                value = yield updates.next()
+                self.assertLess(count, value)
+                count = value
+            stream.remove()
+        self.loop.run_until_complete(main())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,25 @@
 import unittest
 import threading
+import time
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
 import krpc
+import krpc.future
+import krpc.lazy
+import krpc.schema.KRPC
+import krpc.schemacache
+import krpc.service
+import krpc.stream
+from krpc.coalesce import _within_tolerance
 from krpc.test.servertestcase import ServerTestCase
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 class TestClient(ServerTestCase, unittest.TestCase):
 
@@ -52,6 +70,20 @@ class TestClient(ServerTestCase, unittest.TestCase):
         self.assertEqual('6', self.conn.test_service.add_multiple_values(1L, 2L, 3L))
         self.assertRaises(TypeError, self.conn.test_service.float_to_string, '42')
 
+    @unittest.skipIf(numpy is None, 'requires numpy')
+    def test_numpy_parameters(self):
+        self.assertEqual('3.14159', self.conn.test_service.float_to_string(numpy.float32(3.14159)))
+        self.assertEqual('3.14159', self.conn.test_service.double_to_string(numpy.float64(3.14159)))
+        self.assertEqual('42', self.conn.test_service.double_to_string(numpy.int64(42)))
+        self.assertEqual('42', self.conn.test_service.int32_to_string(numpy.int32(42)))
+        self.assertEqual('True', self.conn.test_service.bool_to_string(numpy.bool_(True)))
+        self.assertEqual('6', self.conn.test_service.add_multiple_values(numpy.float64(1), numpy.int32(2), numpy.int64(3)))
+        self.assertEqual([1,2,3], self.conn.test_service.increment_list(numpy.array([0,1,2])))
+        self.assertEqual((2,3), self.conn.test_service.increment_tuple(numpy.array([1,2])))
+        self.assertRaises(TypeError, self.conn.test_service.int32_to_string, numpy.float64(42))
+        self.assertRaises(TypeError, self.conn.test_service.string_to_int32, numpy.float64(42))
+        self.assertRaises(TypeError, self.conn.test_service.increment_tuple, numpy.array([1,2,3]))
+
     def test_incorrect_parameter_type(self):
         self.assertRaises(TypeError, self.conn.test_service.float_to_string, 'foo')
         self.assertRaises(TypeError, self.conn.test_service.add_multiple_values, 0.14159, 'foo', 2)
@@ -160,6 +192,35 @@ class TestClient(ServerTestCase, unittest.TestCase):
         self.assertRaises(TypeError, self.conn.test_service.increment_set, None)
         self.assertRaises(TypeError, self.conn.test_service.increment_dictionary, None)
 
+    def test_lazy_collections(self):
+        self.conn.set_lazy_collections()
+        try:
+            l = self.conn.test_service.increment_list([0,1,2])
+            self.assertTrue(isinstance(l, krpc.lazy.LazyList))
+            self.assertEqual([1,2,3], l)
+            self.assertEqual([2,3,4], self.conn.test_service.increment_list(l))
+            d = self.conn.test_service.increment_dictionary({'a': 0, 'b': 1, 'c': 2})
+            self.assertTrue(isinstance(d, krpc.lazy.LazyDict))
+            self.assertEqual({'a': 1, 'b': 2, 'c': 3}, d)
+            self.assertEqual({'a': 2, 'b': 3, 'c': 4}, self.conn.test_service.increment_dictionary(d))
+            objects = self.conn.test_service.add_to_object_list([], 'jeb')
+            objects = self.conn.test_service.add_to_object_list(objects, 'bob')
+            self.assertEqual(2, len(objects))
+            self.assertEqual('value=jeb', objects[0].get_value())
+            self.assertEqual('value=bob', objects[1].get_value())
+            self.assertEqual((2,3), self.conn.test_service.increment_tuple((1,2)))
+        finally:
+            self.conn.set_lazy_collections(False)
+        self.assertEqual([1,2,3], self.conn.test_service.increment_list([0,1,2]))
+        self.assertTrue(isinstance(self.conn.test_service.increment_list([0,1,2]), list))
+
+    def test_interned_objects(self):
+        obj = self.conn.test_service.create_test_object('jeb')
+        self.assertTrue(obj is self.conn.test_service.echo_test_object(obj))
+        self.conn.test_service.object_property = obj
+        self.assertTrue(obj is self.conn.test_service.object_property)
+        self.assertTrue(obj is self.conn.test_service.add_to_object_list([obj], 'bob')[0])
+
     def test_nested_collections(self):
         self.assertEqual({}, self.conn.test_service.increment_nested_collection({}))
         self.assertEqual({'a': [1, 2], 'b': [], 'c': [3]},
@@ -174,9 +235,888 @@ class TestClient(ServerTestCase, unittest.TestCase):
         self.assertEqual("value=jeb", l[0].get_value())
         self.assertEqual("value=bob", l[1].get_value())
 
+    def test_raw_future(self):
+        future = krpc.future.Future(self.conn, raw=True)
+        self.conn._submit('TestService', 'FloatToString',
+                          self.conn._encode_request('TestService', 'FloatToString', [3.14159], {}, ['value'],
+                                                    [self.conn._types.as_type('float')]),
+                          None, future)
+        self.assertEqual(b'\x073.14159', future.result())
+        future = krpc.future.Future(self.conn, raw=True)
+        self.conn._submit('TestService', 'ThrowArgumentException',
+                          self.conn._encode_request('TestService', 'ThrowArgumentException'), None, future)
+        self.assertRaises(krpc.client.RPCError, future.result)
+
+    def test_pipelined(self):
+        futures = [self.conn.pipelined(self.conn.test_service.int32_to_string, i) for i in range(20)]
+        self.assertEqual([str(i) for i in range(20)], [f.result() for f in futures])
+
+    def test_pipelined_property(self):
+        self.conn.test_service.string_property = 'foo'
+        future = self.conn.pipelined(getattr, self.conn.test_service, 'string_property')
+        self.assertEqual('foo', future.result())
+        self.assertTrue(future.done())
+
+    def test_pipelined_class_method(self):
+        obj = self.conn.test_service.create_test_object('bob')
+        future = self.conn.pipelined(obj.float_to_string, 3.14159)
+        self.assertEqual('bob3.14159', future.result())
+
+    def test_pipelined_out_of_order_results(self):
+        f0 = self.conn.pipelined(self.conn.test_service.float_to_string, 0.123)
+        f1 = self.conn.pipelined(self.conn.test_service.float_to_string, 1.234)
+        self.assertEqual('42', self.conn.test_service.int32_to_string(42))
+        self.assertEqual('1.234', f1.result())
+        self.assertEqual('0.123', f0.result())
+
+    def test_pipelined_error(self):
+        future = self.conn.pipelined(self.conn.test_service.throw_argument_exception)
+        self.assertEqual('42', self.conn.test_service.int32_to_string(42))
+        with self.assertRaises(krpc.client.RPCError) as cm:
+            future.result()
+        self.assertEqual('Invalid argument', str(cm.exception))
+
+    def test_pipelined_property_setters_are_invalid(self):
+        self.assertRaises(ValueError, self.conn.pipelined, setattr, self.conn.test_service, 'string_property', 'foo')
+
+    def test_batch(self):
+        with self.conn.batch() as batch:
+            futures = [self.conn.test_service.int32_to_string(i) for i in range(20)]
+            self.assertFalse(any(f.done() for f in futures))
+            self.assertEqual(20, len(batch))
+        self.assertEqual([str(i) for i in range(20)], [f.result() for f in futures])
+        self.assertEqual([str(i) for i in range(20)], batch.results())
+
+    def test_batch_properties(self):
+        obj = self.conn.test_service.create_test_object('jeb')
+        with self.conn.batch():
+            obj.int_property = 42
+            self.conn.test_service.string_property = 'foo'
+            int_property = obj.int_property
+            string_property = self.conn.test_service.string_property
+        self.assertEqual(42, int_property.result())
+        self.assertEqual('foo', string_property.result())
+
+    def test_batch_add(self):
+        obj = self.conn.test_service.create_test_object('bob')
+        with self.conn.batch() as batch:
+            batch.add(obj.float_to_string, 3.14159)
+            batch.add(getattr, obj, 'int_property')
+            batch.add(self.conn.test_service.TestClass.static_method, 'foo')
+        self.assertEqual(['bob3.14159', 0, 'jebfoo'], batch.results())
+
+    def test_batch_error(self):
+        with self.conn.batch():
+            f0 = self.conn.test_service.throw_argument_exception()
+            f1 = self.conn.test_service.int32_to_string(42)
+        self.assertRaises(krpc.client.RPCError, f0.result)
+        self.assertEqual('42', f1.result())
+
+    def test_batch_result_inside_block(self):
+        with self.conn.batch():
+            future = self.conn.test_service.int32_to_string(42)
+            self.assertRaises(RuntimeError, future.result)
+        self.assertEqual('42', future.result())
+
+    def test_empty_batch(self):
+        with self.conn.batch() as batch:
+            pass
+        self.assertEqual([], batch.results())
+
+    def test_nested_batch(self):
+        with self.conn.batch() as batch0:
+            with self.conn.batch() as batch1:
+                future = self.conn.test_service.int32_to_string(42)
+            self.assertIs(batch0, batch1)
+            self.assertFalse(future.done())
+        self.assertEqual('42', future.result())
+
+    def test_batch_not_sent_on_exception(self):
+        try:
+            with self.conn.batch():
+                future = self.conn.test_service.int32_to_string(42)
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertRaises(RuntimeError, future.result)
+        self.assertEqual('42', self.conn.test_service.int32_to_string(42))
+
+    def test_batch_is_per_thread(self):
+        result = []
+        def thread_main():
+            result.append(self.conn.test_service.int32_to_string(42))
+        with self.conn.batch():
+            t = threading.Thread(target=thread_main)
+            t.start()
+            t.join()
+        self.assertEqual(['42'], result)
+
+    def test_rpc_connections(self):
+        conn = self.connect(rpc_connections=3)
+        self.assertEqual(3, len(conn._rpc_channels))
+        results = {}
+        def thread_main(i):
+            results[i] = [conn.test_service.int32_to_string(i*100+j) for j in range(50)]
+        threads = [threading.Thread(target=thread_main, args=(i,)) for i in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for i in range(6):
+            self.assertEqual([str(i*100+j) for j in range(50)], results[i])
+        with conn.stream(conn.test_service.float_to_string, 3.14159) as x:
+            self.assertEqual('3.14159', x())
+        conn.close()
+
+    def test_rpc_connections_keep_order_within_thread(self):
+        conn = self.connect(rpc_connections=3)
+        futures = [conn.pipelined(conn.test_service.int32_to_string, i) for i in range(20)]
+        self.assertEqual(1, len(set(future._channel for future in futures)))
+        self.assertEqual([str(i) for i in range(20)], [future.result() for future in futures])
+        conn.close()
+
+    def test_invalid_rpc_connections(self):
+        self.assertRaises(ValueError, self.connect, rpc_connections=0)
+
+    def test_invalid_stream_port(self):
+        threads = threading.active_count()
+        connections = self._record_rpc_connections()
+        self.assertRaises(krpc.error.NetworkError, krpc.connect, address='localhost',
+                          rpc_port=int(os.getenv('RPC_PORT', 50000)), stream_port=1,
+                          rpc_connections=2, reader_thread=True)
+        # The RPC connections are closed, and their reader threads have exited
+        self.assertEqual(2, len(connections))
+        self.assertTrue(all(self._closed(connection) for connection in connections))
+        self.assertEqual(threads, threading.active_count())
+
+    def test_invalid_extra_rpc_connection(self):
+        threads = threading.active_count()
+        connections = self._record_rpc_connections(fail_after=1)
+        self.assertRaises(krpc.error.NetworkError, self.connect, rpc_connections=3)
+        self.assertEqual(1, len(connections))
+        self.assertTrue(self._closed(connections[0]))
+        # The stream handshake has finished, and its connection was closed
+        self.assertEqual(threads, threading.active_count())
+
+    def _record_rpc_connections(self, fail_after=None):
+        """ Record the RPC connections opened by krpc.connect, failing to open
+            any after the first fail_after connections """
+        connections = []
+        connect_rpc = krpc._connect_rpc
+        def recording_connect_rpc(address, rpc_port, name):
+            if fail_after is not None and len(connections) >= fail_after:
+                raise krpc.error.NetworkError(address, rpc_port, 'Connection refused')
+            rpc_connection, client_identifier = connect_rpc(address, rpc_port, name)
+            connections.append(rpc_connection)
+            return rpc_connection, client_identifier
+        krpc._connect_rpc = recording_connect_rpc
+        self.addCleanup(setattr, krpc, '_connect_rpc', connect_rpc)
+        return connections
+
+    def _closed(self, connection):
+        try:
+            connection.fileno()
+        except socket.error:
+            return True
+        return False
+
+    def test_startup_profile(self):
+        conn = self.connect()
+        try:
+            profile = krpc.startup_profile()
+            self.assertEqual(set(['import', 'rpc_handshake', 'stream_handshake', 'stream_handshake_wait',
+                                  'message_types', 'schema_fetch', 'service_build', 'total']),
+                             set(profile.keys()))
+            self.assertTrue(all(x >= 0 for x in profile.values()))
+            self.assertTrue(profile['schema_fetch'] + profile['service_build'] <= profile['total'])
+            self.assertEqual('3.14159', conn.test_service.float_to_string(3.14159))
+        finally:
+            conn.close()
+        conn = krpc.connect(name='Python2ClientTest', address='localhost',
+                            rpc_port=int(os.getenv('RPC_PORT', 50000)), stream_port=None)
+        try:
+            self.assertFalse('stream_handshake' in krpc.startup_profile())
+        finally:
+            conn.close()
+
+    def test_import_defers_modules(self):
+        # Modules only needed once connected are not imported with the package
+        code = '\n'.join([
+            'import site, sys',
+            'site.addsitedir(%r)' % os.path.dirname(os.path.dirname(krpc.__file__)),
+            'import krpc',
+            'names = [\'google.protobuf\', \'krpc.schema.KRPC\', \'xml.etree.ElementTree\', \'enum\']',
+            'print(\' \'.join(name for name in names if name in sys.modules))'
+        ])
+        output = subprocess.check_output([sys.executable, '-c', code])
+        self.assertEqual('', output.strip())
+
+    def test_reader_thread(self):
+        conn = self.connect(reader_thread=True)
+        self.assertEqual('3.14159', conn.test_service.float_to_string(3.14159))
+        futures = [conn.pipelined(conn.test_service.int32_to_string, i) for i in range(20)]
+        self.assertEqual([str(i) for i in range(20)], [future.result() for future in futures])
+        with conn.batch():
+            conn.test_service.string_property = 'foo'
+            x = conn.test_service.string_property
+        self.assertEqual('foo', x.result())
+        self.assertRaises(krpc.client.RPCError, conn.test_service.throw_argument_exception)
+        results = {}
+        def thread_main(i):
+            results[i] = [conn.test_service.int32_to_string(i*100+j) for j in range(50)]
+        threads = [threading.Thread(target=thread_main, args=(i,)) for i in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for i in range(6):
+            self.assertEqual([str(i*100+j) for j in range(50)], results[i])
+        conn.close()
+
+    def test_reader_thread_close(self):
+        conn = self.connect(reader_thread=True)
+        future = conn.pipelined(conn.test_service.blocking_procedure, 1000)
+        conn.close()
+        # Does not block once the connection has closed
+        future.exception()
+        self.assertRaises(Exception, conn.test_service.int32_to_string, 42)
+
+    def test_reader_thread_error(self):
+        conn = self.connect(reader_thread=True)
+        try:
+            # Responses can't be decoded without the response type
+            conn._response_type = None
+            with conn.batch():
+                futures = [conn.test_service.blocking_procedure(10) for _ in range(2)]
+            for future in futures:
+                error = future.exception(5)
+                self.assertFalse(isinstance(error, krpc.error.RPCTimeoutError))
+                self.assertIsNotNone(error)
+            self.assertRaises(Exception, conn.test_service.int32_to_string, 42)
+        finally:
+            conn.close()
+
+    def test_priority_rules(self):
+        procedure = ('TestService', 'FloatToString')
+        self.assertEqual(krpc.NORMAL_PRIORITY, self.conn._request_priority(*procedure))
+        self.conn.set_priority(krpc.HIGH_PRIORITY, 'TestService')
+        self.assertEqual(krpc.HIGH_PRIORITY, self.conn._request_priority(*procedure))
+        self.conn.set_priority(krpc.LOW_PRIORITY, 'TestService', 'FloatToString')
+        self.assertEqual(krpc.LOW_PRIORITY, self.conn._request_priority(*procedure))
+        with self.conn.priority(krpc.HIGH_PRIORITY):
+            self.assertEqual(krpc.HIGH_PRIORITY, self.conn._request_priority(*procedure))
+        self.assertEqual(krpc.LOW_PRIORITY, self.conn._request_priority(*procedure))
+        self.assertEqual('3.14159', self.conn.test_service.float_to_string(3.14159))
+
+    def test_priority_order(self):
+        channel = self.conn._rpc_channels[0]
+        futures = {}
+        def thread_main(priority):
+            with self.conn.priority(priority):
+                futures[priority] = self.conn.pipelined(self.conn.test_service.int32_to_string, priority)
+        channel.send_lock.acquire()
+        threads = []
+        for priority in (krpc.LOW_PRIORITY, krpc.NORMAL_PRIORITY, krpc.HIGH_PRIORITY):
+            thread = threading.Thread(target=thread_main, args=(priority,))
+            thread.start()
+            threads.append(thread)
+            while len(channel.send_lock._waiting) < len(threads):
+                time.sleep(0.001)
+        channel.send_lock.release()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([futures[krpc.HIGH_PRIORITY], futures[krpc.NORMAL_PRIORITY], futures[krpc.LOW_PRIORITY]],
+                         list(channel.pending))
+        self.assertEqual(['2', '1', '0'], [futures[i].result() for i in (2, 1, 0)])
+
+    def test_high_priority_connection(self):
+        conn = self.connect(high_priority_connection=True)
+        try:
+            self.assertEqual(2, len(conn._rpc_channels))
+            channel = conn._shared_channels[0]
+            futures = []
+            def thread_main():
+                futures.extend(conn.pipelined(conn.test_service.int32_to_string, i) for i in range(20))
+            # Stop the responses to the normal priority requests being received
+            channel.receive_lock.acquire()
+            try:
+                thread = threading.Thread(target=thread_main)
+                thread.start()
+                thread.join()
+                # High priority requests do not wait behind them
+                with conn.priority(krpc.HIGH_PRIORITY):
+                    future = conn.pipelined(conn.test_service.int32_to_string, 42)
+                self.assertIs(conn._high_priority_channel, future._channel)
+                self.assertEqual('42', future.result(5))
+                self.assertEqual(20, len(channel.pending))
+            finally:
+                channel.receive_lock.release()
+            self.assertEqual([str(i) for i in range(20)], [future.result() for future in futures])
+            # Other requests are not sent on the high priority connection
+            self.assertIs(channel, conn.pipelined(conn.test_service.int32_to_string, 42)._channel)
+            self.assertEqual('3.14159', conn.test_service.float_to_string(3.14159))
+        finally:
+            conn.close()
+
+    def test_fire_and_forget(self):
+        with self.conn.fire_and_forget():
+            self.conn.test_service.string_property = 'foo'
+            # Calls that return a value still wait for the result
+            self.assertEqual('foo', self.conn.test_service.string_property)
+            self.assertIsNone(self.conn.test_service.throw_argument_exception())
+        # The error is raised by the first call made after its response has been
+        # received, which is at the latest during the next call that waits
+        errors = 0
+        for _ in range(2):
+            try:
+                self.assertEqual('42', self.conn.test_service.int32_to_string(42))
+            except krpc.client.RPCError:
+                errors += 1
+        self.assertEqual(1, errors)
+
+    def test_fire_and_forget_error_callback(self):
+        errors = []
+        self.conn.set_error_callback(errors.append)
+        with self.conn.fire_and_forget():
+            self.conn.test_service.throw_argument_exception()
+            self.conn.test_service.string_property = 'bar'
+        self.assertEqual('bar', self.conn.test_service.string_property)
+        self.assertEqual(1, len(errors))
+        self.assertEqual('Invalid argument', str(errors[0]))
+
+    def _count_requests(self):
+        count = [0]
+        submit = self.conn._submit
+        def counting_submit(*args):
+            count[0] += 1
+            return submit(*args)
+        self.conn._submit = counting_submit
+        return count
+
+    def test_coalesce_writes(self):
+        self.conn.coalesce_writes('TestService', 'TestClass_set_IntProperty')
+        obj1 = self.conn.test_service.create_test_object('coalesce1')
+        obj2 = self.conn.test_service.create_test_object('coalesce2')
+        count = self._count_requests()
+        obj1.int_property = 1
+        obj1.int_property = 1
+        obj2.int_property = 1
+        self.assertEqual(2, count[0])
+        obj1.int_property = 2
+        self.assertEqual(3, count[0])
+        self.assertEqual(2, obj1.int_property)
+        self.assertEqual(1, obj2.int_property)
+
+    def test_coalesce_writes_tolerance(self):
+        self.conn.coalesce_writes('TestService', 'TestClass_set_IntProperty', tolerance=1)
+        obj = self.conn.test_service.create_test_object('coalesce3')
+        count = self._count_requests()
+        obj.int_property = 10
+        obj.int_property = 11
+        obj.int_property = 9
+        self.assertEqual(1, count[0])
+        self.assertEqual(10, obj.int_property)
+        obj.int_property = 12
+        self.assertEqual(12, obj.int_property)
+
+    def test_coalesce_writes_max_rate(self):
+        self.conn.coalesce_writes('TestService', 'TestClass_set_IntProperty', max_rate=10)
+        obj = self.conn.test_service.create_test_object('coalesce4')
+        count = self._count_requests()
+        for i in range(1, 6):
+            obj.int_property = i
+        self.assertEqual(1, count[0])
+        time.sleep(0.2)
+        # Only the last of the delayed writes is sent
+        self.assertEqual(2, count[0])
+        self.assertEqual(5, obj.int_property)
+
+    def test_coalesce_writes_in_flight(self):
+        self.conn.coalesce_writes('TestService', 'TestClass_set_IntProperty')
+        obj = self.conn.test_service.create_test_object('coalesce5')
+        count = self._count_requests()
+        obj.int_property = 1
+        # Stop the responses to the writes being received, so they are still in
+        # flight when the next write is made
+        channel = self.conn._rpc_channels[0]
+        channel.receive_lock.acquire()
+        try:
+            with self.conn.fire_and_forget():
+                obj.int_property = 0
+                obj.int_property = 1
+                obj.int_property = 1
+        finally:
+            channel.receive_lock.release()
+        self.assertEqual(3, count[0])
+        self.assertEqual(1, obj.int_property)
+
+    def test_coalesce_writes_released_objects(self):
+        self.conn.coalesce_writes('TestService', 'TestClass_set_IntProperty')
+        coalescer = self.conn._write_coalescer
+        obj = self.conn.test_service.create_test_object('coalesce6')
+        obj.int_property = 1
+        self.assertEqual(1, len(coalescer._object_states))
+        del obj
+        self.assertEqual(0, len(coalescer._object_states))
+
+    @unittest.skipIf(numpy is None, 'requires numpy')
+    def test_coalesce_writes_numpy_tolerance(self):
+        self.conn.coalesce_writes('TestService', 'TestClass_set_IntProperty', tolerance=1)
+        obj = self.conn.test_service.create_test_object('coalesce7')
+        count = self._count_requests()
+        obj.int_property = numpy.int32(10)
+        obj.int_property = numpy.int64(11)
+        obj.int_property = 9
+        self.assertEqual(1, count[0])
+        self.assertEqual(10, obj.int_property)
+
+    @unittest.skipIf(numpy is None, 'requires numpy')
+    def test_coalesce_writes_numpy_arrays(self):
+        self.assertTrue(_within_tolerance((numpy.array([1.0, 2.0]),), (numpy.array([1.5, 2.0]),), 1))
+        self.assertFalse(_within_tolerance((numpy.array([1.0, 2.0]),), (numpy.array([1.0, 4.0]),), 1))
+        self.assertFalse(_within_tolerance((numpy.array([1.0, 2.0]),), (numpy.array([1.0]),), 1))
+        self.assertTrue(_within_tolerance(([1.0, 2.0],), (numpy.array([1.0, 2.0]),), 0))
+
+    def test_coalesce_writes_copies_values(self):
+        coalescer = self.conn._write_coalescer
+        coalescer.add_rule('TestService', 'SetValues')
+        sent = []
+        coalescer._send = lambda state, service, procedure, data, values: sent.append(values)
+        values = [1, 2]
+        coalescer.write('TestService', 'SetValues', b'', (values,), ['values'])
+        values.append(3)
+        coalescer.write('TestService', 'SetValues', b'', (values,), ['values'])
+        self.assertEqual([([1, 2],), ([1, 2, 3],)], sent)
+
+    def _wait_until(self, condition):
+        while not condition():
+            time.sleep(0.001)
+
+    def test_coalesce_getters(self):
+        self.conn.test_service.string_property = 'foo'
+        channel = self.conn._rpc_channels[0]
+        results = []
+        def thread_main():
+            results.append(self.conn.test_service.string_property)
+        # Stop responses being received until both threads have made their call
+        channel.receive_lock.acquire()
+        thread0 = threading.Thread(target=thread_main)
+        thread0.start()
+        self._wait_until(lambda: len(self.conn._in_flight) == 1)
+        thread1 = threading.Thread(target=thread_main)
+        thread1.start()
+        self._wait_until(lambda: self.conn.stats()['coalesced_getter_calls'] == 1)
+        channel.receive_lock.release()
+        thread0.join()
+        thread1.join()
+        self.assertEqual(['foo', 'foo'], results)
+        stats = self.conn.stats()
+        self.assertEqual(2, stats['getter_calls'])
+        self.assertEqual(1, stats['coalesced_getter_calls'])
+        self.assertEqual(0, len(self.conn._in_flight))
+
+    def test_coalesced_getter_decoded_once(self):
+        self.conn.test_service.string_property = 'foo'
+        future = self.conn._submit_getter('TestService', 'get_StringProperty',
+                                          self.conn._encode_request('TestService', 'get_StringProperty'),
+                                          self.conn._types.as_type('string'))
+        self.assertEqual('foo', future.result())
+        # Another thread waiting for the same response saw it had not been
+        # decoded, before the first thread finished decoding it
+        future._decoded = False
+        self.assertEqual('foo', future.result())
+
+    def test_coalesce_getters_after_write(self):
+        self.conn.test_service.string_property = 'foo'
+        channel = self.conn._rpc_channels[0]
+        results = []
+        def thread_main():
+            results.append(self.conn.test_service.string_property)
+        def writer_thread_main():
+            self.conn.pipelined(self.conn.test_service.int32_to_string, 42)
+            results.append(self.conn.test_service.string_property)
+        channel.receive_lock.acquire()
+        thread0 = threading.Thread(target=thread_main)
+        thread0.start()
+        self._wait_until(lambda: len(self.conn._in_flight) == 1)
+        # A getter made after the thread's own earlier request does not use
+        # the response to the getter that was sent before it
+        thread1 = threading.Thread(target=writer_thread_main)
+        thread1.start()
+        self._wait_until(lambda: self.conn.stats()['getter_calls'] == 2)
+        channel.receive_lock.release()
+        thread0.join()
+        thread1.join()
+        self.assertEqual(0, self.conn.stats()['coalesced_getter_calls'])
+
+    def test_coalesce_getters_copies_results(self):
+        # Treat a procedure returning a list as a property getter
+        self.conn._property_getters = self.conn._property_getters | set([('TestService', 'IncrementList')])
+        channel = self.conn._rpc_channels[0]
+        results = []
+        def thread_main():
+            results.append(self.conn.test_service.increment_list([0, 1, 2]))
+            results[-1].append(0)
+        channel.receive_lock.acquire()
+        thread0 = threading.Thread(target=thread_main)
+        thread0.start()
+        self._wait_until(lambda: len(self.conn._in_flight) == 1)
+        thread1 = threading.Thread(target=thread_main)
+        thread1.start()
+        self._wait_until(lambda: self.conn.stats()['coalesced_getter_calls'] == 1)
+        channel.receive_lock.release()
+        thread0.join()
+        thread1.join()
+        self.assertEqual([[1, 2, 3, 0], [1, 2, 3, 0]], results)
+
+    def test_coalesce_getters_other_channel(self):
+        conn = self.connect(rpc_connections=2)
+        conn.test_service.string_property = 'foo'
+        channels = conn._rpc_channels
+        written = threading.Event()
+        getter_sent = threading.Event()
+        results = []
+        writes = []
+        def thread_main():
+            results.append(conn.test_service.string_property)
+        def writer_thread_main():
+            writes.append(conn.pipelined(conn.test_service.int32_to_string, 42))
+            written.set()
+            getter_sent.wait()
+            results.append(conn.test_service.string_property)
+        for channel in channels:
+            channel.receive_lock.acquire()
+        thread1 = threading.Thread(target=writer_thread_main)
+        thread1.start()
+        written.wait()
+        # Sent on the other channel, after the write
+        thread0 = threading.Thread(target=thread_main)
+        thread0.start()
+        self._wait_until(lambda: len(conn._in_flight) == 1)
+        self.assertIsNot(writes[0]._channel, list(conn._in_flight.values())[0]._channel)
+        getter_sent.set()
+        # The write may be executed after the getter on the other channel, so
+        # the writer's getter is not coalesced with it
+        self._wait_until(lambda: conn.stats()['getter_calls'] == 2)
+        for channel in channels:
+            channel.receive_lock.release()
+        thread0.join()
+        thread1.join()
+        self.assertEqual(['foo', 'foo'], results)
+        self.assertEqual(0, conn.stats()['coalesced_getter_calls'])
+        conn.close()
+
+    def test_cache_property(self):
+        self.conn.test_service.string_property = 'foo'
+        # Read the property through a getter whose value is changed by a different setter
+        self.conn.cache_property('TestService', None, 'StringPropertyPrivateSet')
+        count = self._count_requests()
+        self.assertEqual('foo', self.conn.test_service.string_property_private_set)
+        self.assertEqual('foo', self.conn.test_service.string_property_private_set)
+        self.conn.test_service.string_property = 'bar'
+        self.assertEqual('foo', self.conn.test_service.string_property_private_set)
+        self.assertEqual(2, count[0])
+        stats = self.conn.stats()
+        self.assertEqual(2, stats['property_cache_hits'])
+        self.assertEqual(1, stats['property_cache_misses'])
+
+    def test_cache_property_ttl(self):
+        self.conn.test_service.string_property = 'foo'
+        self.conn.cache_property('TestService', None, 'StringPropertyPrivateSet', ttl=0.1)
+        self.assertEqual('foo', self.conn.test_service.string_property_private_set)
+        self.conn.test_service.string_property = 'bar'
+        self.assertEqual('foo', self.conn.test_service.string_property_private_set)
+        time.sleep(0.15)
+        self.assertEqual('bar', self.conn.test_service.string_property_private_set)
+
+    def test_cache_property_invalidate(self):
+        self.conn.test_service.string_property = 'foo'
+        self.conn.cache_property('TestService', None, 'StringPropertyPrivateSet', invalidate_on=['set_StringProperty'])
+        self.assertEqual('foo', self.conn.test_service.string_property_private_set)
+        self.conn.test_service.string_property = 'bar'
+        self.assertEqual('bar', self.conn.test_service.string_property_private_set)
+        # Setting the cached property itself also invalidates it
+        self.conn.cache_property('TestService', 'TestClass', 'IntProperty')
+        obj = self.conn.test_service.create_test_object('cache')
+        obj.int_property = 1
+        self.assertEqual(1, obj.int_property)
+        obj.int_property = 2
+        self.assertEqual(2, obj.int_property)
+
+    def test_cache_property_timeout(self):
+        self.conn.test_service.string_property = 'foo'
+        self.conn.cache_property('TestService', None, 'StringPropertyPrivateSet')
+        channel = self.conn._rpc_channels[0]
+        # Stop the response being received, so the cached call is still waiting for it
+        channel.receive_lock.acquire()
+        try:
+            with self.conn.timeout(0.05):
+                for _ in range(2):
+                    self.assertRaises(krpc.error.RPCTimeoutError,
+                                      lambda: self.conn.test_service.string_property_private_set)
+        finally:
+            channel.receive_lock.release()
+        stats = self.conn.stats()
+        self.assertEqual(2, stats['timeouts'])
+        self.assertEqual(1, stats['property_cache_hits'])
+        self.assertEqual('foo', self.conn.test_service.string_property_private_set)
+
+    def test_cache_property_copies_values(self):
+        # Cache a procedure that returns a list, as if it were a property getter
+        self.conn._property_cache._ttls[('TestService', 'IncrementList')] = None
+        count = self._count_requests()
+        value = self.conn.test_service.increment_list([1, 2])
+        value.append(4)
+        self.assertEqual([2, 3], self.conn.test_service.increment_list([1, 2]))
+        self.conn.test_service.increment_list([1, 2]).append(4)
+        self.assertEqual([2, 3], self.conn.test_service.increment_list([1, 2]))
+        self.assertEqual(1, count[0])
+
+    def test_default_cache_policies_invalidated_by_staging(self):
+        for (service, class_name, _), policy in krpc.cache.DEFAULT_POLICIES.items():
+            if class_name in ('Part', 'Engine'):
+                self.assertEqual(['Control_ActivateNextStage'], policy.get('invalidate_on'))
+
+    def test_cache_class_property(self):
+        self.conn.cache_properties({('TestService', 'TestClass', 'IntProperty'): {}})
+        obj1 = self.conn.test_service.create_test_object('cache1')
+        obj2 = self.conn.test_service.create_test_object('cache2')
+        obj1.int_property = 1
+        obj2.int_property = 2
+        count = self._count_requests()
+        self.assertEqual([1, 2, 1, 2], [obj1.int_property, obj2.int_property, obj1.int_property, obj2.int_property])
+        self.assertEqual(2, count[0])
+
+    def test_auto_streams(self):
+        self.conn.test_service.string_property = 'foo'
+        self.conn.set_auto_streams(threshold=3, window=10, cooldown=0.2)
+        try:
+            count = self._count_requests()
+            values = [self.conn.test_service.string_property for _ in range(10)]
+            self.assertEqual(['foo']*10, values)
+            # 4 getter calls, then the request to add the stream
+            self.assertEqual(5, count[0])
+            self.assertEqual([('TestService', 'get_StringProperty', True, 6)], self.conn.auto_stream_report())
+            self.assertEqual(6, self.conn.stats()['auto_stream_reads'])
+            # Reads are served from the stream, which receives the new value
+            self.conn.test_service.string_property = 'bar'
+            self._wait_until(lambda: self.conn.test_service.string_property == 'bar')
+            # Other getters are not affected
+            self.assertEqual([], [x for x in self.conn.auto_stream_report() if x[1] != 'get_StringProperty'])
+            # The stream is removed once it has not been read for the cooldown
+            streams = len(krpc.stream._stream_cache)
+            self._wait_until(lambda: not self.conn.auto_stream_report()[0][2])
+            self._wait_until(lambda: len(krpc.stream._stream_cache) == streams - 1)
+            count[0] = 0
+            self.assertEqual('bar', self.conn.test_service.string_property)
+            self.assertEqual(1, count[0])
+        finally:
+            self.conn.set_auto_streams(False)
+        self.assertEqual([], self.conn.auto_stream_report())
+
+    def test_auto_streams_shared_stream_removed(self):
+        self.conn.test_service.string_property = 'foo'
+        stream = self.conn.add_stream(getattr, self.conn.test_service, 'string_property')
+        self.conn.set_auto_streams(threshold=1, window=10, cooldown=10)
+        try:
+            for _ in range(3):
+                self.assertEqual('foo', self.conn.test_service.string_property)
+            self.assertEqual([('TestService', 'get_StringProperty', True, 1)], self.conn.auto_stream_report())
+            # Reads fall back to RPCs once the user removes the shared stream
+            stream.remove()
+            self.assertEqual('foo', self.conn.test_service.string_property)
+            self.assertEqual([('TestService', 'get_StringProperty', False, 1)], self.conn.auto_stream_report())
+        finally:
+            self.conn.set_auto_streams(False)
+
+    def test_auto_streams_not_removed_after_add_stream(self):
+        self.conn.test_service.string_property = 'foo'
+        self.conn.set_auto_streams(threshold=1, window=10, cooldown=0.1)
+        try:
+            for _ in range(3):
+                self.assertEqual('foo', self.conn.test_service.string_property)
+            self.assertTrue(self.conn.auto_stream_report()[0][2])
+            # The user adds the stream the client added, which the client no longer removes
+            stream = self.conn.add_stream(getattr, self.conn.test_service, 'string_property')
+            self._wait_until(lambda: not self.conn.auto_stream_report()[0][2])
+            self.assertIn(stream._stream_id, krpc.stream._stream_cache)
+            self.assertEqual('foo', stream())
+            stream.remove()
+        finally:
+            self.conn.set_auto_streams(False)
+
+    def test_auto_streams_add_stream_fails(self):
+        self.conn.test_service.string_property = 'foo'
+        self.conn.set_auto_streams(threshold=1, window=10, cooldown=10)
+        def fail(request):
+            raise krpc.error.RPCError('add_stream failed')
+        self.conn.krpc.add_stream = fail
+        try:
+            count = self._count_requests()
+            # The values that were read are returned, and the getter keeps making RPCs
+            for _ in range(4):
+                self.assertEqual('foo', self.conn.test_service.string_property)
+            self.assertEqual(4, count[0])
+            self.assertEqual([], self.conn.auto_stream_report())
+            self.assertEqual(1, self.conn.stats()['auto_stream_failures'])
+        finally:
+            del self.conn.krpc.add_stream
+            self.conn.set_auto_streams(False)
+
+    def test_auto_streams_disable(self):
+        self.conn.set_auto_streams(threshold=1)
+        obj = self.conn.test_service.create_test_object('auto')
+        obj.int_property = 42
+        for _ in range(3):
+            self.assertEqual(42, obj.int_property)
+        self.assertEqual([('TestService', 'TestClass_get_IntProperty', True, 1)], self.conn.auto_stream_report())
+        streams = len(krpc.stream._stream_cache)
+        self.conn.set_auto_streams(False)
+        self.assertEqual(streams - 1, len(krpc.stream._stream_cache))
+
+    def test_timeout(self):
+        channel = self.conn._rpc_channels[0]
+        # Stop the response being received
+        channel.receive_lock.acquire()
+        try:
+            with self.conn.timeout(0.05):
+                self.assertRaises(krpc.client.RPCTimeoutError, self.conn.test_service.int32_to_string, 1)
+        finally:
+            channel.receive_lock.release()
+        # The late response is discarded, and does not get handed to the next call
+        self.assertEqual('2', self.conn.test_service.int32_to_string(2))
+        stats = self.conn.stats()
+        self.assertEqual(1, stats['timeouts'])
+        self.assertEqual(1, stats['late_responses'])
+
+    def test_client_timeout(self):
+        self.conn.set_timeout(10)
+        for i in range(10):
+            self.assertEqual(str(i), self.conn.test_service.int32_to_string(i))
+        self.assertRaises(krpc.client.RPCError, self.conn.test_service.throw_argument_exception)
+        with self.conn.timeout(None):
+            self.assertEqual('42', self.conn.test_service.int32_to_string(42))
+        histogram = self.conn.stats()['deadline_histogram']
+        self.assertEqual([0.1, 0.25, 0.5, 0.75, 0.9, 1.0], [bound for bound,_ in histogram])
+        self.assertEqual(11, sum(count for _,count in histogram))
+
+    def test_future_result_timeout(self):
+        channel = self.conn._rpc_channels[0]
+        future = self.conn.pipelined(self.conn.test_service.int32_to_string, 42)
+        channel.receive_lock.acquire()
+        try:
+            self.assertRaises(krpc.client.RPCTimeoutError, future.result, 0.01)
+        finally:
+            channel.receive_lock.release()
+        self.assertEqual('42', future.result(10))
+
+    def test_lazy_services(self):
+        # Don't use the services already built by other clients
+        krpc.service._schemas.clear()
+        conn = self.connect()
+        try:
+            service = krpc.service._shared(type(conn.test_service))
+            self.assertFalse(service._materialized)
+            self.assertFalse('float_to_string' in service.__dict__)
+            self.assertEqual('3.14159', conn.test_service.float_to_string(float(3.14159)))
+            self.assertTrue(service._materialized)
+            obj = conn.test_service.create_test_object('bob')
+            self.assertEqual('value=bob', obj.get_value())
+            self.assertRaises(AttributeError, getattr, conn.test_service, 'not_a_member')
+        finally:
+            conn.close()
+
+    def test_lazy_member_documentation(self):
+        krpc.service._schemas.clear()
+        conn = self.connect()
+        try:
+            service = krpc.service._shared(type(conn.test_service))
+            service._materialize()
+            # Members are added without parsing their documentation
+            self.assertTrue(isinstance(service.__dict__['float_to_string'], krpc.service._LazyMember))
+            self.assertTrue(isinstance(service.__dict__['string_property'], krpc.service._LazyMember))
+            self.assertEqual('3.14159', conn.test_service.float_to_string(float(3.14159)))
+            self.assertFalse(isinstance(service.__dict__['float_to_string'], krpc.service._LazyMember))
+            conn.test_service.string_property = 'foo'
+            self.assertTrue(isinstance(service.__dict__['string_property'], property))
+            self.assertEqual('foo', conn.test_service.string_property)
+            # Class members too
+            obj = conn.test_service.create_test_object('bob')
+            cls = service._schema.class_base('TestService', 'TestClass')
+            self.assertTrue(isinstance(cls.__dict__['get_value'], krpc.service._LazyMember))
+            self.assertEqual('value=bob', obj.get_value())
+            self.assertFalse(isinstance(cls.__dict__['get_value'], krpc.service._LazyMember))
+        finally:
+            conn.close()
+
+    def test_lazy_services_use_other_services(self):
+        services = krpc.schema.KRPC.Services()
+        service1 = services.services.add()
+        service1.name = 'LazyService1'
+        procedure = service1.procedures.add()
+        procedure.name = 'GetObject'
+        procedure.has_return_type = True
+        procedure.return_type = 'uint64'
+        procedure.attributes.extend(['ReturnType.Class(LazyService2.LazyClass)'])
+        service2 = services.services.add()
+        service2.name = 'LazyService2'
+        cls = service2.classes.add()
+        cls.name = 'LazyClass'
+        cls.documentation = '<doc><summary>A lazy class.</summary></doc>'
+        procedure = service2.procedures.add()
+        procedure.name = 'LazyClass_get_Name'
+        procedure.has_return_type = True
+        procedure.return_type = 'string'
+        procedure.parameters.add(name='this', type='uint64')
+        procedure.attributes.extend(['Class.Property.Get(LazyService2.LazyClass,Name)',
+                                     'ParameterType(0).Class(LazyService2.LazyClass)'])
+        self.conn._add_services(krpc.service.Schema(services.SerializeToString()))
+        lazy1 = self.conn.lazy_service1
+        lazy2 = self.conn.lazy_service2
+        self.assertFalse(type(lazy2)._materialized)
+        self.assertTrue(callable(lazy1.get_object))
+        self.assertTrue(type(lazy2)._materialized)
+        self.assertEqual('A lazy class.', lazy2.LazyClass.__doc__)
+        self.assertTrue(isinstance(lazy2.LazyClass.name, property))
+
+    def test_schema_cache(self):
+        directory = tempfile.mkdtemp()
+        try:
+            conn = self.connect(schema_cache=directory)
+            self.assertEqual('3.14159', conn.test_service.float_to_string(float(3.14159)))
+            version = conn.krpc.get_status().version
+            conn.close()
+            cache = krpc.schemacache.SchemaCache(directory)
+            data = cache.load('localhost', int(os.getenv('RPC_PORT', 50000)), version)
+            self.assertIsNotNone(data)
+            # Reconnecting uses the stored services
+            services = krpc.schema.KRPC.Services()
+            services.ParseFromString(data)
+            services.services.add(name='CachedService')
+            cache.store('localhost', int(os.getenv('RPC_PORT', 50000)), version, services.SerializeToString())
+            conn = self.connect(schema_cache=directory)
+            self.assertTrue(hasattr(conn, 'cached_service'))
+            self.assertEqual('3.14159', conn.test_service.float_to_string(float(3.14159)))
+            conn.close()
+            # An entry that does not match its fingerprint is fetched again
+            path = cache._path('localhost', int(os.getenv('RPC_PORT', 50000)), version)
+            with open(path, 'r+b') as f:
+                f.seek(-1, os.SEEK_END)
+                f.truncate()
+            conn = self.connect(schema_cache=directory)
+            self.assertFalse(hasattr(conn, 'cached_service'))
+            self.assertEqual(data, cache.load('localhost', int(os.getenv('RPC_PORT', 50000)), version))
+            conn.close()
+        finally:
+            shutil.rmtree(directory)
+
     def test_client_members(self):
         self.assertSetEqual(
-            set(['krpc', 'test_service', 'add_stream', 'stream', 'close']),
+            set(['krpc', 'test_service', 'add_stream', 'stream', 'pipelined', 'batch', 'close',
+                 'priority', 'set_priority', 'fire_and_forget', 'set_error_callback',
+                 'coalesce_writes', 'stats', 'set_timeout', 'timeout', 'set_numpy_results',
+                 'set_lazy_collections', 'cache_property', 'cache_properties',
+                 'set_auto_streams', 'auto_stream_report']),
             set(filter(lambda x: not x.startswith('_'), dir(self.conn))))
 
     def test_krpc_service_members(self):
@@ -271,6 +1211,28 @@ class TestClient(ServerTestCase, unittest.TestCase):
             self.conn.test_service.string_property = string
             self.assertEqual(string, self.conn.test_service.string_property)
 
+    def test_services_shared_by_connections(self):
+        conn1 = self.connect()
+        conn2 = self.connect()
+        try:
+            self.assertNotEqual(type(conn1.test_service), type(conn2.test_service))
+            self.assertEqual(krpc.service._shared(type(conn1.test_service)),
+                             krpc.service._shared(type(conn2.test_service)))
+            self.assertEqual(conn1.test_service.TestClass.get_value.__func__,
+                             conn2.test_service.TestClass.get_value.__func__)
+            self.assertEqual(conn1.test_service.TestEnum, conn2.test_service.TestEnum)
+            obj1 = conn1.test_service.create_test_object('jeb')
+            obj2 = conn2.test_service.create_test_object('bob')
+            self.assertEqual(conn1.test_service.TestClass, type(obj1))
+            self.assertEqual(conn2.test_service.TestClass, type(obj2))
+            self.assertEqual('value=jeb', obj1.get_value())
+            self.assertEqual('value=bob', obj2.get_value())
+            self.assertEqual('jebbobbill', conn2.test_service.TestClass.static_method('bob', 'bill'))
+            self.assertEqual(conn1.test_service.TestClass.__doc__, conn2.test_service.TestClass.__doc__)
+        finally:
+            conn1.close()
+            conn2.close()
+
     def test_types_from_different_connections(self):
         conn1 = self.connect()
         conn2 = self.connect()
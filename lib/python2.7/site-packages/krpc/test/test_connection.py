@@ -78,6 +78,45 @@ class TestConnection(unittest.TestCase):
         self.assertEqual(message[:len(partial)], partial)
         self.assertEqual(message[len(partial):], conn.receive(len(message) - len(partial)))
 
+    def test_receive_message(self):
+        conn = self.connect()
+        conn.send(b'\x03foo')
+        self.assertEqual(b'foo', conn.receive_message().tobytes())
+
+    def test_receive_multiple_messages(self):
+        conn = self.connect()
+        conn.send(b'\x03foo\x00\x06barbaz')
+        self.assertEqual(b'foo', conn.receive_message().tobytes())
+        self.assertEqual(b'', conn.receive_message().tobytes())
+        self.assertEqual(b'barbaz', conn.receive_message().tobytes())
+
+    def test_receive_long_message(self):
+        conn = self.connect()
+        message = b'foo' * 4096
+        # Size header is a 2 byte varint
+        conn.send(b'\x80\x60' + message)
+        self.assertEqual(message, conn.receive_message().tobytes())
+
+    def test_receive_after_receive_message(self):
+        conn = self.connect()
+        conn.send(b'\x03foobarbaz')
+        self.assertEqual(b'foo', conn.receive_message().tobytes())
+        self.assertEqual(b'bar', conn.receive(3))
+        self.assertEqual(b'baz', conn.partial_receive(16))
+
+    def test_receive_message_timeout(self):
+        conn = self.connect()
+        conn.send(b'\x06foo')
+        self.assertIsNone(conn.receive_message(timeout=0.1))
+        # The partial message is kept
+        conn.send(b'bar')
+        self.assertEqual(b'foobar', conn.receive_message(timeout=1).tobytes())
+
+    def test_receive_message_on_remote_closed_connection(self):
+        conn = self.connect()
+        self.server_close_connection(conn)
+        self.assertRaises(socket.error, conn.receive_message)
+
     def test_receive_on_remote_closed_connection(self):
         conn = self.connect()
         self.server_close_connection(conn)
@@ -3,6 +3,12 @@ from krpc.decoder import Decoder
 from krpc.types import Types
 from krpc.platform import hexlify, unhexlify
 import krpc.schema.KRPC
+from krpc.lazy import LazyList, LazyDict
+from krpc.encoder import Encoder
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 class TestDecoder(unittest.TestCase):
 
@@ -51,6 +57,88 @@ class TestDecoder(unittest.TestCase):
         value = Decoder.decode(unhexlify('00'), typ)
         self.assertIsNone(value)
 
+    @unittest.skipIf(numpy is None, 'requires numpy')
+    def test_decode_numpy_tuple(self):
+        for typ in ('Tuple(double,double,double)', 'Tuple(float,float,float)', 'Tuple(double,float)'):
+            typ = self.types.as_type(typ)
+            value = (1.5, -2.25, 4.0)[:len(typ.value_types)]
+            data = Encoder.encode(value, typ)
+            array = Decoder.decode(data, typ, numpy=True)
+            self.assertTrue(isinstance(array, numpy.ndarray))
+            self.assertEqual(numpy.float64, array.dtype)
+            self.assertEqual(list(value), list(array))
+            self.assertEqual(value, Decoder.decode(data, typ))
+
+    @unittest.skipIf(numpy is None, 'requires numpy')
+    def test_decode_numpy_list(self):
+        for typ in ('List(double)', 'List(float)'):
+            typ = self.types.as_type(typ)
+            for value in ([], [0.0], [1.5, -2.25, 4.0, 1e10]):
+                array = Decoder.decode(Encoder.encode(value, typ), typ, numpy=True)
+                self.assertTrue(isinstance(array, numpy.ndarray))
+                self.assertEqual(numpy.float64, array.dtype)
+                self.assertEqual(value, list(array))
+
+    @unittest.skipIf(numpy is None, 'requires numpy')
+    def test_decode_numpy_other_types(self):
+        typ = self.types.as_type('List(int32)')
+        self.assertEqual([1, 2, 3], Decoder.decode(Encoder.encode([1, 2, 3], typ), typ, numpy=True))
+        typ = self.types.as_type('Tuple(double,string)')
+        self.assertEqual((1.5, 'foo'), Decoder.decode(Encoder.encode((1.5, 'foo'), typ), typ, numpy=True))
+        typ = self.types.as_type('double')
+        self.assertEqual(1.5, Decoder.decode(Encoder.encode(1.5, typ), typ, numpy=True))
+
+    def test_decode_lazy_list(self):
+        typ = self.types.as_type('List(Class(ServiceName.ClassName))')
+        decoded = []
+        decode = Decoder._compiled(typ.value_type)
+        value = Decoder.decode(Encoder.encode([typ.value_type.python_type(i) for i in range(1, 11)], typ), typ, lazy=True)
+        value._decode = lambda data: decoded.append(data) or decode(data)
+        self.assertTrue(isinstance(value, LazyList))
+        self.assertEqual(10, len(value))
+        self.assertEqual([], decoded)
+        self.assertEqual(3, value[2]._object_id)
+        self.assertEqual(10, value[-1]._object_id)
+        self.assertTrue(value[2] is value[2])
+        self.assertEqual(2, len(decoded))
+        part = value[1:4]
+        self.assertEqual(3, len(part))
+        self.assertEqual(2, len(decoded))
+        self.assertEqual([2, 3, 4], [x._object_id for x in part])
+        self.assertEqual(4, len(decoded))
+        self.assertEqual(list(range(1, 11)), [x._object_id for x in value])
+        self.assertEqual(10, len(decoded))
+
+    def test_decode_lazy_list_equality(self):
+        typ = self.types.as_type('List(int32)')
+        value = Decoder.decode(Encoder.encode([1, 2, 3], typ), typ, lazy=True)
+        self.assertEqual([1, 2, 3], value)
+        self.assertEqual(value, [1, 2, 3])
+        self.assertNotEqual([1, 2], value)
+        self.assertEqual([3, 2], value[:0:-1])
+        self.assertTrue(2 in value)
+        self.assertEqual(1, value.index(2))
+        self.assertEqual('[1, 2, 3]', repr(value))
+
+    def test_decode_lazy_dictionary(self):
+        typ = self.types.as_type('Dictionary(string,List(int32))')
+        value = Decoder.decode(Encoder.encode({'a': [1], 'b': [], 'c': [2, 3]}, typ), typ, lazy=True)
+        self.assertTrue(isinstance(value, LazyDict))
+        self.assertEqual(3, len(value))
+        self.assertEqual([2, 3], value['c'])
+        self.assertTrue(isinstance(value['c'], list))
+        self.assertTrue('a' in value)
+        self.assertFalse('d' in value)
+        self.assertRaises(KeyError, lambda: value['d'])
+        self.assertEqual({'a': [1], 'b': [], 'c': [2, 3]}, dict(value))
+        self.assertEqual(value, {'a': [1], 'b': [], 'c': [2, 3]})
+
+    def test_decode_lazy_other_types(self):
+        typ = self.types.as_type('Tuple(int32,string)')
+        self.assertEqual((1, 'foo'), Decoder.decode(Encoder.encode((1, 'foo'), typ), typ, lazy=True))
+        typ = self.types.as_type('Set(int32)')
+        self.assertEqual(set([1, 2]), Decoder.decode(Encoder.encode(set([1, 2]), typ), typ, lazy=True))
+
     def test_guid(self):
         self.assertEqual('6f271b39-00dd-4de4-9732-f0d3a68838df', Decoder.guid(unhexlify('391b276fdd00e44d9732f0d3a68838df')))
 
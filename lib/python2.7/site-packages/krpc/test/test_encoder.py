@@ -1,9 +1,14 @@
 import unittest
-from krpc.encoder import Encoder
+import itertools
+from krpc.encoder import Encoder, RequestTemplate
 from krpc.types import Types
 from krpc.types import ClassBase
 from krpc.platform import hexlify, unhexlify
 import krpc.schema.KRPC
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 class TestEncoder(unittest.TestCase):
 
@@ -62,6 +67,12 @@ class TestEncoder(unittest.TestCase):
         data = Encoder.encode_delimited(300, self.types.as_type('int32'))
         self.assertEqual('02'+'ac02', hexlify(data))
 
+    def test_encode_negative_unsigned(self):
+        for typ in ('uint32', 'uint64'):
+            for value in (-1, -127, -128, -300):
+                self.assertRaises(ValueError, Encoder.encode, value, self.types.as_type(typ))
+        self.assertEqual(b'\x00', Encoder.encode(0, self.types.as_type('uint32')))
+
     def test_encode_class(self):
         typ = self.types.as_type('Class(ServiceName.ClassName)')
         class_type = typ.python_type
@@ -77,5 +88,60 @@ class TestEncoder(unittest.TestCase):
         data = Encoder.encode(value, typ)
         self.assertEqual('00', hexlify(data))
 
+    @unittest.skipIf(numpy is None, 'requires numpy')
+    def test_encode_numpy(self):
+        values = [
+            ('double', numpy.float64(3.14159), 3.14159),
+            ('float', numpy.float32(2.5), 2.5),
+            ('double', numpy.int32(42), 42.0),
+            ('int32', numpy.int64(-33), -33),
+            ('uint64', numpy.uint64(300), 300),
+            ('bool', numpy.bool_(True), True),
+            ('Tuple(double,double,double)', numpy.array([1.5, -2.25, 4.0]), (1.5, -2.25, 4.0)),
+            ('Tuple(float,float)', numpy.array([1.5, -2.25]), (1.5, -2.25)),
+            ('Tuple(int32,int64)', numpy.array([1, 2]), (1, 2)),
+            ('List(double)', numpy.array([]), []),
+            ('List(double)', numpy.arange(5), [0.0, 1.0, 2.0, 3.0, 4.0]),
+            ('List(int32)', numpy.arange(5), [0, 1, 2, 3, 4])
+        ]
+        for typ, value, expected in values:
+            typ = self.types.as_type(typ)
+            self.assertEqual(hexlify(Encoder.encode(expected, typ)), hexlify(Encoder.encode_numpy(value, typ)))
+
+    @unittest.skipIf(numpy is None, 'requires numpy')
+    def test_encode_numpy_incompatible(self):
+        values = [
+            ('int32', numpy.float64(3.5)),
+            ('string', numpy.float64(3.5)),
+            ('double', numpy.array([1.0])),
+            ('Tuple(double,double,double)', numpy.array([1.0, 2.0])),
+            ('Tuple(double,double)', numpy.array([[1.0, 2.0]])),
+            ('List(int32)', numpy.array([1.5])),
+            ('Class(ServiceName.ClassName)', numpy.uint64(1))
+        ]
+        for typ, value in values:
+            self.assertIsNone(Encoder.encode_numpy(value, self.types.as_type(typ)))
+
+    def test_request_template(self):
+        arguments = [
+            [],
+            [(0, b'\x01')],
+            [(0, b'\x01'), (1, b'foo'), (2, b'')],
+            [(1, b'x' * 300), (200, b'\x02')],
+        ]
+        templates = [RequestTemplate('ServiceName', 'ProcedureName', 3),
+                     RequestTemplate('ServiceName', 'ProcedureName')]
+        for template, args in itertools.product(templates, arguments):
+            request = krpc.schema.KRPC.Request()
+            request.service = 'ServiceName'
+            request.procedure = 'ProcedureName'
+            for position, value in args:
+                argument = krpc.schema.KRPC.Argument()
+                argument.position = position
+                argument.value = value
+                request.arguments.extend([argument])
+            expected = Encoder.encode_delimited(request, self.types.as_type('KRPC.Request'))
+            self.assertEqual(hexlify(expected), hexlify(template.encode_delimited(args)))
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,6 +1,96 @@
 import unittest
 import timeit
+import time
+import os
+import threading
+import struct
+from google.protobuf.internal import decoder as protobuf_decoder
+import krpc.stream
+import krpc.schema.KRPC
+from krpc.encoder import Encoder
+from krpc.decoder import Decoder
+from krpc.service import Schema, load_schema
+import krpc.service
 from krpc.test.servertestcase import ServerTestCase
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+def synthetic_services():
+    """ Return a Services message with services the size of SpaceCenter, UI and MechJeb """
+    def doc(text):
+        return '<doc><summary>%s, see <see cref="M:SpaceCenter.Vessel.Flight" />.</summary>' \
+               '<param name="value">The <c>value</c>.</param><returns>A value.</returns></doc>' % text
+    def add_procedure(service, name, attributes, params=(), return_type=None):
+        procedure = service.procedures.add()
+        procedure.name = name
+        procedure.attributes.extend(attributes)
+        for i, (param_name, typ) in enumerate(params):
+            param = procedure.parameters.add()
+            param.name = param_name
+            if typ.startswith('Class('):
+                param.type = 'uint64'
+                procedure.attributes.append('ParameterType(%d).%s' % (i, typ))
+            else:
+                param.type = typ
+        if return_type is not None:
+            procedure.has_return_type = True
+            if return_type.startswith('Class('):
+                procedure.return_type = 'uint64'
+                procedure.attributes.append('ReturnType.' + return_type)
+            else:
+                procedure.return_type = return_type
+        procedure.documentation = doc(name)
+    def add_service(services, name, nclasses, nmembers, nenums, other_class):
+        service = services.services.add()
+        service.name = name
+        service.documentation = doc(name)
+        classes = ['Class%d' % i for i in range(nclasses)]
+        for class_name in classes:
+            cls = service.classes.add()
+            cls.name = class_name
+            cls.documentation = doc(class_name)
+        for i in range(nenums):
+            enum = service.enumerations.add()
+            enum.name = 'Enum%d' % i
+            enum.documentation = doc(enum.name)
+            for j in range(5):
+                value = enum.values.add()
+                value.name = 'Value%d' % j
+                value.value = j
+        for i in range(nmembers):
+            add_procedure(service, 'Procedure%d' % i, [], [('value', 'double')], 'string')
+            add_procedure(service, 'get_Property%d' % i, ['Property.Get(Property%d)' % i], [], 'float')
+        for c, class_name in enumerate(classes):
+            this = ('this', 'Class(%s.%s)' % (name, class_name))
+            other = 'Class(%s.%s)' % (name, classes[(c+1) % nclasses])
+            for i in range(nmembers):
+                attr = '%s.%s,Method%d' % (name, class_name, i)
+                add_procedure(service, '%s_Method%d' % (class_name, i), ['Class.Method(%s)' % attr],
+                              [this, ('value', 'int32')], other if i % 2 else 'bool')
+                attr = '%s.%s,Property%d' % (name, class_name, i)
+                add_procedure(service, '%s_get_Property%d' % (class_name, i), ['Class.Property.Get(%s)' % attr],
+                              [this], 'Tuple(double,double,double)')
+                add_procedure(service, '%s_set_Property%d' % (class_name, i), ['Class.Property.Set(%s)' % attr],
+                              [this, ('value', 'Tuple(double,double,double)')])
+            if other_class is not None:
+                attr = '%s.%s,Vessel' % (name, class_name)
+                add_procedure(service, '%s_get_Vessel' % class_name, ['Class.Property.Get(%s)' % attr],
+                              [this], other_class)
+    services = krpc.schema.KRPC.Services()
+    add_service(services, 'SpaceCenter', 40, 12, 30, None)
+    add_service(services, 'UI', 12, 8, 5, None)
+    add_service(services, 'MechJeb', 25, 10, 10, 'Class(SpaceCenter.Class0)')
+    return services
+
+def resident_memory():
+    """ Return the resident memory of the process in bytes, or None if it is not known """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError):
+        return None
 
 class TestPerformance(ServerTestCase, unittest.TestCase):
 
@@ -25,5 +115,243 @@ class TestPerformance(ServerTestCase, unittest.TestCase):
         print 'RPC execution rate: %d per second' % (n/t)
         print 'Latency: %.3f milliseconds' % ((t*1000)/n)
 
+    def test_request_encoding_performance(self):
+        n = 10000
+        conn = self.conn
+        types = conn._types
+        request_type = types.as_type('KRPC.Request')
+        calls = [
+            ('getter', 'get_StringProperty', [], [], []),
+            ('1 argument', 'FloatToString', [3.14159], ['value'], [types.as_type('float')]),
+            ('3 arguments', 'AddMultipleValues', [3.14159, 42, 1234567890123], ['x', 'y', 'z'],
+             [types.as_type('float'), types.as_type('int32'), types.as_type('int64')])
+        ]
+        print
+        for name, procedure, args, param_names, param_types in calls:
+            def build():
+                request = conn._build_request('TestService', procedure, args, {}, param_names, param_types)
+                Encoder.encode_delimited(request, request_type)
+            def encode():
+                conn._encode_request('TestService', procedure, args, {}, param_names, param_types)
+            self.assertEqual(Encoder.encode_delimited(
+                conn._build_request('TestService', procedure, args, {}, param_names, param_types), request_type),
+                conn._encode_request('TestService', procedure, args, {}, param_names, param_types))
+            t0 = timeit.timeit(stmt=build, number=n)
+            t1 = timeit.timeit(stmt=encode, number=n)
+            print 'Request encoding, %s: %.1f us with message objects, %.1f us with template (%.1fx)' % \
+                (name, t0*1e6/n, t1*1e6/n, t0/t1)
+
+    @unittest.skipIf(numpy is None, 'requires numpy')
+    def test_numpy_argument_performance(self):
+        n = 10000
+        conn = self.conn
+        types = conn._types
+        # Arguments as computed by a control loop, for example a pitch and heading,
+        # and a direction vector
+        pitch, heading = numpy.arcsin(numpy.array([0.5, 0.25]))
+        direction = numpy.cross([1.0, 0.0, 0.0], [0.0, 1.0, 0.0])
+        samples = numpy.linspace(0.0, 1.0, 100)
+        calls = [
+            ('2 numpy.float64', [types.as_type('float'), types.as_type('float')], [pitch, heading],
+             lambda: [pitch.item(), heading.item()]),
+            ('numpy array as Tuple(double,double,double)', [types.as_type('Tuple(double,double,double)')],
+             [direction], lambda: [tuple(direction.tolist())]),
+            ('numpy array as List(double) of 100 values', [types.as_type('List(double)')],
+             [samples], lambda: [samples.tolist()])
+        ]
+        print
+        for name, param_types, args, converted_args in calls:
+            param_names = ['arg%d' % i for i in range(len(param_types))]
+            def encode_converted():
+                conn._encode_request('TestService', 'Procedure', converted_args(), {}, param_names, param_types)
+            def encode():
+                conn._encode_request('TestService', 'Procedure', args, {}, param_names, param_types)
+            self.assertEqual(conn._encode_request('TestService', 'Procedure', converted_args(), {}, param_names, param_types),
+                             conn._encode_request('TestService', 'Procedure', args, {}, param_names, param_types))
+            t0 = timeit.timeit(stmt=encode_converted, number=n)
+            t1 = timeit.timeit(stmt=encode, number=n)
+            print 'Request encoding, %s: %.1f us converted to python values, %.1f us passed directly (%.1fx)' % \
+                (name, t0*1e6/n, t1*1e6/n, t0/t1)
+
+    def test_decoding_performance(self):
+        n = 10000
+        types = self.conn._types
+        tuple_message_type = types.as_type('KRPC.Tuple').python_type
+        list_message_type = types.as_type('KRPC.List').python_type
+        tuple_type = types.as_type('Tuple(double,double,double)')
+        list_type = types.as_type('List(Class(TestService.TestClass))')
+        class_type = list_type.value_type.python_type
+        # Decodes values the way the client did before decoding functions were compiled:
+        # parse the collection message, then decode each item
+        def decode_tuple_with_messages(data):
+            msg = tuple_message_type()
+            msg.ParseFromString(data)
+            return tuple(struct.unpack('<d', item[0:8])[0] for item in msg.items)
+        def decode_list_with_messages(data):
+            msg = list_message_type()
+            msg.ParseFromString(data)
+            return [class_type(object_id) if object_id != 0 else None for object_id in
+                    (protobuf_decoder._DecodeVarint(item, 0)[0] for item in msg.items)]
+        values = [
+            ('Tuple(double,double,double)', tuple_type, (1.5, -2.25, 1234567.875), decode_tuple_with_messages),
+            ('List(Class) of 20 objects', list_type, [class_type(i) for i in range(1, 21)], decode_list_with_messages)
+        ]
+        print
+        for name, typ, value, decode_with_messages in values:
+            data = Encoder.encode(value, typ)
+            self.assertEqual(value, decode_with_messages(data))
+            self.assertEqual(value, Decoder.decode(data, typ))
+            t0 = timeit.timeit(stmt=lambda: decode_with_messages(data), number=n)
+            t1 = timeit.timeit(stmt=lambda: Decoder.decode(data, typ), number=n)
+            print 'Decoding %s: %.1f us with message objects, %.1f us compiled (%.1fx)' % \
+                (name, t0*1e6/n, t1*1e6/n, t0/t1)
+
+    def test_service_creation_performance(self):
+        n = 3
+        services = synthetic_services()
+        nprocedures = sum(len(service.procedures) for service in services.services)
+        data = services.SerializeToString()
+        def create(used):
+            conn = self.connect()
+            try:
+                memory = resident_memory()
+                start = time.time()
+                conn._add_services(Schema(data))
+                for name in used:
+                    conn._services[name]._materialize()
+                t = time.time() - start
+                if memory is not None:
+                    memory = resident_memory() - memory
+                return t, memory
+            finally:
+                conn.close()
+        print
+        print 'Creating SpaceCenter, UI and MechJeb sized services (%d procedures):' % nprocedures
+        for name, used in (('no services used', []),
+                           ('MechJeb used, which also builds SpaceCenter', ['MechJeb']),
+                           ('all services used, as when built eagerly', ['SpaceCenter', 'UI', 'MechJeb'])):
+            results = [create(used) for _ in range(n)]
+            t = min(x[0] for x in results)
+            memory = results[0][1]
+            print '  %s: %.1f ms%s' % (name, t*1000,
+                                       ', %.1f MB resident' % (memory/1e6) if memory is not None else '')
+
+    def test_shared_services_performance(self):
+        nclients = 4
+        data = synthetic_services().SerializeToString()
+        def create(schema):
+            conns = [self.connect() for _ in range(nclients)]
+            try:
+                memory = resident_memory()
+                start = time.time()
+                for conn in conns:
+                    conn._add_services(schema())
+                    for name in ('SpaceCenter', 'UI', 'MechJeb'):
+                        conn._services[name]._materialize()
+                t = time.time() - start
+                if memory is not None:
+                    memory = resident_memory() - memory
+                return t, memory
+            finally:
+                for conn in conns:
+                    conn.close()
+        print
+        print 'Building SpaceCenter, UI and MechJeb sized services for %d clients:' % nclients
+        try:
+            for name, schema in (('built by each client', lambda: Schema(data)),
+                                 ('shared by the clients', lambda: load_schema(data))):
+                t, memory = create(schema)
+                print '  %s: %.1f ms%s' % (name, t*1000,
+                                           ', %.1f MB resident' % (memory/1e6) if memory is not None else '')
+        finally:
+            krpc.service._schemas.pop(load_schema(data).fingerprint)
+
+    def test_pipelined_performance(self):
+        n = 100
+        def wrapper():
+            futures = [self.conn.pipelined(self.conn.test_service.float_to_string, float(3.14159)) for _ in range(n)]
+            for future in futures:
+                future.result()
+        t = timeit.timeit(stmt=wrapper, number=1)
+        print
+        print 'Total pipelined execution time: %.2f seconds' % t
+        print 'Pipelined RPC execution rate: %d per second' % (n/t)
+
+    def test_fire_and_forget_performance(self):
+        n = 200
+        def wrapper():
+            for _ in range(n):
+                self.conn.test_service.string_property = 'foo'
+        def fire_and_forget_wrapper():
+            with self.conn.fire_and_forget():
+                wrapper()
+            self.conn.test_service.string_property
+        t0 = timeit.timeit(stmt=wrapper, number=1)
+        t1 = timeit.timeit(stmt=fire_and_forget_wrapper, number=1)
+        print
+        print 'Property setter rate: %d per second' % (n/t0)
+        print 'Fire-and-forget property setter rate: %d per second' % (n/t1)
+
+    def test_threaded_performance(self):
+        n = 200
+        print
+        for rpc_connections, reader_thread in ((1, False), (1, True), (None, False)):
+            for thread_count in (1, 2, 4, 8):
+                conn = self.connect(rpc_connections=rpc_connections or thread_count, reader_thread=reader_thread)
+                def thread_main():
+                    for _ in range(n):
+                        conn.test_service.float_to_string(float(3.14159))
+                threads = [threading.Thread(target=thread_main) for _ in range(thread_count)]
+                start = time.time()
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                t = time.time() - start
+                conn.close()
+                print '%d threads, %d RPC connections%s: %d RPCs per second' % \
+                    (thread_count, len(conn._rpc_channels), ' with reader thread' if reader_thread else '',
+                     (n*thread_count)/t)
+
+    def test_stream_performance(self):
+        nstreams = 50
+        duration = 5
+        updates = [0]
+        update = krpc.stream.Stream.update
+        def counted_update(stream, value):
+            updates[0] += 1
+            update(stream, value)
+        krpc.stream.Stream.update = counted_update
+        try:
+            streams = [self.conn.add_stream(self.conn.test_service.int32_to_string, i) for i in range(nstreams)]
+            updates[0] = 0
+            start_times = os.times()
+            start = time.time()
+            time.sleep(duration)
+            t = time.time() - start
+            end_times = os.times()
+            count = updates[0]
+            for s in streams:
+                s.remove()
+        finally:
+            krpc.stream.Stream.update = update
+        cpu = (end_times[0] - start_times[0]) + (end_times[1] - start_times[1])
+        print
+        print 'Active streams: %d' % nstreams
+        print 'Stream updates received: %d per second' % (count/t)
+        print 'Updates received per stream: %.1f per second' % (count/(t*nstreams))
+        print 'Client CPU usage: %.1f%%' % (100*cpu/t)
+
+    def test_idle_stream_cpu_usage(self):
+        duration = 5
+        start_times = os.times()
+        start = time.time()
+        time.sleep(duration)
+        t = time.time() - start
+        end_times = os.times()
+        cpu = (end_times[0] - start_times[0]) + (end_times[1] - start_times[1])
+        print
+        print 'Idle client CPU usage: %.1f%%' % (100*cpu/t)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,48 @@
+import unittest
+import os
+import shutil
+import tempfile
+from krpc.schemacache import SchemaCache, fingerprint
+
+class TestSchemaCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = SchemaCache(os.path.join(self.directory, 'services'))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_store_and_load(self):
+        self.assertIsNone(self.cache.load('localhost', 50000, '0.2.3'))
+        self.cache.store('localhost', 50000, '0.2.3', b'\x0a\x04\x0a\x02\n\x00')
+        self.assertEqual(b'\x0a\x04\x0a\x02\n\x00', self.cache.load('localhost', 50000, '0.2.3'))
+        self.cache.store('localhost', 50000, '0.2.3', b'foo')
+        self.assertEqual(b'foo', self.cache.load('localhost', 50000, '0.2.3'))
+
+    def test_entries_are_per_server_and_version(self):
+        self.cache.store('localhost', 50000, '0.2.3', b'foo')
+        self.assertIsNone(self.cache.load('localhost', 50000, '0.2.4'))
+        self.assertIsNone(self.cache.load('localhost', 50002, '0.2.3'))
+        self.assertIsNone(self.cache.load('192.168.0.1', 50000, '0.2.3'))
+        self.cache.store('fe80::1', 50000, '0.2.3', b'bar')
+        self.assertEqual(b'bar', self.cache.load('fe80::1', 50000, '0.2.3'))
+        self.assertEqual(b'foo', self.cache.load('localhost', 50000, '0.2.3'))
+
+    def test_fingerprint_mismatch(self):
+        self.cache.store('localhost', 50000, '0.2.3', b'foo')
+        path = self.cache._path('localhost', 50000, '0.2.3')
+        with open(path, 'rb') as f:
+            self.assertEqual(fingerprint(b'foo').encode('ascii') + b'\nfoo', f.read())
+        with open(path, 'wb') as f:
+            f.write(fingerprint(b'foo').encode('ascii') + b'\nfo')
+        self.assertIsNone(self.cache.load('localhost', 50000, '0.2.3'))
+
+    def test_remove(self):
+        self.cache.store('localhost', 50000, '0.2.3', b'foo')
+        self.cache.remove('localhost', 50000, '0.2.3')
+        self.assertIsNone(self.cache.load('localhost', 50000, '0.2.3'))
+        self.cache.remove('localhost', 50000, '0.2.3')
+
+if __name__ == '__main__':
+    unittest.main()
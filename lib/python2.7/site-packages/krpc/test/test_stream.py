@@ -1,4 +1,5 @@
 import unittest
+import logging
 import time
 from krpc.test.servertestcase import ServerTestCase
 
@@ -57,6 +58,41 @@ class TestStream(ServerTestCase, unittest.TestCase):
         obj = self.conn.test_service.create_test_object('bill')
         self.assertRaises(ValueError, self.conn.add_stream, setattr, obj.int_property, 42)
 
+    def test_add_stream_inside_batch_is_invalid(self):
+        with self.conn.batch():
+            self.assertRaises(RuntimeError, self.conn.add_stream, self.conn.test_service.float_to_string, 3.14159)
+
+    def test_callback(self):
+        values = []
+        with self.conn.stream(self.conn.test_service.counter) as x:
+            x.add_callback(values.append)
+            while len(values) < 3:
+                self.wait()
+            x.remove_callback(values.append)
+        self.assertLess(values[0], values[1])
+        self.assertLess(values[1], values[2])
+
+    def test_callback_error(self):
+        def fail(value):
+            raise RuntimeError('callback failed')
+        values = []
+        logger = logging.getLogger('krpc.stream')
+        disabled = logger.disabled
+        logger.disabled = True
+        try:
+            with self.conn.stream(self.conn.test_service.counter) as x:
+                x.add_callback(fail)
+                x.add_callback(values.append)
+                while len(values) < 3:
+                    self.wait()
+                # The stream thread is still running
+                count = x()
+                while x() == count:
+                    self.wait()
+        finally:
+            logger.disabled = disabled
+        self.assertLess(values[0], values[1])
+
     def test_counter(self):
         count = -1
         with self.conn.stream(self.conn.test_service.counter) as x:
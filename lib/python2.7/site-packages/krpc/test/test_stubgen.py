@@ -0,0 +1,126 @@
+import unittest
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import krpc.schema.KRPC
+import krpc.service
+import krpc.stubgen
+from krpc.test.servertestcase import ServerTestCase
+
+class TestStubGen(ServerTestCase, unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super(TestStubGen, cls).setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super(TestStubGen, cls).tearDownClass()
+
+    def setUp(self):
+        super(TestStubGen, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.path = krpc.stubgen.generate(self.conn, self.directory)
+        sys.path.insert(0, self.directory)
+        # Build the services of new clients from the stubs
+        krpc.service._schemas.clear()
+
+    def tearDown(self):
+        sys.path.remove(self.directory)
+        for name in list(sys.modules.keys()):
+            if name == 'krpc_stubs' or name.startswith('krpc_stubs.'):
+                del sys.modules[name]
+        krpc.service._schemas.clear()
+        shutil.rmtree(self.directory)
+        super(TestStubGen, self).tearDown()
+
+    def test_generate(self):
+        self.assertEqual(os.path.join(self.directory, 'krpc_stubs'), self.path)
+        self.assertEqual(set(['__init__.py', 'krpc.py', 'test_service.py']),
+                         set(filter(lambda x: x.endswith('.py'), os.listdir(self.path))))
+        import krpc_stubs
+        self.assertEqual(self.conn.krpc.get_status().version, krpc_stubs.VERSION)
+        self.assertEqual({'KRPC': 'krpc_stubs.krpc', 'TestService': 'krpc_stubs.test_service'},
+                         krpc_stubs.SERVICES)
+
+    def test_services_from_stubs(self):
+        conn = self.connect()
+        try:
+            test_service = conn.test_service
+            self.assertEqual('krpc_stubs.test_service', type(test_service)._stub)
+            self.assertEqual('3.14159', test_service.float_to_string(float(3.14159)))
+            self.assertEqual('_invoke_float_to_string', test_service.float_to_string.__code__.co_name)
+            self.assertEqual('xfoobarbaz', test_service.optional_arguments('x'))
+            self.assertEqual(test_service.TestEnum.value_c, test_service.enum_default_arg())
+            test_service.string_property = 'foo'
+            self.assertEqual('foo', test_service.string_property)
+            obj = test_service.create_test_object('bob')
+            self.assertEqual('value=bob', obj.get_value())
+            obj.int_property = 42
+            self.assertEqual(42, obj.int_property)
+            self.assertEqual('jebbobbill', test_service.TestClass.static_method('bob', 'bill'))
+            self.assertEqual(self.conn.test_service.__doc__, test_service.__doc__)
+            self.assertEqual(self.conn.test_service.TestClass.__doc__, test_service.TestClass.__doc__)
+            self.assertEqual(self.conn.test_service.float_to_string.__doc__, test_service.float_to_string.__doc__)
+            self.assertEqual(set(dir(self.conn.test_service)), set(dir(test_service)))
+            self.assertEqual(set(dir(self.conn.test_service.TestClass)), set(dir(test_service.TestClass)))
+            stream = conn.add_stream(getattr, obj, 'int_property')
+            self.assertEqual(42, stream())
+            stream.remove()
+        finally:
+            conn.close()
+
+    def test_stubs_for_other_services_are_not_used(self):
+        with open(os.path.join(self.path, '__init__.py'), 'a') as f:
+            f.write('FINGERPRINT = \'0\'\n')
+        os.remove(os.path.join(self.path, '__init__.pyc'))
+        conn = self.connect()
+        try:
+            self.assertIsNone(type(conn.test_service)._stub)
+            self.assertEqual('3.14159', conn.test_service.float_to_string(float(3.14159)))
+        finally:
+            conn.close()
+
+    def test_stub_import_fails(self):
+        with open(os.path.join(self.path, 'test_service.py'), 'w') as f:
+            f.write('def print(): pass\n')
+        os.remove(os.path.join(self.path, 'test_service.pyc'))
+        logger = logging.getLogger('krpc.service')
+        disabled = logger.disabled
+        logger.disabled = True
+        conn = self.connect()
+        try:
+            # Built at runtime instead
+            self.assertEqual('3.14159', conn.test_service.float_to_string(float(3.14159)))
+            self.assertIsNone(type(conn.test_service)._stub)
+            self.assertEqual('value=bob', conn.test_service.create_test_object('bob').get_value())
+        finally:
+            logger.disabled = disabled
+            conn.close()
+
+    def test_keyword_member_names(self):
+        services = krpc.schema.KRPC.Services()
+        service = services.services.add()
+        service.name = 'KeywordService'
+        service.classes.add().name = 'Lambda'
+        service.procedures.add(name='Print')
+        procedure = service.procedures.add(name='get_Global', has_return_type=True, return_type='string')
+        procedure.attributes.extend(['Property.Get(Global)'])
+        procedure = service.procedures.add(name='Lambda_Yield')
+        procedure.parameters.add(name='this', type='uint64')
+        procedure.attributes.extend(['Class.Method(KeywordService.Lambda,Yield)',
+                                     'ParameterType(0).Class(KeywordService.Lambda)'])
+        cls = krpc.service.Schema(services.SerializeToString()).services['KeywordService']
+        source = krpc.stubgen._service_source(cls, '0.0.0')
+        module = {}
+        exec(compile(source, 'keyword_service.py', 'exec'), module)
+        module['add_types'](cls)
+        module['add_members'](cls)
+        self.assertTrue(callable(getattr(cls, 'print')))
+        self.assertTrue(isinstance(cls.__dict__['global'], property))
+        self.assertTrue(callable(getattr(cls._schema.class_base('KeywordService', 'Lambda'), 'yield')))
+
+if __name__ == '__main__':
+    unittest.main()
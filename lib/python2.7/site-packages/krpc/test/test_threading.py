@@ -40,5 +40,10 @@ class TestThreading(ServerTestCase, unittest.TestCase):
         for thread in threads:
             thread.join()
 
+class TestThreadingReaderThread(TestThreading):
+
+    def connect(self, **kwargs):
+        return super(TestThreadingReaderThread, self).connect(reader_thread=True, **kwargs)
+
 if __name__ == '__main__':
     unittest.main()
@@ -69,6 +69,24 @@ class TestTypes(unittest.TestCase):
         typ2 = types.as_type('Class(ServiceName.ClassName)')
         self.assertEqual(typ, typ2)
 
+    def test_class_instances(self):
+        types = Types()
+        typ = types.as_type('Class(ServiceName.ClassName)')
+        instance = typ.python_type(42)
+        self.assertFalse(hasattr(instance, '__dict__'))
+        self.assertRaises(AttributeError, setattr, instance, 'foo', 1)
+        self.assertTrue(instance is typ.python_type(42))
+        self.assertFalse(instance is typ.python_type(43))
+        # Instances are only kept while referenced
+        instances = typ.python_type._instances
+        self.assertEqual(1, len(instances))
+        del instance
+        self.assertEqual(0, len(instances))
+        # Each client has its own instances
+        other_typ = Types().as_type('Class(ServiceName.ClassName)')
+        self.assertFalse(typ.python_type(42) is other_typ.python_type(42))
+        self.assertEqual(typ.python_type(42), other_typ.python_type(42))
+
     def test_list_types(self):
         types = Types()
         typ = types.as_type('List(int32)')
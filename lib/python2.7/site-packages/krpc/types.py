@@ -1,9 +1,11 @@
 import re
 import collections
-from enum import Enum
 import krpc.schema
 from krpc.attributes import Attributes
+from krpc.lazy import LazyList, LazyDict
 import importlib
+import threading
+import weakref
 
 def _parse_type_string(typ):
     """ Given a string, extract a substring up to the first comma. Parses parentheses.
@@ -65,9 +67,13 @@ class Types(object):
         and stores python types for services and service defined class and
         enumeration types. """
 
-    def __init__(self):
+    def __init__(self, schema=None, client=None):
         # Mapping from protobuf type strings to type objects
         self._types = {}
+        # The services that define class and enumeration types, and the client
+        # that class types are bound to (see krpc.service.Schema)
+        self._schema = schema
+        self._client = client
 
     def as_type(self, type_string, doc=None):
         """ Return a type object given a protocol buffer type string """
@@ -80,9 +86,11 @@ class Types(object):
         if type_string in PROTOBUF_VALUE_TYPES:
             typ = ValueType(type_string)
         elif type_string.startswith('Class(') or type_string == 'Class':
-            typ = ClassType(type_string, doc)
+            typ = ClassType(type_string, doc, self._schema, self._client)
         elif type_string.startswith('Enum(') or type_string == 'Enum':
             typ = EnumType(type_string, doc)
+            if self._schema is not None:
+                typ._python_type = self._schema.enum_type(typ._service_name, typ._enum_name)
         elif type_string.startswith('List(') or type_string == 'List':
             typ = ListType(type_string, self)
         elif type_string.startswith('Dictionary(') or type_string == 'Dictionary':
@@ -141,6 +149,11 @@ class Types(object):
             if typ.python_type._service_name == value_type._service_name and \
                typ.python_type._class_name == value_type._class_name:
                 return typ.python_type(value._object_id)
+        # Lazy collections returned by an RPC, whose items already have the correct types
+        if isinstance(value, LazyList) and isinstance(typ, ListType):
+            return typ.python_type(value)
+        if isinstance(value, LazyDict) and isinstance(typ, DictionaryType):
+            return typ.python_type(value.items())
         # Collection types
         try:
             # Coerce tuples to lists
@@ -168,6 +181,14 @@ class Types(object):
 class TypeBase(object):
     """ Base class for all type objects """
 
+    # Functions that encode and decode values of the type, compiled on first use
+    # by krpc.encoder.Encoder and krpc.decoder.Decoder
+    _encoder = None
+    _decoder = None
+    _numpy_encoder = None
+    _numpy_decoder = None
+    _lazy_decoder = None
+
     def __init__(self, protobuf_type, python_type):
         self._protobuf_type = protobuf_type
         self._python_type = python_type
@@ -208,13 +229,13 @@ class MessageType(TypeBase):
 class ClassType(TypeBase):
     """ A class type, represented by a uint64 identifier """
 
-    def __init__(self, type_string, doc):
+    def __init__(self, type_string, doc, schema=None, client=None):
         match = re.match(r'Class\(([^\.]+)\.([^\.]+)\)', type_string)
         if not match:
             raise ValueError('\'%s\' is not a valid type string for a class type' % type_string)
         service_name = match.group(1)
         class_name = match.group(2)
-        typ = _create_class_type(service_name, class_name, doc)
+        typ = _create_class_type(service_name, class_name, doc, schema, client)
         super(ClassType, self).__init__(str(type_string), typ)
 
 class EnumType(TypeBase):
@@ -298,6 +319,8 @@ class TupleType(TypeBase):
 
 class DynamicType(object):
 
+    __slots__ = ()
+
     @classmethod
     def _add_method(cls, name, func, doc=None):
         """ Add a method """
@@ -315,6 +338,15 @@ class DynamicType(object):
         setattr(cls, name, func)
         return getattr(cls, name)
 
+    @classmethod
+    def _add_class_method(cls, name, func, doc=None):
+        """ Add a class method """
+        func.__name__ = name
+        func.__doc__ = doc
+        func = classmethod(func)
+        setattr(cls, name, func)
+        return getattr(cls, name)
+
     @classmethod
     def _add_property(cls, name, getter=None, setter=None, doc=None):
         """ Add a property """
@@ -325,12 +357,26 @@ class DynamicType(object):
         return getattr(cls, name)
 
 class ClassBase(DynamicType):
-    """ Base class for service-defined class types """
+    """ Base class for service-defined class types. Instances are interned: creating
+        an instance for an object that already has one returns the existing instance,
+        for as long as it is referenced. """
 
-    _client = None
+    __slots__ = ('_object_id', '__weakref__')
 
-    def __init__(self, object_id):
-        self._object_id = object_id
+    _client = None
+    # Instances of the class, by object id. Set for each class by _create_class_type.
+    _instances = None
+
+    def __new__(cls, object_id):
+        instance = cls._instances.get(object_id)
+        if instance is None:
+            with _instances_lock:
+                instance = cls._instances.get(object_id)
+                if instance is None:
+                    instance = super(ClassBase, cls).__new__(cls)
+                    instance._object_id = object_id
+                    cls._instances[object_id] = instance
+        return instance
 
     def __eq__(self, other):
         return isinstance(other, ClassBase) and self._object_id == other._object_id
@@ -364,11 +410,20 @@ class ClassBase(DynamicType):
     def __repr__(self):
         return '<%s.%s remote object #%d>' % (self._service_name, self._class_name, self._object_id)
 
-def _create_class_type(service_name, class_name, doc):
-    return type(str(class_name), (ClassBase,),
-                {'_service_name': service_name, '_class_name': class_name, '__doc__': doc})
+_instances_lock = threading.Lock()
+
+def _create_class_type(service_name, class_name, doc, schema=None, client=None):
+    base = ClassBase
+    if schema is not None:
+        # Subclass the type shared by clients, which holds the class's members
+        base = schema.class_base(service_name, class_name)
+        doc = base.__dict__['__doc__']
+    return type(str(class_name), (base,),
+                {'_service_name': service_name, '_class_name': class_name, '__doc__': doc,
+                 '__slots__': (), '_instances': weakref.WeakValueDictionary(), '_client': client})
 
 def _create_enum_type(service_name, enum_name, values, doc):
+    from enum import Enum
     typ = Enum(str(enum_name), values)
     setattr(typ, '__doc__', doc)
     return typ
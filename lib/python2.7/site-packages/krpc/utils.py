@@ -1,11 +1,25 @@
 import re
 
-_regex_multi_uppercase = re.compile(r'([A-Z]+)([A-Z][a-z0-9])')
-_regex_single_uppercase = re.compile(r'([a-z0-9])([A-Z])')
-_regex_underscores = re.compile(r'(.)_')
+class LazyPattern(object):
+    """ A regular expression that is compiled when it is first used, rather than
+        when the module defining it is imported """
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+
+    def __getattr__(self, name):
+        # Called until the methods of the compiled expression are stored on the instance
+        compiled = re.compile(self.pattern)
+        for method in ('match', 'search', 'findall', 'sub'):
+            setattr(self, method, getattr(compiled, method))
+        return getattr(compiled, name)
+
+_regex_multi_uppercase = LazyPattern(r'([A-Z]+)([A-Z][a-z0-9])')
+_regex_single_uppercase = LazyPattern(r'([a-z0-9])([A-Z])')
+_regex_underscores = LazyPattern(r'(.)_')
 
 def snake_case(camel_case):
     """ Convert camel case to snake case, e.g. GetServices -> get_services """
-    result = re.sub(_regex_underscores, r'\1__', camel_case)
-    result = re.sub(_regex_single_uppercase, r'\1_\2', result)
-    return re.sub(_regex_multi_uppercase, r'\1_\2', result).lower()
+    result = _regex_underscores.sub(r'\1__', camel_case)
+    result = _regex_single_uppercase.sub(r'\1_\2', result)
+    return _regex_multi_uppercase.sub(r'\1_\2', result).lower()